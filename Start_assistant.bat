@@ -47,7 +47,7 @@ timeout /t 3 /nobreak >nul
 :: Проверяем доступность бэкенда каждые 3 секунды
 set "backend_checked=0"
 for /l %%i in (1,1,10) do (
-    curl -s http://localhost:8000/docs >nul 2>&1
+    curl -sf http://localhost:8000/ready >nul 2>&1
     if !errorlevel! equ 0 (
         if !backend_checked! equ 0 (
             echo [100%%] AI-сервер готов!
@@ -103,7 +103,7 @@ for /l %%i in (1,1,20) do (
     set /a "percent=%%i*5"
     echo [!percent!%%] Загрузка сервера...
     
-    curl -s http://localhost:8000/docs >nul 2>&1
+    curl -sf http://localhost:8000/ready >nul 2>&1
     if !errorlevel! equ 0 (
         echo [100%%] AI-сервер готов!
         goto backend_ready
@@ -1,26 +1,149 @@
+import asyncio
 import logging
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from contextlib import aclosing, asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import json
-import requests
+from typing import Optional
 import os
+import shutil
 import uuid
-from rag_system.rag_service import RAGService
-from fastapi.responses import StreamingResponse
+from rag_system import profiling
+from rag_system.components.llm.router import NoBackendAvailable, OllamaRouter
+from rag_system.components.llm.model_provisioner import ModelProvisioner
+from rag_system.components.llm.scheduler import GenerationScheduler, Priority, SchedulerOverloaded
+from rag_system.health import HealthMonitor
+from rag_system.query_registry import QueryCancelled, QueryRegistry
+from rag_system.service_loader import RAGServiceLoader, ServiceNotReady
+from rag_system.tracing import start_trace_logging, stop_trace_logging
+from rag_system.utils import metrics, resilience
+from rag_system.utils.loop_lag import monitor_event_loop_lag
+from rag_system.utils.sse import SSECoalescer
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Corporate AI Assistant API")
+# RAG сервис (llama-index, Chroma, модель эмбеддингов) загружается в фоне из lifespan,
+# чтобы порт открывался сразу. Тяжелые модули импортирует только загрузчик.
+rag_loader = RAGServiceLoader()
+sse_coalescer = SSECoalescer()
+query_registry = QueryRegistry()
+
+# Модель для общих ответов /api/chat без базы знаний
+CHAT_MODEL = "qwen2.5:0.5b"
+# Число воркеров uvicorn. Индекс у воркеров общий (rag_system/index_server.py),
+# а сессии диалога, реестр запросов и очередь генераций - у каждого свои
+API_WORKERS = max(1, int(os.getenv("API_WORKERS", "1")))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Создает общий HTTP клиент Ollama и планировщик генераций на время жизни приложения"""
+    # Трассы запросов пишет отдельный поток, запрос только кладет строку в очередь
+    trace_listener = start_trace_logging()
+    # Один или несколько инстансов Ollama (OLLAMA_BACKENDS) за балансировщиком
+    ollama_client = OllamaRouter.from_env()
+    # Лимиты LLM_MAX_IN_FLIGHT и LLM_MAX_QUEUE - на весь сервер, делим их между воркерами
+    scheduler = GenerationScheduler(backends_for=ollama_client.backend_count, workers=API_WORKERS)
+    app.state.ollama_client = ollama_client
+    app.state.scheduler = scheduler
+    app.state.provisioners = []
+    ollama_client.start_health_checks()
+    # /health отдает результаты фоновых проверок, а не опрашивает зависимости на каждый запрос
+    health = HealthMonitor()
+    health.register("ollama", ollama_client.tags)
+    app.state.health = health
+    background_tasks = []
+
+    def attach(rag_service):
+        rag_service.llm_client = ollama_client
+        rag_service.scheduler = scheduler
+        # Проверка Ollama, докачка и прогрев моделей идут в фоне, на каждом инстансе
+        required_models = rag_service.cascade.models + [CHAT_MODEL]
+        provisioners = [
+            ModelProvisioner(client, models=ollama_client.models_for(client, required_models))
+            for client in ollama_client.clients
+        ]
+        app.state.provisioners = provisioners
+        background_tasks.extend(asyncio.create_task(p.run()) for p in provisioners)
+        health.register(
+            "knowledge_base", lambda: asyncio.to_thread(rag_service.get_knowledge_base_stats)
+        )
+
+    health.start()
+
+    rag_loader.on_ready(attach)
+    background_tasks.append(asyncio.create_task(rag_loader.load()))
+    background_tasks.append(asyncio.create_task(monitor_event_loop_lag()))
+    try:
+        yield
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await health.aclose()
+        if rag_loader.service is not None:
+            rag_loader.service.llm_client = None
+            # Несохраненные изменения индекса - на диск до выхода
+            await asyncio.to_thread(rag_loader.service.close)
+        await ollama_client.aclose()
+        stop_trace_logging(trace_listener)
+
+app = FastAPI(title="Corporate AI Assistant API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Query-ID", "X-Profile-ID"],
 )
+# Профиль отдельного запроса (X-Profile: 1) - только при PROFILING_ENABLED=1,
+# без флага middleware не добавляется вовсе
+if profiling.PROFILING_ENABLED:
+    app.add_middleware(profiling.RequestProfilerMiddleware)
+
+@app.exception_handler(SchedulerOverloaded)
+async def scheduler_overloaded_handler(request: Request, exc: SchedulerOverloaded):
+    """Быстрый отказ при перегрузке очереди генераций"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(ServiceNotReady)
+async def service_not_ready_handler(request: Request, exc: ServiceNotReady):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "loading": rag_loader.status()},
+        headers={"Retry-After": "2"},
+    )
+
+@app.exception_handler(resilience.CircuitOpen)
+async def circuit_open_handler(request: Request, exc: resilience.CircuitOpen):
+    """Зависимость недоступна - отказ сразу, без ожидания таймаутов"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(round(exc.retry_after))},
+    )
 
-rag_service = RAGService()
+@app.exception_handler(NoBackendAvailable)
+async def no_backend_handler(request: Request, exc: NoBackendAvailable):
+    """Все инстансы Ollama выведены из ротации"""
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+def require_single_worker(feature: str) -> None:
+    """Сессии и отмена по id живут в памяти воркера: следующий запрос может попасть в другой"""
+    if API_WORKERS > 1:
+        raise HTTPException(
+            status_code=501,
+            detail=f"{feature} is not available with API_WORKERS > 1",
+        )
+
+def request_priority(http_request: Request, default: Priority) -> Priority:
+    """Приоритет из заголовка X-Priority (interactive / normal / batch)"""
+    return Priority.parse(http_request.headers.get("X-Priority"), default)
 
 class GenerateRequest(BaseModel):
     model: str              # Name of the model to be used
@@ -29,6 +152,8 @@ class GenerateRequest(BaseModel):
 
 class RAGQueryRequest(BaseModel):
     question: str
+    session_id: Optional[str] = None   # ID сессии диалога для уточняющих вопросов
+    query_id: Optional[str] = None     # ID запроса для отмены, по умолчанию генерируется сервером
 
 @app.get("/")
 async def root():
@@ -40,124 +165,196 @@ async def get_docs():
     return {"message": "Visit /docs for Swagger UI"}
 
 @app.post("/generate")
-async def generate_full(request: GenerateRequest):
+async def generate_full(request: GenerateRequest, http_request: Request):
     """Оригинальный эндпоинт для генерации через Ollama"""
-    url = "http://localhost:11434/api/generate"    
-    headers = {"Content-Type": "application/json"}  
     data = {
         "model": request.model,     
         "prompt": request.prompt,   
         "stream": request.stream    
     }
+    scheduler = app.state.scheduler
 
-    response = requests.post(url, headers=headers, data=json.dumps(data), stream=True)
-    
-    raw_response = ""
-    for line in response.iter_lines():
-        if line:
-            raw_response += line.decode('utf-8') + "\n"     
+    if request.stream:
+        ticket = await scheduler.acquire(request.model, request_priority(http_request, Priority.INTERACTIVE))
 
-    return raw_response
+        # Пробрасываем NDJSON от Ollama клиенту по мере генерации
+        async def relay():
+            try:
+                async with aclosing(app.state.ollama_client.stream_lines("/api/generate", data)) as lines:
+                    async for line in lines:
+                        yield line + "\n"
+            finally:
+                scheduler.release(ticket)
+
+        # Если клиент отключился до первого чанка, relay() не запустится и его
+        # finally не вернет слот - это сделает фоновая задача ответа
+        # (повторный release ничего не делает)
+        return StreamingResponse(
+            relay(), media_type="application/x-ndjson", background=BackgroundTask(scheduler.release, ticket)
+        )
+
+    raw_parts = []
+    async with scheduler.slot(request.model, request_priority(http_request, Priority.NORMAL)):
+        async for line in app.state.ollama_client.stream_lines("/api/generate", data):
+            raw_parts.append(line)
+
+    return "\n".join(raw_parts) + "\n" if raw_parts else ""
 
 @app.post("/generate_formatted")
-async def generate_formatted(request: GenerateRequest):
+async def generate_formatted(request: GenerateRequest, http_request: Request):
     """Оригинальный эндпоинт для форматированной генерации"""
-    url = "http://localhost:11434/api/generate"    
-    headers = {"Content-Type": "application/json"}  
     data = {
         "model": request.model,     
         "prompt": request.prompt,   
-        "stream": request.stream   
+        "stream": request.stream    
     }
+    scheduler = app.state.scheduler
 
-    response = requests.post(url, headers=headers, data=json.dumps(data), stream=True)
-    
-    formatted_response = ""
-    for line in response.iter_lines():
-        if line:
+    if request.stream:
+        ticket = await scheduler.acquire(request.model, request_priority(http_request, Priority.INTERACTIVE))
+
+        # Отдаем только текст ответа, без служебных полей Ollama
+        async def relay():
             try:
-                json_line = json.loads(line.decode('utf-8'))        
-                if "response" in json_line:
-                    formatted_response += json_line["response"]     
-            except json.JSONDecodeError:
-                continue
+                started = False
+                async with aclosing(app.state.ollama_client.stream("/api/generate", data)) as chunks:
+                    async for json_line in chunks:
+                        text = json_line.get("response")
+                        if not started and text:
+                            # как и в буферизованном режиме, убираем ведущие пробелы
+                            text = text.lstrip()
+                            started = bool(text)
+                        if text:
+                            yield text
+                yield "\n"
+            finally:
+                scheduler.release(ticket)
+
+        # Если клиент отключился до первого чанка, relay() не запустится и его
+        # finally не вернет слот - это сделает фоновая задача ответа
+        # (повторный release ничего не делает)
+        return StreamingResponse(
+            relay(), media_type="text/plain; charset=utf-8", background=BackgroundTask(scheduler.release, ticket)
+        )
+
+    response_parts = []
+    async with scheduler.slot(request.model, request_priority(http_request, Priority.NORMAL)):
+        async for json_line in app.state.ollama_client.stream("/api/generate", data):
+            if "response" in json_line:
+                response_parts.append(json_line["response"])
     
-    formatted_response = formatted_response.strip() + "\n"
+    formatted_response = "".join(response_parts).strip() + "\n"
     
     return {"response": formatted_response}
 
 # ==================== RAG ====================
 
-@app.post("/api/rag/upload")
-async def rag_upload_document(file: UploadFile = File(...)):
-    """Загрузка документа в RAG систему (базу знаний компании)"""
-    temp_filename = None
+ALLOWED_EXTENSIONS = ['.pdf', '.docx', '.txt', '.md', '.json']
+
+async def ingest_upload(rag_service, file: UploadFile, doc_id: Optional[str] = None) -> dict:
+    """Сохраняет загруженный файл во временную папку и добавляет его в базу знаний"""
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    if file_extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"File type {file_extension} not supported. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
+    
+    temp_dir = "./temp_documents"
+    os.makedirs(temp_dir, exist_ok=True)
+    temp_filename = f"{temp_dir}/temp_{uuid.uuid4()}{file_extension}"
     try:
-        allowed_extensions = ['.pdf', '.docx', '.txt', '.md', '.json']
-        file_extension = os.path.splitext(file.filename)[1].lower()
-        
-        if file_extension not in allowed_extensions:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"File type {file_extension} not supported. Allowed: {', '.join(allowed_extensions)}"
-            )
-        
-        temp_dir = "./temp_documents"
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        temp_filename = f"{temp_dir}/temp_{uuid.uuid4()}{file_extension}"
-        
         with open(temp_filename, "wb") as f:
             content = await file.read()
             f.write(content)
         
         logger.info(f"Starting ingestion of {file.filename}")
-        result = rag_service.add_document(temp_filename)
-        
+        result = await asyncio.to_thread(rag_service.add_document, temp_filename, doc_id, file.filename)
+    finally:
         # Очищаем временный файл ВНЕ зависимости от результата
         try:
-            if temp_filename and os.path.exists(temp_filename):
+            if os.path.exists(temp_filename):
                 os.remove(temp_filename)
                 logger.info(f"Cleaned up temporary file: {temp_filename}")
         except Exception as cleanup_error:
             logger.warning(f"Could not remove temp file {temp_filename}: {cleanup_error}")
-        
-        if not result.get("success", False):
-            raise HTTPException(status_code=500, detail=result.get("message", "Unknown error"))
-        
+    
+    if not result.get("success", False):
+        raise HTTPException(status_code=500, detail=result.get("message", result.get("error", "Unknown error")))
+    return result
+
+@app.post("/api/rag/upload")
+async def rag_upload_document(file: UploadFile = File(...)):
+    """Загрузка документа в RAG систему (базу знаний компании)"""
+    rag_service = rag_loader.get()
+    try:
+        result = await ingest_upload(rag_service, file)
         return {
             "success": True,
             "filename": file.filename,
             "message": "Document successfully added to corporate knowledge base",
-            "document_id": str(uuid.uuid4())
+            "document_id": result["document_id"]
         }
-        
     except HTTPException:
-        # Всегда очищаем временный файл даже при исключениях
-        if temp_filename and os.path.exists(temp_filename):
-            try:
-                os.remove(temp_filename)
-            except:
-                pass
         raise
     except Exception as e:
-        # Всегда очищаем временный файл даже при исключениях
-        if temp_filename and os.path.exists(temp_filename):
-            try:
-                os.remove(temp_filename)
-            except:
-                pass
         logger.error(f"Upload error for {file.filename}: {e}")
         raise HTTPException(status_code=500, detail=f"Upload error: {str(e)}")
 
+@app.get("/api/rag/documents")
+async def list_documents(limit: int = 50, cursor: Optional[int] = None):
+    """Список документов базы знаний постранично: cursor берется из next_cursor предыдущей страницы"""
+    rag_service = rag_loader.get()
+    limit = max(1, min(limit, 500))
+    return await asyncio.to_thread(rag_service.list_documents, limit, cursor)
+
+@app.get("/api/rag/documents/{doc_id}")
+async def get_document(doc_id: str):
+    """Документ базы знаний: имя файла, число фрагментов, время загрузки"""
+    rag_service = rag_loader.get()
+    document = await asyncio.to_thread(rag_service.get_document, doc_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document
+
+@app.put("/api/rag/documents/{doc_id}")
+async def replace_document(doc_id: str, file: UploadFile = File(...)):
+    """Замена документа новой версией файла с сохранением document_id"""
+    rag_service = rag_loader.get()
+    if await asyncio.to_thread(rag_service.get_document, doc_id) is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    try:
+        await ingest_upload(rag_service, file, doc_id=doc_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Replace error for document {doc_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Replace error: {str(e)}")
+    return {
+        "success": True,
+        "document_id": doc_id,
+        "document": await asyncio.to_thread(rag_service.get_document, doc_id),
+    }
+
+@app.delete("/api/rag/documents/{doc_id}")
+async def delete_document(doc_id: str):
+    """Удаление документа и всех его фрагментов из базы знаний"""
+    rag_service = rag_loader.get()
+    if not await asyncio.to_thread(rag_service.delete_document, doc_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"success": True, "document_id": doc_id}
+
 @app.post("/api/rag/query")
-async def rag_query(request: RAGQueryRequest):
+async def rag_query(request: RAGQueryRequest, http_request: Request):
     """Запрос к базе знаний компании"""
+    rag_service = rag_loader.get()
     try:
         if not request.question or not request.question.strip():
             raise HTTPException(status_code=400, detail="Question cannot be empty")
         
-        result = rag_service.query_documents(request.question.strip())
+        result = await rag_service.query_documents(
+            request.question.strip(), request_priority(http_request, Priority.NORMAL)
+        )
         
         if "error" in result:
             raise HTTPException(status_code=500, detail=result["error"])
@@ -165,43 +362,150 @@ async def rag_query(request: RAGQueryRequest):
         return {
             "question": request.question,
             "answer": result.get("answer", "No answer generated"),
+            "model": result.get("model"),
             "sources_used": result.get("sources_used", 0),
             "sources": result.get("sources_preview", []),
             "context_length": result.get("context_length", 0)
         }
         
-    except HTTPException:
+    except (HTTPException, SchedulerOverloaded, resilience.CircuitOpen):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Query error: {str(e)}")
 
-@app.post("/api/rag/query/stream")
-async def rag_query_stream(request: RAGQueryRequest):
-    """Streaming запрос к базе знаний компании"""
+async def rag_event_stream(chunks, http_request: Request, query_id: Optional[str] = None) -> StreamingResponse:
+    """SSE ответ RAG сервиса.
+
+    Первый чанк получаем до отправки заголовков: так отказ планировщика
+    превращается в 429/503 с Retry-After, а не в ошибку внутри потока.
+    Токены склеиваются в события SSECoalescer (см. rag_system/utils/sse.py).
+    Запрос регистрируется под query_id (заголовок X-Query-ID) и прерывается
+    через /api/rag/query/{query_id}/cancel или при отключении клиента.
+    """
+    try:
+        handle = query_registry.register(query_id)
+    except ValueError as e:
+        await chunks.aclose()
+        raise HTTPException(status_code=409, detail=str(e))
+    headers = {
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "X-Query-ID": handle.query_id,
+    }
+    cancelled_chunk = {"type": "cancelled", "query_id": handle.query_id, "done": True}
+
+    try:
+        first_chunk = await handle.run(chunks.__anext__())
+    except StopAsyncIteration:
+        first_chunk = None
+    except QueryCancelled:
+        # Отменили, пока запрос ждал в очереди
+        query_registry.finish(handle)
+        return StreamingResponse(
+            iter([sse_coalescer.frame(cancelled_chunk)]), media_type="text/event-stream", headers=headers
+        )
+    except BaseException:
+        query_registry.finish(handle)
+        raise
+
+    async def client_gone() -> bool:
+        if await http_request.is_disconnected():
+            handle.cancel("disconnect")
+            return True
+        return False
+
     async def generate():
+        frames = sse_coalescer.stream(chunks, client_gone, handle.cancelled)
+        finished = False
         try:
+            if first_chunk is not None:
+                yield sse_coalescer.frame(first_chunk)
             # Получаем streaming ответ от RAG сервиса
-            for chunk in rag_service.query_documents_stream(request.question):
-                yield f"data: {json.dumps(chunk)}\n\n"
+            async for frame in frames:
+                yield frame
+            finished = True
+            if handle.reason == "client":
+                yield sse_coalescer.frame(cancelled_chunk)
                 
         except Exception as e:
+            finished = True
             error_chunk = {"type": "error", "content": f"Ошибка: {str(e)}"}
-            yield f"data: {json.dumps(error_chunk)}\n\n"
+            yield sse_coalescer.frame(error_chunk)
+        finally:
+            if not finished:
+                # Сервер закрыл поток, потому что запись в сокет не удалась
+                handle.cancel("disconnect")
+            # Освобождаем модель и слот планировщика сразу, не дожидаясь
+            # сборщика мусора: закрытие доходит до HTTP запроса к Ollama
+            await frames.aclose()
+            await chunks.aclose()
+            query_registry.finish(handle)
     
     return StreamingResponse(
         generate(), 
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
+        headers=headers,
+    )
+
+@app.post("/api/rag/query/stream")
+async def rag_query_stream(request: RAGQueryRequest, http_request: Request):
+    """Streaming запрос к базе знаний компании"""
+    rag_service = rag_loader.get()
+    priority = request_priority(http_request, Priority.INTERACTIVE)
+    if request.session_id:
+        require_single_worker("Chat sessions")
+        session = rag_service.sessions.get(request.session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Chat session not found or expired")
+        return await rag_event_stream(
+            rag_service.query_session_stream(session, request.question, priority),
+            http_request,
+            request.query_id,
+        )
+    return await rag_event_stream(
+        rag_service.query_documents_stream(request.question, priority), http_request, request.query_id
     )
 
+@app.post("/api/rag/query/{query_id}/cancel")
+async def cancel_rag_query(query_id: str):
+    """Остановить генерацию ответа (кнопка "стоп")"""
+    require_single_worker("Query cancellation")
+    if not query_registry.cancel(query_id, "client"):
+        raise HTTPException(status_code=404, detail="Query not found or already finished")
+    return {"success": True, "query_id": query_id}
+
+@app.post("/api/rag/sessions")
+async def create_chat_session():
+    """Создать сессию диалога для уточняющих вопросов"""
+    require_single_worker("Chat sessions")
+    rag_service = rag_loader.get()
+    session = rag_service.create_session()
+    return {"session_id": session.session_id, "ttl_seconds": rag_service.sessions.ttl_seconds}
+
+@app.delete("/api/rag/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    """Завершить сессию диалога"""
+    require_single_worker("Chat sessions")
+    if not rag_loader.get().sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Chat session not found or expired")
+    return {"success": True, "session_id": session_id}
+
+@app.get("/api/rag/sessions")
+async def chat_sessions_stats():
+    """Статистика активных сессий диалога"""
+    require_single_worker("Chat sessions")
+    return rag_loader.get().sessions.stats()
+
 @app.get("/api/rag/stats")
 async def rag_stats():
     """Статистика базы знаний компании"""
+    rag_service = rag_loader.get()
     try:
-        stats = rag_service.get_knowledge_base_stats()
+        # Последняя фоновая проверка /health; в многопроцессном режиме запрос
+        # к процессу индекса ждал бы замка записи
+        stats = app.state.health.detail("knowledge_base")
+        if stats is None:
+            stats = await asyncio.to_thread(rag_service.get_knowledge_base_stats)
         return {
             "knowledge_base_status": "active",
             "statistics": stats
@@ -209,17 +513,68 @@ async def rag_stats():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Stats error: {str(e)}")
 
+@app.post("/api/rag/flush")
+async def rag_flush():
+    """Сохранить индекс на диск сейчас (обычно он сохраняется группами записей)"""
+    rag_service = rag_loader.get()
+    await asyncio.to_thread(rag_service.flush_knowledge_base)
+    stats = await asyncio.to_thread(rag_service.get_knowledge_base_stats)
+    return {"success": True, "statistics": stats}
+
+@app.get("/api/rag/snapshot")
+async def rag_snapshot_export():
+    """Снимок базы знаний (тексты, метаданные, векторы) для переноса на другую площадку"""
+    rag_service = rag_loader.get()
+    os.makedirs("./temp_documents", exist_ok=True)
+    snapshot_path = f"./temp_documents/snapshot_{uuid.uuid4()}.zip"
+    try:
+        manifest = await asyncio.to_thread(rag_service.export_knowledge_base, snapshot_path)
+    except Exception as e:
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+        raise HTTPException(status_code=500, detail=f"Snapshot export error: {str(e)}")
+    return FileResponse(
+        snapshot_path,
+        media_type="application/zip",
+        filename=f"kb-snapshot-{manifest['created_at'][:10]}.zip",
+        background=BackgroundTask(os.remove, snapshot_path),
+    )
+
+@app.post("/api/rag/snapshot")
+async def rag_snapshot_import(file: UploadFile = File(...), replace: bool = False):
+    """Загрузка снимка базы знаний без пересчета эмбеддингов"""
+    from rag_system.snapshot import SnapshotError
+
+    rag_service = rag_loader.get()
+    os.makedirs("./temp_documents", exist_ok=True)
+    snapshot_path = f"./temp_documents/snapshot_{uuid.uuid4()}.zip"
+    try:
+        with open(snapshot_path, "wb") as f:
+            # Снимок может быть на гигабайты - копируем потоком
+            await asyncio.to_thread(shutil.copyfileobj, file.file, f, 1024 * 1024)
+        result = await asyncio.to_thread(rag_service.import_knowledge_base, snapshot_path, replace)
+        return {"success": True, "snapshot": result}
+    except SnapshotError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Snapshot import error: {str(e)}")
+    finally:
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+
 # ==================== CHAT ====================
 
 @app.post("/api/chat") # Сейчас не используется
-async def chat_with_assistant(request: RAGQueryRequest):
+async def chat_with_assistant(request: RAGQueryRequest, http_request: Request):
     """Умный чат с ассистентом (использует базу знаний когда возможно)"""
+    rag_service = rag_loader.get()
+    priority = request_priority(http_request, Priority.NORMAL)
     try:
         # Определяем, стоит ли использовать RAG для этого вопроса
-        use_rag = should_use_rag(request.question)
+        intent = await rag_service.intent_router.route(request.question)
         
-        if use_rag:
-            result = rag_service.query_documents(request.question)
+        if intent.use_rag:
+            result = await rag_service.query_documents(request.question, priority)
             if result.get("sources_used", 0) > 0:
                 return {
                     "type": "rag_response",
@@ -231,89 +586,206 @@ async def chat_with_assistant(request: RAGQueryRequest):
                 }
         
         # Если RAG не подошел или нет документов, используем обычную генерацию
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={
-                "model": "qwen2.5:0.5b",
+        async with app.state.scheduler.slot(CHAT_MODEL, priority):
+            response = await app.state.ollama_client.generate({
+                "model": CHAT_MODEL,
                 "prompt": f"Ты корпоративный AI-ассистент. Ответь на вопрос: {request.question}",
-                "stream": False
-            }
-        )
+            })
         
         return {
             "type": "general_response",
             "question": request.question,
-            "answer": response.json().get("response", "No response generated"),
+            "answer": response.get("response", "No response generated"),
             "context_based": False
         }
         
+    except (SchedulerOverloaded, resilience.CircuitOpen):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
 
 @app.post("/api/chat/stream") # Сейчас не используется
-async def chat_stream(request: RAGQueryRequest):
+async def chat_stream(request: RAGQueryRequest, http_request: Request):
     """Streaming чат с ассистентом"""
-    async def generate():
-        try:
-            # Получаем streaming ответ от RAG сервиса
-            for chunk in rag_service.query_documents_stream(request.question):
-                yield f"data: {json.dumps(chunk)}\n\n"
-                
-        except Exception as e:
-            error_chunk = {"type": "error", "content": f"Ошибка: {str(e)}"}
-            yield f"data: {json.dumps(error_chunk)}\n\n"
-    
-    return StreamingResponse(
-        generate(), 
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
+    return await rag_event_stream(
+        rag_loader.get().query_documents_stream(request.question, request_priority(http_request, Priority.INTERACTIVE)),
+        http_request,
+        request.query_id,
     )
 
 # ==================== HEALTH & UTILS ====================
 
 @app.get("/health")
 async def health_check():
-    """Проверка статуса всех компонентов системы"""
-    try:
-        ollama_response = requests.get("http://localhost:11434/api/tags")
-        ollama_ok = ollama_response.status_code == 200
-        
-        rag_stats = rag_service.get_knowledge_base_stats()
-        rag_ok = "error" not in rag_stats
-        
+    """Статус всех компонентов системы по последним фоновым проверкам"""
+    health = app.state.health
+    ollama_status = health.status("ollama")
+    checks = health.snapshot()
+    # Автоматы защиты этого воркера; автомат Chroma в многопроцессном режиме - в статистике базы знаний
+    breakers = resilience.breaker_states()
+
+    if rag_loader.service is None:
+        # Сервер уже отвечает, база знаний еще загружается
         return {
-            "status": "healthy" if ollama_ok and rag_ok else "degraded",
+            "status": "starting" if rag_loader.state != "error" else "degraded",
             "components": {
-                "ollama": "healthy" if ollama_ok else "unavailable",
-                "rag_system": "healthy" if rag_ok else "degraded",
-                "knowledge_base_documents": rag_stats.get("document_count", 0)
-            }
+                "ollama": ollama_status,
+                "rag_system": rag_loader.state,
+                "knowledge_base_documents": 0
+            },
+            "checks": checks,
+            "circuit_breakers": breakers,
+            "loading": rag_loader.status()
         }
-    except Exception as e:
-        return {
-            "status": "unhealthy",
-            "error": str(e)
+
+    rag_stats = health.detail("knowledge_base") or {}
+    rag_status = health.status("knowledge_base")
+    if rag_status == "healthy" and "error" in rag_stats:
+        rag_status = "degraded"
+    breakers = {**rag_stats.get("circuit_breakers", {}), **breakers}
+    breakers_closed = all(b["state"] == "closed" for b in breakers.values())
+
+    return {
+        "status": "healthy" if ollama_status == "healthy" and rag_status == "healthy" and breakers_closed else "degraded",
+        "components": {
+            "ollama": ollama_status,
+            "rag_system": rag_status,
+            "knowledge_base_documents": rag_stats.get("document_count", 0)
+        },
+        "checks": checks,
+        "circuit_breakers": breakers,
+        "knowledge_base": {
+            key: rag_stats[key]
+            for key in ("documents", "chunks", "bytes", "disk_bytes", "embedding_dimension", "index_version")
+            if key in rag_stats
         }
+    }
 
-def should_use_rag(question: str) -> bool:
-    """Определяет, стоит ли использовать RAG для данного вопроса"""
-    question_lower = question.lower()
-    
-    # Ключевые слова, которые указывают на вопросы о процессах компании
-    rag_keywords = [
-        'как оформить', 'процедура', 'инструкция', 'документ', 'шаблон',
-        'регламент', 'политика', 'правила', 'требования', 'стандарт',
-        'компании', 'организации', 'корпоративный', 'внутренний',
-        'командировка', 'отпуск', 'увольнение', 'прием', 'договор',
-        'отчет', 'заявка', 'согласование', 'подписание'
-    ]
-    
-    return any(keyword in question_lower for keyword in rag_keywords)
+@app.get("/ready")
+async def readiness_check():
+    """Готовность к запросам: база знаний загружена, модели скачаны, прогреты и загружены в память Ollama"""
+    hot_models = set()
+    provisioning = {}
+    for provisioner in app.state.provisioners:
+        url = provisioner.llm_client.base_url
+        provisioning[url] = provisioner.status()
+        try:
+            loaded_models = await provisioner.loaded_models()
+        except Exception as e:
+            logger.warning(f"Could not list loaded Ollama models on {url}: {e}")
+            continue
+        hot_models.update(
+            model for model, status in provisioner.models.items()
+            if status.state == "ready" and model in loaded_models
+        )
+
+    # Модель готова, если она горячая хотя бы на одном инстансе
+    required_models = {m for p in app.state.provisioners for m in p.models}
+    models_ready = bool(required_models) and required_models <= hot_models
+    ready = models_ready and rag_loader.state == "ready"
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "rag_service": rag_loader.status(),
+            "hot_models": sorted(hot_models),
+            "provisioning": provisioning,
+        },
+    )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus: стадии RAG, вызовы Ollama, загрузка документов"""
+    index_metrics = {}
+    if rag_loader.service is not None:
+        try:
+            # В многопроцессном режиме поиск и загрузка идут в процессе индекса
+            index_metrics = await asyncio.to_thread(rag_loader.service.index_metrics)
+        except Exception as e:
+            logger.warning(f"Index process metrics unavailable: {e}")
+    return PlainTextResponse(metrics.render(index_metrics), media_type="text/plain; version=0.0.4")
+
+# ==================== PROFILING ====================
+
+def require_profiling(http_request: Request) -> None:
+    """/admin/profile* есть только при PROFILING_ENABLED=1; токен - если задан PROFILING_TOKEN"""
+    if not profiling.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiling.token_allowed(http_request.headers.get("X-Profile-Token")):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+@app.post("/admin/profile/start")
+async def start_sampling_profile(http_request: Request, seconds: float = 30, interval_ms: float = 5):
+    """Сэмплирующий профиль этого воркера на seconds секунд (collapsed stacks для flamegraph)"""
+    require_profiling(http_request)
+    try:
+        return profiling.start_sampling(seconds, interval_ms / 1000)
+    except profiling.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/admin/profile/stop")
+async def stop_sampling_profile(http_request: Request):
+    """Остановить сэмплирование досрочно и записать профиль"""
+    require_profiling(http_request)
+    status = await asyncio.to_thread(profiling.stop_sampling)
+    if status is None:
+        raise HTTPException(status_code=404, detail="No sampling profile was started")
+    return status
+
+@app.get("/admin/profile")
+async def profiling_status(http_request: Request):
+    require_profiling(http_request)
+    return {
+        "sampling": profiling.sampling_status(),
+        "ingest_allocations": profiling.PROFILE_INGEST_ALLOCATIONS,
+        "profiles": await asyncio.to_thread(profiling.list_profiles),
+    }
+
+@app.get("/admin/profile/{name}")
+async def download_profile(name: str, http_request: Request, format: Optional[str] = None, limit: int = 40):
+    """Файл профиля; format=text - сводка pstats для .prof"""
+    require_profiling(http_request)
+    path = profiling.profile_file(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "text" and path.suffix == ".prof":
+        return PlainTextResponse(await asyncio.to_thread(profiling.format_cprofile, path, limit))
+    return FileResponse(path, filename=name)
+
+@app.get("/api/llm/models")
+async def llm_models():
+    """Прогресс скачивания и прогрева моделей по инстансам Ollama"""
+    return {p.llm_client.base_url: p.status() for p in app.state.provisioners}
+
+@app.get("/api/llm/stats")
+async def llm_stats():
+    """Загрузка пула соединений к Ollama и очереди генераций"""
+    rag_service = rag_loader.service
+    return {
+        "ollama_pool": app.state.ollama_client.pool_stats(),
+        "scheduler": app.state.scheduler.stats(),
+        "cascade": rag_service.cascade.stats() if rag_service else None,
+        "streaming": sse_coalescer.stats(),
+        "queries": query_registry.stats(),
+        "intent_router": rag_service.intent_router.stats() if rag_service else None,
+        "embedding": rag_service.ingest_component.embedding_stats() if rag_service else None,
+    }
 
 if __name__ == "__main__":
+    import multiprocessing
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    multiprocessing.freeze_support()
+    # API_WORKERS > 1: модель эмбеддингов и Chroma в одном процессе индекса,
+    # воркеры uvicorn обращаются к нему (rag_system/index_server.py).
+    # Сессии диалога и отмена запроса по id в этом режиме отключены (501)
+    if API_WORKERS > 1:
+        from rag_system.index_server import start_index_process
+        index_process = start_index_process()
+        try:
+            uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=API_WORKERS)
+        finally:
+            index_process.terminate()
+            index_process.join(timeout=10)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from llama_index.core.llms import ChatMessage, MessageRole
+
+from .components.llm.prompt_helper import IncrementalPromptRenderer, get_prompt_style
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL_SECONDS = float(os.getenv("CHAT_SESSION_TTL", "1800"))
+SESSION_MAX_COUNT = int(os.getenv("CHAT_SESSION_MAX_COUNT", "1000"))
+SESSION_MAX_MEMORY_MB = float(os.getenv("CHAT_SESSION_MAX_MEMORY_MB", "256"))
+# Окно контекста модели (передается Ollama как num_ctx) и длина ответа.
+# История сессии обрезается так, чтобы промпт и ответ помещались в окно:
+# иначе Ollama молча отбросит начало диалога вместе с системным промптом
+SESSION_NUM_CTX = int(os.getenv("CHAT_SESSION_NUM_CTX", "4096"))
+SESSION_NUM_PREDICT = int(os.getenv("CHAT_SESSION_NUM_PREDICT", "400"))
+# Оценка без токенизатора: у qwen2.5 на русском тексте около 3 символов на
+# токен, берем с запасом
+SESSION_CHARS_PER_TOKEN = float(os.getenv("CHAT_SESSION_CHARS_PER_TOKEN", "2.5"))
+# Служебные токены шаблона на одно сообщение (<|im_start|>role ... <|im_end|>)
+_MESSAGE_OVERHEAD_TOKENS = 5
+# Шаблон промпта модели, для qwen2.5 это ChatML
+SESSION_PROMPT_STYLE = os.getenv("CHAT_SESSION_PROMPT_STYLE", "chatml")
+
+
+# Промпт уже отрендерен по шаблону модели, поэтому шаблон Ollama подменяем на
+# "как есть". raw не подходит: в raw режиме Ollama не возвращает context и
+# игнорирует переданный, а без шаблона возвращает и подставляет его текст
+# перед новым промптом
+_PASSTHROUGH_TEMPLATE = "{{ .Prompt }}"
+
+
+def estimate_tokens(message: ChatMessage) -> int:
+    return int(len(message.content or "") / SESSION_CHARS_PER_TOKEN) + _MESSAGE_OVERHEAD_TOKENS
+
+
+class ChatSession:
+    """История диалога с закэшированным промптом и контекстом Ollama"""
+
+    def __init__(
+        self,
+        session_id: str,
+        system_prompt: str,
+        prompt_style: str = SESSION_PROMPT_STYLE,
+        token_budget: int = SESSION_NUM_CTX - SESSION_NUM_PREDICT,
+    ):
+        self.session_id = session_id
+        # Сколько токенов может занять промпт, чтобы ответ еще поместился в num_ctx
+        self.token_budget = token_budget
+        self.messages: List[ChatMessage] = [
+            ChatMessage(role=MessageRole.SYSTEM, content=system_prompt)
+        ]
+        self.renderer = IncrementalPromptRenderer(get_prompt_style(prompt_style, incremental=True))
+        # Токены, которые Ollama вернула в поле context после прошлого ответа.
+        # array вместо list: в несколько раз меньше памяти на токен
+        self.ollama_context: Optional[array] = None
+        self.context_model: Optional[str] = None
+        self.created_at = time.monotonic()
+        self.last_access = self.created_at
+        self.turns = 0
+        self.trimmed_turns = 0
+        self.lock = asyncio.Lock()
+        self._checkpoint = self.renderer.snapshot()
+
+    def build_prompt(self, user_message: str, model: str) -> Dict:
+        """Добавляет вопрос в историю и возвращает параметры генерации.
+
+        Если есть контекст Ollama от прошлого ответа той же модели, отправляем
+        его и только новый фрагмент диалога: прошлые реплики не рендерятся и не
+        передаются текстом заново. Иначе отправляем весь диалог, отрендеренный
+        из кэша префикса. Префикс в обоих случаях одинаковый, поэтому llama.cpp
+        переиспользует KV кэш прошлых реплик.
+        Если диалог с новым вопросом не помещается в token_budget, старые
+        пары вопрос-ответ выбрасываются.
+        """
+        message = ChatMessage(role=MessageRole.USER, content=user_message)
+        self.messages.append(message)
+        if self.ollama_context is not None and self.context_model == model:
+            # Длина контекста Ollama - точное число токенов диалога до этого вопроса
+            prompt_tokens = len(self.ollama_context) + estimate_tokens(message)
+        else:
+            prompt_tokens = sum(estimate_tokens(m) for m in self.messages)
+        if prompt_tokens > self.token_budget:
+            self._trim()
+        self._checkpoint = self.renderer.snapshot()
+        use_context = (
+            self.ollama_context is not None
+            and self.context_model == model
+            and self.renderer.prompt_style.supports_incremental
+        )
+        if use_context:
+            return {
+                "prompt": self.renderer.continuation(self.messages),
+                "context": self.ollama_context.tolist(),
+                "template": _PASSTHROUGH_TEMPLATE,
+            }
+        return {"prompt": self.renderer.render(self.messages), "template": _PASSTHROUGH_TEMPLATE}
+
+    def add_answer(self, answer: str, model: str, context: Optional[List[int]]) -> None:
+        self.messages.append(ChatMessage(role=MessageRole.ASSISTANT, content=answer))
+        self.turns += 1
+        self.ollama_context = array("i", context) if context else None
+        self.context_model = model if context else None
+
+    def discard_question(self) -> None:
+        """Убирает вопрос, на который не удалось получить ответ"""
+        if self.messages and self.messages[-1].role == MessageRole.USER:
+            self.messages.pop()
+            # префикс мог уже включить этот вопрос - откатываем кэш
+            self.renderer.restore(self._checkpoint)
+
+    def _trim(self) -> None:
+        """Выбросить самые старые пары вопрос-ответ, пока диалог не поместится в бюджет.
+
+        Системное сообщение и новый вопрос остаются, даже если одни больше бюджета.
+        """
+        system, history, question = self.messages[0], self.messages[1:-1], self.messages[-1]
+        tokens = estimate_tokens(system) + estimate_tokens(question) + sum(estimate_tokens(m) for m in history)
+        dropped = 0
+        # Хотя бы одну пару выбрасываем всегда: по точной длине контекста Ollama
+        # диалог уже не поместился, даже если грубая оценка говорит обратное
+        while history and (dropped == 0 or tokens > self.token_budget):
+            # История - пары вопрос-ответ, отбрасываем по паре
+            for removed in history[:2]:
+                tokens -= estimate_tokens(removed)
+            history = history[2:]
+            dropped += 1
+        self.messages = [system, *history, question]
+        self.trimmed_turns += dropped
+        logger.debug("Session %s: dropped %d oldest turns to fit %d tokens", self.session_id, dropped, self.token_budget)
+        # Префикс и контекст больше не совпадают с историей
+        self.renderer.reset()
+        self.ollama_context = None
+
+    @property
+    def memory_bytes(self) -> int:
+        text = sum(len(m.content or "") for m in self.messages)
+        # промпт хранится в кэше рендерера, контекст - 4 байта на токен
+        context = len(self.ollama_context) * 4 if self.ollama_context is not None else 0
+        return 2 * text + context
+
+
+class ChatSessionStore:
+    """Хранилище сессий с вытеснением по TTL и лимиту памяти.
+
+    Сессии лежат в OrderedDict в порядке последнего обращения, поэтому
+    просроченные и самые старые сессии всегда в начале и удаляются за O(1).
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = SESSION_TTL_SECONDS,
+        max_sessions: int = SESSION_MAX_COUNT,
+        max_memory_mb: float = SESSION_MAX_MEMORY_MB,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self.evicted_ttl = 0
+        self.evicted_memory = 0
+
+    def create(self, system_prompt: str) -> ChatSession:
+        self._evict_expired()
+        session = ChatSession(str(uuid.uuid4()), system_prompt)
+        self._sessions[session.session_id] = session
+        self._enforce_limits()
+        return session
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        self._evict_expired()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_access = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def turn_finished(self, session: ChatSession) -> None:
+        """Сессия выросла после ответа - проверяем лимит памяти"""
+        self._enforce_limits()
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_access <= self.ttl_seconds:
+                break
+            del self._sessions[session_id]
+            self.evicted_ttl += 1
+
+    def _enforce_limits(self) -> None:
+        total = self.memory_bytes()
+        # Самую свежую сессию не трогаем, даже если она одна больше лимита
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or total > self.max_memory_bytes
+        ):
+            session_id, session = self._sessions.popitem(last=False)
+            total -= session.memory_bytes
+            self.evicted_memory += 1
+            logger.info("Evicted chat session %s to respect session limits", session_id)
+
+    def memory_bytes(self) -> int:
+        return sum(session.memory_bytes for session in self._sessions.values())
+
+    def stats(self) -> Dict:
+        return {
+            "active_sessions": len(self._sessions),
+            "memory_bytes": self.memory_bytes(),
+            "max_memory_bytes": self.max_memory_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "num_ctx": SESSION_NUM_CTX,
+            "evicted_ttl": self.evicted_ttl,
+            "evicted_memory": self.evicted_memory,
+        }
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.embeddings import BaseEmbedding
+
+from ...utils import metrics
+from ...utils.histogram import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать соседние запросы, прежде чем запускать батч
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+
+_BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+EMBEDDING_BATCH_SIZE = metrics.histogram(
+    "embedding_batch_size", "Unique texts per embedding model call", buckets=_BATCH_SIZE_BUCKETS
+)
+EMBEDDING_QUEUE_WAIT_SECONDS = metrics.histogram(
+    "embedding_queue_wait_seconds", "Time a query embedding waited for its batch to start"
+)
+EMBEDDING_FORWARD_SECONDS = metrics.histogram(
+    "embedding_forward_seconds", "Embedding model call duration per batch"
+)
+
+_Request = Tuple[str, Future, float]
+
+
+class EmbeddingDispatcher:
+    """Склейка одновременных запросов эмбеддингов в батчи.
+
+    Вызывающие потоки и корутины кладут текст в очередь и ждут Future.
+    Отдельный поток забирает первый запрос, ждет остальные до max_wait_ms
+    или до max_batch_size и делает один прямой проход модели на весь
+    батч. Одинаковые тексты в батче считаются один раз.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = EMBEDDING_BATCH_MAX_SIZE,
+        max_wait_ms: float = EMBEDDING_BATCH_MAX_WAIT_MS,
+    ):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.SimpleQueue[Optional[_Request]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.batch_sizes = Histogram(_BATCH_SIZE_BUCKETS)
+        self.wait_seconds = Histogram()
+        self.forward_seconds = Histogram()
+        self.requests = 0
+        self.deduplicated = 0
+        self.errors = 0
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="embedding-dispatcher", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((text, future, time.monotonic()))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        """Блокирующий вызов для рабочих потоков (поиск через asyncio.to_thread)"""
+        return self.submit(text).result()
+
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    async def aembed(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self, first: _Request) -> List[_Request]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # Сигнал остановки вернем в очередь после текущего батча
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [
+                request for request in self._collect(first)
+                if request[1].set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            for _, _, enqueued in batch:
+                self.wait_seconds.observe(started - enqueued)
+                EMBEDDING_QUEUE_WAIT_SECONDS.observe(started - enqueued)
+            unique = list(dict.fromkeys(text for text, _, _ in batch))
+            self.requests += len(batch)
+            self.deduplicated += len(batch) - len(unique)
+            self.batch_sizes.observe(len(unique))
+            EMBEDDING_BATCH_SIZE.observe(len(unique))
+
+            try:
+                vectors = dict(zip(unique, self.embed_fn(unique)))
+            except BaseException as e:
+                self.errors += 1
+                logger.error("Embedding batch of %d failed: %r", len(unique), e)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                if not isinstance(e, Exception):
+                    # KeyboardInterrupt, SystemExit: поток завершается, но ожидающие не должны висеть
+                    self._abandon(e)
+                    raise
+                continue
+            self.forward_seconds.observe(time.monotonic() - started)
+            EMBEDDING_FORWARD_SECONDS.observe(time.monotonic() - started)
+            for text, future, _ in batch:
+                future.set_result(vectors[text])
+
+    def _abandon(self, error: BaseException) -> None:
+        """Отклонить запросы из очереди; следующий submit запустит новый поток"""
+        with self._start_lock:
+            self._thread = None
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(error)
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> Dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "requests": self.requests,
+            "deduplicated": self.deduplicated,
+            "errors": self.errors,
+            "batch_size": self.batch_sizes.snapshot(),
+            "wait_seconds": self.wait_seconds.snapshot(),
+            "forward_seconds": self.forward_seconds.snapshot(),
+        }
+
+
+class BatchingEmbedding(BaseEmbedding):
+    """Обертка модели эмбеддингов для индекса: эмбеддинги запросов идут
+    через EmbeddingDispatcher, эмбеддинги документов при индексации - как
+    раньше, они уже приходят батчами.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _dispatcher: EmbeddingDispatcher = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, dispatcher: Optional[EmbeddingDispatcher] = None, **kwargs: Any):
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            **kwargs,
+        )
+        self._inner = inner
+        # У paraphrase-multilingual-MiniLM нет отдельного префикса для запросов,
+        # поэтому запросы считаются как обычные тексты одним батчем
+        self._dispatcher = dispatcher or EmbeddingDispatcher(inner.get_text_embedding_batch)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchingEmbedding"
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    @property
+    def dispatcher(self) -> EmbeddingDispatcher:
+        return self._dispatcher
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._dispatcher.embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._dispatcher.aembed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._inner.get_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._inner.get_text_embedding_batch(texts)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return await self._inner.aget_text_embedding(text)
@@ -0,0 +1,75 @@
+import logging
+import os
+from typing import Any, Optional
+
+from llama_index.core.embeddings import BaseEmbedding
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = os.getenv(
+    "EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+)
+# torch - HuggingFaceEmbedding на PyTorch, onnx - та же модель, экспортированная в ONNX Runtime
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Динамическая int8 квантизация весов (только для onnx)
+EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "0") == "1"
+# Потоки внутри операторов, 0 - по числу ядер (решение библиотеки)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+# Без значения - как у библиотеки: батч 10 у PyTorch, 32 у ONNX
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "0")) or None
+# Без значения - max_seq_length самой модели (128 у MiniLM-L12-v2). Другое
+# значение меняет векторы длинных фрагментов, и индекс придется пересобрать
+EMBEDDING_MAX_LENGTH = int(os.getenv("EMBEDDING_MAX_LENGTH", "0")) or None
+# Кэш экспортированных ONNX моделей
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./models/onnx")
+
+
+def create_embed_model(
+    backend: str = EMBEDDING_BACKEND,
+    model_name: str = EMBEDDING_MODEL,
+    quantize: bool = EMBEDDING_QUANTIZE,
+    threads: int = EMBEDDING_THREADS,
+    batch_size: Optional[int] = EMBEDDING_BATCH_SIZE,
+    max_length: Optional[int] = EMBEDDING_MAX_LENGTH,
+    cache_dir: str = EMBEDDING_CACHE_DIR,
+) -> BaseEmbedding:
+    """Модель эмбеддингов для индексации и поиска"""
+    if backend == "onnx":
+        from .onnx_embedding import OnnxEmbedding
+
+        logger.info(
+            "Using ONNX Runtime embeddings for %s (int8=%s, threads=%s, batch=%s)",
+            model_name, quantize, threads or "auto", batch_size or "default",
+        )
+        return OnnxEmbedding(
+            model_name=model_name,
+            cache_dir=cache_dir,
+            quantize=quantize,
+            threads=threads,
+            max_length=max_length,
+            embed_batch_size=batch_size or 32,
+        )
+    if backend != "torch":
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    if threads > 0:
+        import torch
+
+        torch.set_num_threads(threads)
+    # Только заданные явно: иначе остаются настройки модели, с которыми построен индекс
+    kwargs: dict[str, Any] = {}
+    if batch_size:
+        kwargs["embed_batch_size"] = batch_size
+    if max_length:
+        kwargs["max_length"] = max_length
+    return HuggingFaceEmbedding(model_name=model_name, **kwargs)
+
+
+def describe_embed_model(embed_model: BaseEmbedding) -> str:
+    """Короткое описание для статистики: модель и бэкенд"""
+    backend = embed_model.class_name()
+    if getattr(embed_model, "model_path", "").endswith("int8.onnx"):
+        backend += ", int8"
+    return f"{embed_model.model_name.split('/')[-1]} ({backend})"
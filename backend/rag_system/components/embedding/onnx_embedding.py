@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.embeddings import BaseEmbedding
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model_int8.onnx"
+# Настройки sentence-transformers, среди них max_seq_length модели
+SENTENCE_BERT_CONFIG = "sentence_bert_config.json"
+
+
+def export_onnx_model(model_name: str, cache_dir: str, quantize: bool = False) -> Tuple[Path, Path]:
+    """Экспорт модели sentence-transformers в ONNX с кэшированием на диске.
+
+    Экспорт (и динамическая int8 квантизация) выполняются один раз, потом
+    модель берется из cache_dir. Возвращает папку с токенизатором и путь
+    к .onnx файлу.
+    """
+    model_dir = Path(cache_dir) / model_name.replace("/", "--")
+    onnx_path = model_dir / ONNX_MODEL_FILE
+    if not onnx_path.exists():
+        # optimum нужен только для экспорта, в рантайме хватает onnxruntime
+        from optimum.onnxruntime import ORTModelForFeatureExtraction  # type: ignore
+        from transformers import AutoTokenizer  # type: ignore
+
+        logger.info("Exporting %s to ONNX into %s", model_name, model_dir)
+        # Экспортируем во временную папку, чтобы прерванный экспорт не оставил битый кэш
+        tmp_dir = model_dir.with_name(model_dir.name + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(tmp_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp_dir)
+        _save_sentence_bert_config(model_name, tmp_dir)
+        shutil.rmtree(model_dir, ignore_errors=True)
+        os.replace(tmp_dir, model_dir)
+
+    if not quantize:
+        return model_dir, onnx_path
+
+    int8_path = model_dir / ONNX_INT8_MODEL_FILE
+    if not int8_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore
+
+        logger.info("Quantizing %s to int8", onnx_path)
+        tmp_path = int8_path.with_suffix(".tmp")
+        quantize_dynamic(str(onnx_path), str(tmp_path), weight_type=QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+    return model_dir, int8_path
+
+
+def _save_sentence_bert_config(model_name: str, model_dir: Path) -> None:
+    from huggingface_hub import hf_hub_download  # type: ignore
+
+    try:
+        shutil.copy(hf_hub_download(model_name, SENTENCE_BERT_CONFIG), model_dir / SENTENCE_BERT_CONFIG)
+    except Exception as e:
+        logger.warning("No %s for %s: %s", SENTENCE_BERT_CONFIG, model_name, e)
+
+
+def model_max_length(model_name: str, model_dir: Path, tokenizer: Any) -> int:
+    """max_seq_length модели, как у SentenceTransformer (и HuggingFaceEmbedding).
+
+    Лимит токенизатора обычно больше (512 против 128 у MiniLM), и с ним
+    векторы длинных текстов не совпали бы с векторами PyTorch.
+    """
+    config_path = Path(model_dir) / SENTENCE_BERT_CONFIG
+    if not config_path.exists():
+        # Кэш, экспортированный без конфига
+        _save_sentence_bert_config(model_name, Path(model_dir))
+    if config_path.exists():
+        max_seq_length = json.loads(config_path.read_text(encoding="utf-8")).get("max_seq_length")
+        if max_seq_length:
+            return int(max_seq_length)
+    logger.warning("Using tokenizer max length %s for %s", tokenizer.model_max_length, model_name)
+    return int(tokenizer.model_max_length)
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """Эмбеддинги sentence-transformers через ONNX Runtime на CPU.
+
+    Mean pooling по attention mask и L2 нормализация, как у
+    HuggingFaceEmbedding, и тот же max_seq_length, поэтому векторы
+    взаимозаменяемы с PyTorch (tests/test_embedding_parity.py).
+    """
+
+    model_path: str = Field(description="Path to the .onnx file.")
+    max_length: int = Field(description="Max tokens per text.")
+    threads: int = Field(default=0, description="Intra-op threads, 0 - ONNX Runtime default.")
+
+    _session: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _input_names: set = PrivateAttr()
+
+    def __init__(
+        self,
+        model_name: str,
+        cache_dir: str,
+        quantize: bool = False,
+        threads: int = 0,
+        max_length: Optional[int] = None,
+        embed_batch_size: int = 32,
+        **kwargs: Any,
+    ) -> None:
+        import onnxruntime as ort  # type: ignore
+        from transformers import AutoTokenizer  # type: ignore
+
+        model_dir, model_path = export_onnx_model(model_name, cache_dir, quantize)
+        tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        # По умолчанию - как у PyTorch бэкенда, иначе векторы не совпадут с индексом
+        max_length = max_length or model_max_length(model_name, model_dir, tokenizer)
+        super().__init__(
+            model_name=model_name,
+            model_path=str(model_path),
+            max_length=max_length,
+            threads=threads,
+            embed_batch_size=embed_batch_size,
+            **kwargs,
+        )
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        # Параллелим внутри операторов, между операторами граф последовательный
+        options.inter_op_num_threads = 1
+        self._session = ort.InferenceSession(
+            str(model_path), options, providers=["CPUExecutionProvider"]
+        )
+        self._tokenizer = tokenizer
+        self._input_names = {i.name for i in self._session.get_inputs()}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        # Тексты близкой длины в одном батче - меньше паддинга
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        encoded = self._tokenizer(
+            [texts[i] for i in order],
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        inputs = {
+            name: value.astype(np.int64)
+            for name, value in encoded.items()
+            if name in self._input_names
+        }
+        last_hidden_state = self._session.run(None, inputs)[0]
+
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (last_hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+        result: List[List[float]] = [[] for _ in texts]
+        for position, index in enumerate(order):
+            result[index] = pooled[position].tolist()
+        return result
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([query])[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
@@ -0,0 +1,170 @@
+import logging
+import os
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Модели от самой быстрой к самой качественной: "qwen2.5:0.5b,llama3.2:1b,llama3.1:8b".
+# Если не задано, каскад состоит из одной модели сервиса
+LLM_CASCADE_TIERS = os.getenv("LLM_CASCADE_TIERS", "")
+# Границы сложности между уровнями, по одной на каждый уровень кроме первого
+LLM_CASCADE_THRESHOLDS = os.getenv("LLM_CASCADE_THRESHOLDS", "0.4,0.7")
+# Эскалация ответа, который плохо опирается на контекст (только без стриминга)
+LLM_CASCADE_ESCALATE = os.getenv("LLM_CASCADE_ESCALATE", "1") == "1"
+LLM_CASCADE_GROUNDING_THRESHOLD = float(os.getenv("LLM_CASCADE_GROUNDING_THRESHOLD", "0.45"))
+
+_LATENCY_SAMPLES = 256
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Признаки вопросов, требующих рассуждения, а не пересказа одного фрагмента
+_HARD_INTENT_RE = re.compile(
+    r"\b(почему|зачем|сравни\w*|разниц\w*|отлича\w*|объясни\w*|обоснуй\w*|"
+    r"проанализир\w*|оцени\w*|рассчита\w*|посчита\w*|сколько|если|"
+    r"риск\w*|последстви\w*|плюсы|минусы|преимуществ\w*|недостат\w*)\b",
+    re.IGNORECASE,
+)
+# Длина основы слова для грубого стемминга русских словоформ
+_STEM_LENGTH = 5
+
+
+def _stems(text: str) -> set:
+    return {w[:_STEM_LENGTH] for w in _WORD_RE.findall(text.lower()) if len(w) > 3}
+
+
+def grounding_score(answer: str, context: str) -> float:
+    """Доля значимых слов ответа, встречающихся в контексте (0..1)"""
+    answer_stems = _stems(answer)
+    if not answer_stems:
+        return 0.0
+    return len(answer_stems & _stems(context)) / len(answer_stems)
+
+
+@dataclass
+class CascadeTier:
+    model: str
+    max_complexity: float
+    routed: int = 0
+    escalated_to: int = 0
+    grounding_failures: int = 0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=_LATENCY_SAMPLES))
+
+    def stats(self, total: int) -> dict[str, Any]:
+        latencies = sorted(self.latencies)
+
+        def pct(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+        return {
+            "model": self.model,
+            "max_complexity": self.max_complexity,
+            "routed": self.routed,
+            "hit_rate": round(self.routed / total, 3) if total else 0.0,
+            "escalated_to": self.escalated_to,
+            "grounding_failures": self.grounding_failures,
+            "latency_seconds": {"p50": pct(0.5), "p95": pct(0.95)},
+        }
+
+
+class ModelCascade:
+    """Выбор модели по сложности вопроса.
+
+    Дешевый роутер оценивает сложность по длине вопроса, разбросу оценок
+    релевантности найденных фрагментов и словам-признакам рассуждения.
+    Простые вопросы отвечает маленькая модель, сложные - более крупная.
+    Ответ, плохо опирающийся на контекст, можно переспросить у следующего
+    уровня (см. grounding_score).
+    """
+
+    def __init__(
+        self,
+        models: Optional[Sequence[str]] = None,
+        thresholds: Optional[Sequence[float]] = None,
+        escalate: bool = LLM_CASCADE_ESCALATE,
+        grounding_threshold: float = LLM_CASCADE_GROUNDING_THRESHOLD,
+    ):
+        models = list(models or [])
+        if not models:
+            raise ValueError("Model cascade needs at least one model")
+        if thresholds is None:
+            thresholds = [float(t) for t in LLM_CASCADE_THRESHOLDS.split(",") if t.strip()]
+        # Последний уровень принимает любую сложность
+        bounds = list(thresholds[: len(models) - 1])
+        bounds += [1.0] * (len(models) - len(bounds))
+        self.tiers: List[CascadeTier] = [
+            CascadeTier(model=model, max_complexity=bound) for model, bound in zip(models, bounds)
+        ]
+        self.escalate = escalate
+        self.grounding_threshold = grounding_threshold
+        self.total = 0
+
+    @classmethod
+    def from_env(cls, default_model: str) -> "ModelCascade":
+        models = [m.strip() for m in LLM_CASCADE_TIERS.split(",") if m.strip()]
+        return cls(models or [default_model])
+
+    @property
+    def models(self) -> List[str]:
+        return [tier.model for tier in self.tiers]
+
+    def complexity(self, question: str, scores: Sequence[float] = ()) -> float:
+        """Оценка сложности вопроса от 0 (простой) до 1 (сложный)"""
+        words = len(_WORD_RE.findall(question))
+        # Длинные, многочастные вопросы сложнее
+        length_signal = min(words / 40.0, 1.0)
+        parts_signal = min(max(question.count("?") - 1, 0) + question.count(";"), 2) / 2.0
+        intent_signal = min(len(_HARD_INTENT_RE.findall(question)) / 2.0, 1.0)
+
+        # Слабое лучшее совпадение или плоский разброс оценок - ответ не лежит
+        # в одном фрагменте, его придется собирать из нескольких
+        retrieval_signal = 0.5
+        if scores:
+            ordered = sorted(scores, reverse=True)
+            top = ordered[0]
+            spread = top - ordered[min(2, len(ordered) - 1)]
+            weak_match = 1.0 - min(max(top, 0.0), 1.0)
+            flat = 1.0 - min(spread / 0.15, 1.0) if len(ordered) > 1 else 0.0
+            retrieval_signal = 0.6 * weak_match + 0.4 * flat
+
+        score = (
+            0.25 * length_signal
+            + 0.15 * parts_signal
+            + 0.35 * intent_signal
+            + 0.25 * retrieval_signal
+        )
+        return round(min(score, 1.0), 4)
+
+    def route(self, question: str, scores: Sequence[float] = ()) -> int:
+        """Индекс уровня для вопроса"""
+        score = self.complexity(question, scores)
+        for index, tier in enumerate(self.tiers):
+            if score <= tier.max_complexity:
+                break
+        self.tiers[index].routed += 1
+        self.total += 1
+        logger.debug("Cascade routed complexity=%.3f to %s", score, self.tiers[index].model)
+        return index
+
+    def should_escalate(self, index: int, answer: str, context: str) -> bool:
+        """Нужно ли переспросить более крупную модель"""
+        if not self.escalate or not context or index >= len(self.tiers) - 1:
+            return False
+        if grounding_score(answer, context) >= self.grounding_threshold:
+            return False
+        self.tiers[index].grounding_failures += 1
+        self.tiers[index + 1].escalated_to += 1
+        return True
+
+    def record_latency(self, index: int, seconds: float) -> None:
+        self.tiers[index].latencies.append(seconds)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "escalation_enabled": self.escalate,
+            "grounding_threshold": self.grounding_threshold,
+            "total_routed": self.total,
+            "tiers": [tier.stats(self.total) for tier in self.tiers],
+        }
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from .ollama_client import OllamaClient
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ModelStatus:
+    model: str
+    # pending -> pulling -> warming -> ready, либо error
+    state: str = "pending"
+    completed_bytes: int = 0
+    total_bytes: int = 0
+    pull_status: str = ""
+    warmup_seconds: float | None = None
+    error: str | None = None
+
+    @property
+    def progress(self) -> float:
+        if self.state in ("warming", "ready"):
+            return 1.0
+        if not self.total_bytes:
+            return 0.0
+        return round(self.completed_bytes / self.total_bytes, 4)
+
+
+class ModelProvisioner:
+    """Подготовка моделей Ollama при старте приложения.
+
+    Работает в фоне, не задерживая запуск сервера: проверяет соединение с
+    Ollama (через retry из utils/ollama.check_connection), докачивает
+    отсутствующие модели и делает прогревочную генерацию, чтобы первый
+    запрос пользователя не ждал загрузки модели в память.
+    """
+
+    def __init__(self, llm_client: OllamaClient, models: list[str]) -> None:
+        self.llm_client = llm_client
+        self.models = {model: ModelStatus(model=model) for model in dict.fromkeys(models)}
+        self.ollama_reachable = False
+        self.started_at = time.monotonic()
+        self.finished_at: float | None = None
+
+    async def run(self) -> None:
+        # Импорт здесь: модуль поднимает ImportError без пакета ollama
+        from ...utils.ollama import check_connection
+
+        try:
+            from ollama import Client  # type: ignore
+
+            client = Client(host=self.llm_client.base_url)
+            self.ollama_reachable = await asyncio.to_thread(check_connection, client)
+        except Exception as e:
+            logger.error("Ollama is not reachable at %s: %s", self.llm_client.base_url, e)
+            self.ollama_reachable = False
+
+        if not self.ollama_reachable:
+            for status in self.models.values():
+                status.state = "error"
+                status.error = "Ollama is not reachable"
+            self.finished_at = time.monotonic()
+            return
+
+        for status in self.models.values():
+            await self._provision(client, status)
+        self.finished_at = time.monotonic()
+
+    async def _provision(self, client: Any, status: ModelStatus) -> None:
+        from ...utils.ollama import pull_model
+
+        def on_progress(completed: int, total: int, pull_status: str) -> None:
+            status.completed_bytes = completed
+            status.total_bytes = total
+            status.pull_status = pull_status
+
+        try:
+            status.state = "pulling"
+            await asyncio.to_thread(pull_model, client, status.model, True, on_progress)
+
+            status.state = "warming"
+            started = time.monotonic()
+            # Пустой промпт только загружает модель в память
+            await self.llm_client.generate({"model": status.model, "prompt": ""})
+            status.warmup_seconds = round(time.monotonic() - started, 3)
+            status.state = "ready"
+            logger.info("Model %s is warm (%.2fs)", status.model, status.warmup_seconds)
+        except Exception as e:
+            status.state = "error"
+            status.error = str(e)
+            logger.error("Failed to provision model %s: %s", status.model, e)
+
+    async def loaded_models(self) -> set[str]:
+        """Модели, которые Ollama сейчас держит в памяти"""
+        running = await self.llm_client.ps()
+        return {m.get("model") or m.get("name") for m in running.get("models", [])}
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def status(self) -> dict[str, Any]:
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return {
+            "ollama_reachable": self.ollama_reachable,
+            "done": self.done,
+            "elapsed_seconds": round(elapsed, 3),
+            "models": {
+                model: {**asdict(status), "progress": status.progress}
+                for model, status in self.models.items()
+            },
+        }
@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import time
+from collections.abc import AsyncIterator
+from contextlib import aclosing
+from typing import Any
+
+import httpx
+
+from ...utils import metrics
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "16"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+# Генерация на CPU может идти минутами, поэтому таймаут чтения большой
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+# Сколько модель остается в памяти Ollama после запроса ("30m", "-1" - навсегда)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+_GENERATION_PATHS = ("/api/generate", "/api/chat")
+
+_TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+_RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200, 400)
+
+OLLAMA_REQUEST_SECONDS = metrics.histogram(
+    "ollama_request_seconds", "Ollama HTTP call duration, streams until the last chunk", ["path", "model"]
+)
+OLLAMA_ERRORS = metrics.counter("ollama_errors_total", "Failed Ollama HTTP calls", ["path"])
+OLLAMA_PROMPT_TOKENS = metrics.histogram(
+    "ollama_prompt_tokens", "Prompt tokens evaluated per generation", ["model"], buckets=_TOKEN_BUCKETS
+)
+OLLAMA_PROMPT_EVAL_SECONDS = metrics.histogram(
+    "ollama_prompt_eval_seconds", "Prompt evaluation time reported by Ollama", ["model"]
+)
+OLLAMA_EVAL_SECONDS = metrics.histogram(
+    "ollama_eval_seconds", "Token generation time reported by Ollama", ["model"]
+)
+OLLAMA_TOKENS_PER_SECOND = metrics.histogram(
+    "ollama_tokens_per_second", "Generation speed, eval_count / eval_duration", ["model"], buckets=_RATE_BUCKETS
+)
+OLLAMA_TOKENS = metrics.counter("ollama_tokens_total", "Tokens processed by Ollama", ["model", "kind"])
+
+
+def record_generation(model: str, response: dict[str, Any]) -> None:
+    """Статистика из финального ответа Ollama: *_duration - в наносекундах"""
+    prompt_tokens = response.get("prompt_eval_count") or 0
+    eval_tokens = response.get("eval_count") or 0
+    eval_duration = (response.get("eval_duration") or 0) / 1e9
+    # При попадании в кэш промпта Ollama не присылает prompt_eval_*
+    OLLAMA_PROMPT_TOKENS.labels(model).observe(prompt_tokens)
+    OLLAMA_PROMPT_EVAL_SECONDS.labels(model).observe((response.get("prompt_eval_duration") or 0) / 1e9)
+    OLLAMA_EVAL_SECONDS.labels(model).observe(eval_duration)
+    OLLAMA_TOKENS.labels(model, "prompt").inc(prompt_tokens)
+    OLLAMA_TOKENS.labels(model, "generated").inc(eval_tokens)
+    if eval_tokens and eval_duration:
+        OLLAMA_TOKENS_PER_SECOND.labels(model).observe(eval_tokens / eval_duration)
+
+
+class OllamaClient:
+    """Асинхронный клиент Ollama с общим пулом соединений.
+
+    Один экземпляр создается на всё приложение (в lifespan FastAPI) и
+    используется всеми обращениями к Ollama, поэтому соединения
+    переиспользуются через keep-alive, а обработчики не блокируют event loop.
+    """
+
+    def __init__(
+        self,
+        base_url: str | None = None,
+        max_connections: int = OLLAMA_MAX_CONNECTIONS,
+        max_keepalive_connections: int = OLLAMA_MAX_KEEPALIVE,
+        keepalive_expiry: float = OLLAMA_KEEPALIVE_EXPIRY,
+        connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+        read_timeout: float = OLLAMA_READ_TIMEOUT,
+        keep_alive: str | None = OLLAMA_KEEP_ALIVE,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self.base_url = (base_url or OLLAMA_BASE_URL).rstrip("/")
+        self.keep_alive = keep_alive
+        self.max_connections = max_connections
+        # transport подменяется в тестах (httpx.MockTransport)
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            transport=transport,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                connect=connect_timeout,
+                read=read_timeout,
+                write=connect_timeout,
+                pool=connect_timeout,
+            ),
+        )
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._total_requests = 0
+        self._errors = 0
+
+    def _acquire(self) -> None:
+        self._in_flight += 1
+        self._total_requests += 1
+        if self._in_flight > self._peak_in_flight:
+            self._peak_in_flight = self._in_flight
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+
+    def _with_keep_alive(self, path: str, payload: dict[str, Any]) -> dict[str, Any]:
+        """Добавляет keep_alive к генерациям, чтобы модель не выгружалась"""
+        if self.keep_alive is None or path not in _GENERATION_PATHS:
+            return payload
+        # числовое значение Ollama понимает как секунды
+        keep_alive: str | int = self.keep_alive
+        if keep_alive.lstrip("-").isdigit():
+            keep_alive = int(keep_alive)
+        return {"keep_alive": keep_alive, **payload}
+
+    async def _post_json(self, path: str, payload: dict[str, Any]) -> dict[str, Any]:
+        self._acquire()
+        started = time.perf_counter()
+        model = payload.get("model", "")
+        try:
+            response = await self._client.post(
+                path, json={**self._with_keep_alive(path, payload), "stream": False}
+            )
+            response.raise_for_status()
+            data = response.json()
+            OLLAMA_REQUEST_SECONDS.labels(path, model).observe(time.perf_counter() - started)
+            if path in _GENERATION_PATHS:
+                record_generation(model, data)
+            return data
+        except httpx.HTTPError:
+            self._errors += 1
+            OLLAMA_ERRORS.labels(path).inc()
+            raise
+        finally:
+            self._release()
+
+    async def generate(self, payload: dict[str, Any]) -> dict[str, Any]:
+        """Нестриминговый вызов /api/generate"""
+        return await self._post_json("/api/generate", payload)
+
+    async def chat(self, payload: dict[str, Any]) -> dict[str, Any]:
+        """Нестриминговый вызов /api/chat"""
+        return await self._post_json("/api/chat", payload)
+
+    async def stream_lines(
+        self, path: str, payload: dict[str, Any]
+    ) -> AsyncIterator[str]:
+        """Отдает сырые NDJSON строки стримингового ответа Ollama"""
+        self._acquire()
+        started = time.perf_counter()
+        model = payload.get("model", "")
+        try:
+            async with self._client.stream(
+                "POST", path, json={"stream": True, **self._with_keep_alive(path, payload)}
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    # Статистика только в последнем чанке; остальные не разбираем
+                    if '"done":true' in line:
+                        OLLAMA_REQUEST_SECONDS.labels(path, model).observe(time.perf_counter() - started)
+                        try:
+                            record_generation(model, json.loads(line))
+                        except json.JSONDecodeError:
+                            pass
+                    yield line
+        except httpx.HTTPError:
+            self._errors += 1
+            OLLAMA_ERRORS.labels(path).inc()
+            raise
+        finally:
+            self._release()
+
+    async def stream(
+        self, path: str, payload: dict[str, Any]
+    ) -> AsyncIterator[dict[str, Any]]:
+        """Отдает разобранные JSON чанки стримингового ответа Ollama"""
+        # aclosing: при закрытии потока сразу рвем HTTP запрос, и Ollama
+        # прекращает генерацию, а не ждем сборщика мусора
+        async with aclosing(self.stream_lines(path, payload)) as lines:
+            async for line in lines:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping malformed Ollama chunk: %r", line[:200])
+
+    async def _get_json(self, path: str) -> dict[str, Any]:
+        self._acquire()
+        try:
+            response = await self._client.get(path)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError:
+            self._errors += 1
+            OLLAMA_ERRORS.labels(path).inc()
+            raise
+        finally:
+            self._release()
+
+    async def tags(self) -> dict[str, Any]:
+        """Список установленных моделей (/api/tags)"""
+        return await self._get_json("/api/tags")
+
+    async def ps(self) -> dict[str, Any]:
+        """Модели, загруженные сейчас в память (/api/ps)"""
+        return await self._get_json("/api/ps")
+
+    def pool_stats(self) -> dict[str, Any]:
+        """Загрузка пула соединений"""
+        stats: dict[str, Any] = {
+            "base_url": self.base_url,
+            "max_connections": self.max_connections,
+            "in_flight": self._in_flight,
+            "peak_in_flight": self._peak_in_flight,
+            "total_requests": self._total_requests,
+            "errors": self._errors,
+            "utilization": round(self._in_flight / self.max_connections, 3),
+        }
+        # httpx не отдает состояние пула публично, смотрим в httpcore
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            stats["open_connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for c in connections if c.is_idle())
+        return stats
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+        logger.info("Ollama HTTP client closed (%s)", self.base_url)
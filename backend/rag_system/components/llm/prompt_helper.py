@@ -24,6 +24,9 @@ class AbstractPromptStyle(abc.ABC):
     series of messages into a prompt.
     """
 
+    # Set by `IncrementalPromptStyle`, see `IncrementalPromptRenderer`.
+    supports_incremental: bool = False
+
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         logger.debug("Initializing prompt_style=%s", self.__class__.__name__)
 
@@ -47,6 +50,37 @@ class AbstractPromptStyle(abc.ABC):
         return prompt
 
 
+class IncrementalPromptStyle(AbstractPromptStyle):
+    """Prompt style that renders a conversation as a plain concatenation of
+    per-message fragments.
+
+    Such a conversation can be rendered incrementally, see
+    `IncrementalPromptRenderer`.
+    """
+
+    supports_incremental = True
+
+    def _prompt_start(self, first_message: ChatMessage) -> str:
+        """Text placed before the first message (e.g. a default system prompt)."""
+        return ""
+
+    @abc.abstractmethod
+    def _message_fragment(self, message: ChatMessage) -> str:
+        """Rendering of a single message."""
+
+    def _generation_prompt(self) -> str:
+        """Text that asks the model for the next assistant message."""
+        return ""
+
+    def _assistant_turn_end(self) -> str:
+        """Text that closes an assistant message.
+
+        A model's answer stops right before this marker, so it has to be
+        re-added when continuing from the model's returned context.
+        """
+        return ""
+
+
 class DefaultPromptStyle(AbstractPromptStyle):
     """Default prompt style that uses the defaults from llama_utils.
 
@@ -139,7 +173,7 @@ class Llama2PromptStyle(AbstractPromptStyle):
         )
 
 
-class Llama3PromptStyle(AbstractPromptStyle):
+class Llama3PromptStyle(IncrementalPromptStyle):
     r"""Template for Meta's Llama 3.1.
 
     The format follows this structure:
@@ -197,6 +231,25 @@ class Llama3PromptStyle(AbstractPromptStyle):
 
         return prompt
 
+    def _prompt_start(self, first_message: ChatMessage) -> str:
+        if first_message.role == MessageRole.SYSTEM:
+            return ""
+        return f"{self.B_SYS}\n\n{self.DEFAULT_SYSTEM_PROMPT}{self.E_SYS}"
+
+    def _message_fragment(self, message: ChatMessage) -> str:
+        if message.content is None:
+            return ""
+        if message.role == MessageRole.SYSTEM:
+            return f"{self.B_SYS}\n\n{message.content.strip()}{self.E_SYS}"
+        role_header = f"{self.B_INST}{message.role.value}{self.E_INST}"
+        return f"{role_header}\n\n{message.content.strip()}{self.EOT}"
+
+    def _generation_prompt(self) -> str:
+        return f"{self.ASSISTANT_INST}\n\n"
+
+    def _assistant_turn_end(self) -> str:
+        return self.EOT
+
     def _completion_to_prompt(self, completion: str) -> str:
         return (
             f"{self.B_SYS}\n\n{self.DEFAULT_SYSTEM_PROMPT}{self.E_SYS}"
@@ -205,7 +258,7 @@ class Llama3PromptStyle(AbstractPromptStyle):
         )
 
 
-class TagPromptStyle(AbstractPromptStyle):
+class TagPromptStyle(IncrementalPromptStyle):
     """Tag prompt style (used by Vigogne) that uses the prompt style `<|ROLE|>`.
 
     It transforms the sequence of messages into a prompt that should look like:
@@ -219,6 +272,15 @@ class TagPromptStyle(AbstractPromptStyle):
     FIXME: should we add surrounding `<s>` and `</s>` tags, like in llama2?
     """
 
+    def _message_fragment(self, message: ChatMessage) -> str:
+        return f"<|{message.role.lower()}|>: {(message.content or '').strip()}\n"
+
+    def _generation_prompt(self) -> str:
+        return "<|assistant|>: "
+
+    def _assistant_turn_end(self) -> str:
+        return "\n"
+
     def _messages_to_prompt(self, messages: Sequence[ChatMessage]) -> str:
         """Format message to prompt with `<|ROLE|>: MSG` style."""
         prompt = ""
@@ -285,16 +347,145 @@ class ChatMLPromptStyle(AbstractPromptStyle):
         )
 
 
+class IncrementalChatMLPromptStyle(IncrementalPromptStyle):
+    """ChatML prompt style (used by Qwen) for multi-turn conversations.
+
+    Unlike `ChatMLPromptStyle`, every message including the assistant's
+    answers gets its own block, so the prompt grows by appending:
+    ```text
+    <|im_start|>system
+    your system prompt here.<|im_end|>
+    <|im_start|>user
+    user message here<|im_end|>
+    <|im_start|>assistant
+    assistant (model) response here<|im_end|>
+    ```
+    """
+
+    def _messages_to_prompt(self, messages: Sequence[ChatMessage]) -> str:
+        if not messages:
+            return self._generation_prompt()
+        prompt = self._prompt_start(messages[0])
+        prompt += "".join(self._message_fragment(message) for message in messages)
+        prompt += self._generation_prompt()
+        return prompt
+
+    def _prompt_start(self, first_message: ChatMessage) -> str:
+        if first_message.role.lower() == "system":
+            return ""
+        # keep an (empty) system block, as models trained on ChatML expect it
+        return "<|im_start|>system\n<|im_end|>\n"
+
+    def _message_fragment(self, message: ChatMessage) -> str:
+        content = (message.content or "").strip()
+        return f"<|im_start|>{message.role.lower()}\n{content}<|im_end|>\n"
+
+    def _generation_prompt(self) -> str:
+        return "<|im_start|>assistant\n"
+
+    def _assistant_turn_end(self) -> str:
+        return "<|im_end|>\n"
+
+    def _completion_to_prompt(self, completion: str) -> str:
+        return self._messages_to_prompt(
+            [ChatMessage(content=completion, role=MessageRole.USER)]
+        )
+
+
+class IncrementalPromptRenderer:
+    """Render a growing conversation without re-rendering its history.
+
+    The rendered text of every message seen so far is cached, so each new turn
+    only formats the messages appended since the previous call. Styles that
+    don't support incremental rendering fall back to a full render.
+
+    The cached prefix is byte-for-byte stable between turns, which also lets
+    the LLM server reuse its KV cache for the shared part of the prompt.
+    """
+
+    def __init__(self, prompt_style: AbstractPromptStyle) -> None:
+        self.prompt_style = prompt_style
+        self._prefix = ""
+        self._rendered_count = 0
+
+    def reset(self) -> None:
+        self._prefix = ""
+        self._rendered_count = 0
+
+    def snapshot(self) -> tuple[str, int]:
+        return self._prefix, self._rendered_count
+
+    def restore(self, snapshot: tuple[str, int]) -> None:
+        """Roll back to a snapshot, e.g. when a turn got no answer."""
+        self._prefix, self._rendered_count = snapshot
+
+    def _append(self, messages: Sequence[ChatMessage]) -> str:
+        """Render `messages[self._rendered_count:]` and add it to the prefix."""
+        style = self.prompt_style
+        new_messages = messages[self._rendered_count :]
+        parts = []
+        if self._rendered_count == 0 and new_messages:
+            parts.append(style._prompt_start(new_messages[0]))
+        parts.extend(style._message_fragment(message) for message in new_messages)
+        appended = "".join(parts)
+        self._prefix += appended
+        self._rendered_count = len(messages)
+        return appended
+
+    def _suffix(self, messages: Sequence[ChatMessage]) -> str:
+        if messages and messages[-1].role == MessageRole.ASSISTANT:
+            return ""
+        return self.prompt_style._generation_prompt()
+
+    def render(self, messages: Sequence[ChatMessage]) -> str:
+        """Full prompt for `messages`, which must extend the previous call's."""
+        if not self.prompt_style.supports_incremental:
+            return self.prompt_style.messages_to_prompt(messages)
+        if len(messages) < self._rendered_count:
+            self.reset()
+        self._append(messages)
+        return self._prefix + self._suffix(messages)
+
+    def continuation(self, messages: Sequence[ChatMessage]) -> str:
+        """Only the part of the prompt after the last assistant answer.
+
+        Meant to be sent together with the model's returned context, which
+        already holds every earlier token of the conversation up to the end of
+        the last generated answer.
+        """
+        if not self.prompt_style.supports_incremental:
+            raise ValueError(
+                f"{self.prompt_style.__class__.__name__} can't render continuations"
+            )
+        answer_index = self._rendered_count
+        if (
+            answer_index >= len(messages)
+            or messages[answer_index].role != MessageRole.ASSISTANT
+        ):
+            raise ValueError("The previous turn has no assistant answer yet")
+        # the answer joins the cached prefix but isn't sent: the context has it
+        self._append(messages[: answer_index + 1])
+        appended = self._append(messages)
+        return (
+            self.prompt_style._assistant_turn_end() + appended + self._suffix(messages)
+        )
+
+
 def get_prompt_style(
     prompt_style: (
         Literal["default", "llama2", "llama3", "tag", "mistral", "chatml"] | None
-    )
+    ),
+    incremental: bool = False,
 ) -> AbstractPromptStyle:
     """Get the prompt style to use from the given string.
 
     :param prompt_style: The prompt style to use.
+    :param incremental: Prefer a variant that `IncrementalPromptRenderer` can
+        render incrementally, for multi-turn sessions.
     :return: The prompt style to use.
     """
+    if incremental and prompt_style == "chatml":
+        return IncrementalChatMLPromptStyle()
     if prompt_style is None or prompt_style == "default":
         return DefaultPromptStyle()
     elif prompt_style == "llama2":
@@ -0,0 +1,389 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from collections.abc import AsyncIterator
+from contextlib import aclosing
+from typing import Any
+
+import httpx
+
+from ...utils import metrics, resilience
+from .ollama_client import OLLAMA_BASE_URL, OLLAMA_READ_TIMEOUT, OllamaClient
+
+logger = logging.getLogger(__name__)
+
+# Список инстансов Ollama: "http://gpu1:11434=qwen2.5:0.5b|llama3.1:8b,http://gpu2:11434".
+# Без списка моделей инстанс обслуживает любую модель.
+OLLAMA_BACKENDS = os.getenv("OLLAMA_BACKENDS", "")
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+# Сколько ошибок подряд выводит инстанс из ротации
+OLLAMA_EJECT_AFTER = int(os.getenv("OLLAMA_EJECT_AFTER", "3"))
+# Сколько успешных проверок подряд возвращает его обратно
+OLLAMA_READMIT_AFTER = int(os.getenv("OLLAMA_READMIT_AFTER", "2"))
+# Попыток на запрос, если отказали все инстансы, и пауза перед первым повтором
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "3"))
+OLLAMA_RETRY_DELAY = float(os.getenv("OLLAMA_RETRY_DELAY", "0.2"))
+# Общий таймаут нестримингового запроса (все инстансы); поток ограничен таймаутом чтения
+OLLAMA_CALL_TIMEOUT = float(os.getenv("OLLAMA_CALL_TIMEOUT", str(OLLAMA_READ_TIMEOUT)))
+
+# Ошибки, после которых запрос можно безопасно повторить на другом инстансе
+_BACKEND_ERRORS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.PoolTimeout,
+    httpx.RemoteProtocolError,
+)
+
+OLLAMA_FAILOVERS = metrics.counter(
+    "ollama_failovers_total", "Requests retried on another Ollama backend", ["backend"]
+)
+
+
+class NoBackendAvailable(Exception):
+    """Нет ни одного здорового инстанса Ollama для модели"""
+
+
+def parse_backends(raw: str) -> list[tuple[str, list[str] | None]]:
+    backends = []
+    for item in raw.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, models = item.partition("=")
+        model_list = [m.strip() for m in models.split("|") if m.strip()] or None
+        backends.append((url.strip(), model_list))
+    return backends
+
+
+class Backend:
+    """Инстанс Ollama и его состояние в балансировщике"""
+
+    def __init__(self, client: OllamaClient, models: list[str] | None) -> None:
+        self.client = client
+        self.models = set(models) if models else None
+        self.healthy = True
+        self.outstanding = 0
+        self.total_requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.ejected_at: float | None = None
+        self._probe_client: Any = None
+
+    @property
+    def url(self) -> str:
+        return self.client.base_url
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "url": self.url,
+            "models": sorted(self.models) if self.models else "*",
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "total_requests": self.total_requests,
+            "failures": self.failures,
+            "ejected_for_seconds": (
+                round(time.monotonic() - self.ejected_at, 1) if self.ejected_at else None
+            ),
+            "pool": self.client.pool_stats(),
+        }
+
+
+class OllamaRouter:
+    """Балансировщик генераций между несколькими инстансами Ollama.
+
+    Предоставляет тот же интерфейс, что и OllamaClient. Каждый запрос уходит
+    на здоровый инстанс с наименьшим числом выполняющихся запросов. Инстанс
+    выводится из ротации после нескольких ошибок подряд и возвращается после
+    успешных фоновых проверок (utils/ollama.check_connection). Если инстанс
+    отказал до начала ответа, запрос незаметно для клиента повторяется на
+    другом.
+
+    Если отказали все инстансы, запрос повторяется с паузой (OLLAMA_RETRIES),
+    а после нескольких таких отказов подряд автомат защиты "ollama"
+    (utils/resilience.py) сразу отклоняет запросы с CircuitOpen.
+    """
+
+    def __init__(
+        self,
+        backends: list[tuple[str, list[str] | None]],
+        eject_after: int = OLLAMA_EJECT_AFTER,
+        readmit_after: int = OLLAMA_READMIT_AFTER,
+        health_interval: float = OLLAMA_HEALTH_INTERVAL,
+        retries: int = OLLAMA_RETRIES,
+        call_timeout: float = OLLAMA_CALL_TIMEOUT,
+        **client_kwargs: Any,
+    ) -> None:
+        if not backends:
+            raise ValueError("At least one Ollama backend is required")
+        self.backends = [
+            Backend(OllamaClient(base_url=url, **client_kwargs), models)
+            for url, models in backends
+        ]
+        self.eject_after = eject_after
+        self.readmit_after = readmit_after
+        self.health_interval = health_interval
+        self.retries = max(1, retries)
+        self.call_timeout = call_timeout
+        self.breaker = resilience.breaker("ollama")
+        self.failovers = 0
+        self._tie_breaker = itertools.count()
+        self._health_task: asyncio.Task | None = None
+
+    @classmethod
+    def from_env(cls, **kwargs: Any) -> "OllamaRouter":
+        backends = parse_backends(OLLAMA_BACKENDS) or [(OLLAMA_BASE_URL, None)]
+        return cls(backends, **kwargs)
+
+    @property
+    def clients(self) -> list[OllamaClient]:
+        return [backend.client for backend in self.backends]
+
+    @property
+    def base_url(self) -> str:
+        return self.backends[0].url
+
+    def backend_count(self, model: str) -> int:
+        """Сколько инстансов обслуживают модель (для лимитов планировщика)"""
+        return max(1, sum(1 for b in self.backends if b.serves(model)))
+
+    def models_for(self, client: OllamaClient, models: list[str]) -> list[str]:
+        backend = next(b for b in self.backends if b.client is client)
+        return [model for model in models if backend.serves(model)]
+
+    def _pick(self, model: str | None, exclude: set[int]) -> Backend:
+        candidates = [
+            b
+            for i, b in enumerate(self.backends)
+            if i not in exclude and b.healthy and (model is None or b.serves(model))
+        ]
+        if not candidates:
+            raise NoBackendAvailable(f"No healthy Ollama backend for model {model}")
+        # Меньше всего выполняющихся запросов, при равенстве - по кругу
+        offset = next(self._tie_breaker)
+        count = len(candidates)
+        return min(
+            (candidates[(offset + i) % count] for i in range(count)),
+            key=lambda b: b.outstanding,
+        )
+
+    def _pick_or_raise(
+        self, model: str | None, tried: set[int], last_error: Exception | None
+    ) -> Backend:
+        try:
+            return self._pick(model, tried)
+        except NoBackendAvailable:
+            # Все инстансы перепробованы - отдаем настоящую ошибку последнего
+            if last_error is not None:
+                raise last_error
+            raise
+
+    def _record_success(self, backend: Backend) -> None:
+        backend.consecutive_failures = 0
+
+    def _record_failure(self, backend: Backend, error: Exception) -> None:
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        backend.consecutive_successes = 0
+        if backend.healthy and backend.consecutive_failures >= self.eject_after:
+            backend.healthy = False
+            backend.ejected_at = time.monotonic()
+            logger.warning("Ejected Ollama backend %s: %s", backend.url, error)
+
+    @staticmethod
+    def _is_backend_error(error: Exception) -> bool:
+        if isinstance(error, _BACKEND_ERRORS):
+            return True
+        return (
+            isinstance(error, httpx.HTTPStatusError)
+            and error.response.status_code >= 500
+        )
+
+    def _is_outage(self, error: Exception) -> bool:
+        """Отказ Ollama, а не ошибка запроса (неизвестная модель, 4xx)"""
+        return isinstance(error, (NoBackendAvailable, httpx.TimeoutException)) or self._is_backend_error(error)
+
+    async def _call(self, method: str, payload: dict[str, Any]) -> Any:
+        return await resilience.acall(
+            f"ollama.{method}",
+            lambda: self._call_with_failover(method, payload),
+            breaker=self.breaker,
+            timeout=self.call_timeout,
+            tries=self.retries,
+            delay=OLLAMA_RETRY_DELAY,
+            retry_on=self._is_backend_error,
+            is_failure=self._is_outage,
+        )
+
+    async def _call_with_failover(self, method: str, payload: dict[str, Any]) -> Any:
+        tried: set[int] = set()
+        last_error: Exception | None = None
+        while True:
+            backend = self._pick_or_raise(payload.get("model"), tried, last_error)
+            tried.add(self.backends.index(backend))
+            backend.outstanding += 1
+            backend.total_requests += 1
+            try:
+                result = await getattr(backend.client, method)(payload)
+                self._record_success(backend)
+                return result
+            except Exception as e:
+                if not self._is_backend_error(e):
+                    raise
+                self._record_failure(backend, e)
+                self.failovers += 1
+                OLLAMA_FAILOVERS.labels(backend.url).inc()
+                last_error = e
+                logger.warning("Ollama backend %s failed, failing over: %s", backend.url, e)
+            finally:
+                backend.outstanding -= 1
+
+    async def generate(self, payload: dict[str, Any]) -> dict[str, Any]:
+        return await self._call("generate", payload)
+
+    async def chat(self, payload: dict[str, Any]) -> dict[str, Any]:
+        return await self._call("chat", payload)
+
+    async def stream_lines(
+        self, path: str, payload: dict[str, Any]
+    ) -> AsyncIterator[str]:
+        lines = resilience.astream(
+            f"ollama.stream{path}",
+            lambda: self._stream_with_failover(path, payload),
+            breaker=self.breaker,
+            tries=self.retries,
+            delay=OLLAMA_RETRY_DELAY,
+            retry_on=self._is_backend_error,
+            is_failure=self._is_outage,
+        )
+        async with aclosing(lines):
+            async for line in lines:
+                yield line
+
+    async def _stream_with_failover(
+        self, path: str, payload: dict[str, Any]
+    ) -> AsyncIterator[str]:
+        tried: set[int] = set()
+        last_error: Exception | None = None
+        while True:
+            backend = self._pick_or_raise(payload.get("model"), tried, last_error)
+            tried.add(self.backends.index(backend))
+            backend.outstanding += 1
+            backend.total_requests += 1
+            started = False
+            try:
+                async with aclosing(backend.client.stream_lines(path, payload)) as lines:
+                    async for line in lines:
+                        started = True
+                        yield line
+                self._record_success(backend)
+                return
+            except Exception as e:
+                if not self._is_backend_error(e):
+                    raise
+                self._record_failure(backend, e)
+                # После первых токенов повтор продублировал бы ответ
+                if started:
+                    raise
+                self.failovers += 1
+                OLLAMA_FAILOVERS.labels(backend.url).inc()
+                last_error = e
+                logger.warning("Ollama backend %s failed, failing over: %s", backend.url, e)
+            finally:
+                backend.outstanding -= 1
+
+    async def stream(
+        self, path: str, payload: dict[str, Any]
+    ) -> AsyncIterator[dict[str, Any]]:
+        async with aclosing(self.stream_lines(path, payload)) as lines:
+            async for line in lines:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping malformed Ollama chunk: %r", line[:200])
+
+    async def tags(self) -> dict[str, Any]:
+        """Объединенный список моделей со всех здоровых инстансов"""
+        models: dict[str, Any] = {}
+        for backend in self.backends:
+            if not backend.healthy:
+                continue
+            try:
+                for model in (await backend.client.tags()).get("models", []):
+                    models.setdefault(model.get("model") or model.get("name"), model)
+            except httpx.HTTPError as e:
+                self._record_failure(backend, e)
+        if not models and not any(b.healthy for b in self.backends):
+            raise NoBackendAvailable("No healthy Ollama backend")
+        return {"models": list(models.values())}
+
+    async def ps(self) -> dict[str, Any]:
+        """Загруженные модели по инстансам; недоступный инстанс - ошибка в его записи"""
+        running: list[Any] = []
+        backends: dict[str, Any] = {}
+        for backend in self.backends:
+            if not backend.healthy:
+                backends[backend.url] = {"error": "ejected"}
+                continue
+            try:
+                models = (await backend.client.ps()).get("models", [])
+            except httpx.HTTPError as e:
+                self._record_failure(backend, e)
+                backends[backend.url] = {"error": f"{type(e).__name__}: {e}"}
+                continue
+            running.extend({**model, "backend": backend.url} for model in models)
+            backends[backend.url] = {"models": [m.get("model") or m.get("name") for m in models]}
+        return {"models": running, "backends": backends}
+
+    async def _probe(self, backend: Backend) -> None:
+        from ollama import Client  # type: ignore
+
+        from ...utils.ollama import check_connection
+
+        if backend._probe_client is None:
+            backend._probe_client = Client(host=backend.url, timeout=5)
+        # Одна попытка без retry: повторы обеспечивает сам цикл проверок
+        probe = getattr(check_connection, "__wrapped__", check_connection)
+        try:
+            ok = await asyncio.to_thread(probe, backend._probe_client)
+        except Exception as e:
+            ok = False
+            logger.debug("Health probe failed for %s: %s", backend.url, e)
+
+        if not ok:
+            self._record_failure(backend, RuntimeError("health probe failed"))
+            return
+        backend.consecutive_failures = 0
+        backend.consecutive_successes += 1
+        if not backend.healthy and backend.consecutive_successes >= self.readmit_after:
+            backend.healthy = True
+            backend.ejected_at = None
+            logger.info("Re-admitted Ollama backend %s", backend.url)
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.gather(*(self._probe(b) for b in self.backends))
+            await asyncio.sleep(self.health_interval)
+
+    def start_health_checks(self) -> None:
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    def pool_stats(self) -> dict[str, Any]:
+        return {
+            "failovers": self.failovers,
+            "breaker": self.breaker.snapshot(),
+            "backends": [backend.stats() for backend in self.backends],
+        }
+
+    async def aclose(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        await asyncio.gather(*(client.aclose() for client in self.clients))
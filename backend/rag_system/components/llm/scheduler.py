@@ -0,0 +1,294 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "2"))
+# Переопределения для отдельных моделей: "llama3.1:8b=1,qwen2.5:0.5b=4"
+LLM_MAX_IN_FLIGHT_PER_MODEL = os.getenv("LLM_MAX_IN_FLIGHT_PER_MODEL", "")
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))
+
+_WAIT_SAMPLES = 512
+
+
+class Priority(IntEnum):
+    """Приоритет генерации: меньшее значение обслуживается раньше"""
+
+    INTERACTIVE = 0
+    NORMAL = 1
+    BATCH = 2
+
+    @classmethod
+    def parse(cls, value: str | None, default: "Priority") -> "Priority":
+        if not value:
+            return default
+        try:
+            return cls[value.strip().upper()]
+        except KeyError:
+            return default
+
+
+class SchedulerOverloaded(Exception):
+    """Очередь генераций переполнена или ожидание слота истекло"""
+
+    def __init__(self, model: str, reason: str, retry_after: float, status_code: int):
+        super().__init__(f"LLM scheduler overloaded for model {model}: {reason}")
+        self.model = model
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+@dataclass
+class Ticket:
+    model: str
+    priority: Priority
+    granted_at: float = 0.0
+    released: bool = False
+
+
+@dataclass
+class _ModelState:
+    max_in_flight: int
+    in_flight: int = 0
+    waiting: int = 0
+    heap: list = field(default_factory=list)
+    admitted: int = 0
+    rejected: int = 0
+    timed_out: int = 0
+    preempted: int = 0
+    # Экспоненциальное среднее времени удержания слота, для Retry-After
+    avg_hold: float = 5.0
+    waits: deque = field(default_factory=lambda: deque(maxlen=_WAIT_SAMPLES))
+
+
+def _parse_model_limits(raw: str) -> dict[str, int]:
+    limits = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        model, value = item.rsplit("=", 1)
+        try:
+            limits[model.strip()] = int(value)
+        except ValueError:
+            logger.warning("Ignoring invalid in-flight limit %r", item)
+    return limits
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class GenerationScheduler:
+    """Контроль допуска генераций перед Ollama.
+
+    Для каждой модели ограничивает число одновременных генераций, а остальные
+    запросы ставит в ограниченную очередь с приоритетами. Если очередь полна,
+    запрос сразу отклоняется с SchedulerOverloaded (429), если слот не
+    освободился за queue_timeout - тоже отклоняется (503). Интерактивный
+    запрос может вытеснить из полной очереди ожидающий запрос с более
+    низким приоритетом.
+
+    При нескольких воркерах (workers > 1) у каждого свой планировщик, поэтому
+    лимиты и длина очереди делятся между ними: в сумме к Ollama уходит не
+    больше max_in_flight генераций на инстанс (но не меньше одной на воркер).
+    Приоритеты соблюдаются только внутри воркера.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = LLM_MAX_IN_FLIGHT,
+        max_queue: int = LLM_MAX_QUEUE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+        model_limits: dict[str, int] | None = None,
+        backends_for: Callable[[str], int] | None = None,
+        workers: int = 1,
+    ) -> None:
+        self.max_in_flight = max_in_flight
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue // self.workers)
+        self.queue_timeout = queue_timeout
+        self.model_limits = (
+            model_limits
+            if model_limits is not None
+            else _parse_model_limits(LLM_MAX_IN_FLIGHT_PER_MODEL)
+        )
+        # Число инстансов Ollama с моделью: лимит задается на один инстанс
+        self.backends_for = backends_for
+        self._models: dict[str, _ModelState] = {}
+        self._sequence = itertools.count()
+
+    def _state(self, model: str) -> _ModelState:
+        state = self._models.get(model)
+        if state is None:
+            limit = self.model_limits.get(model, self.max_in_flight)
+            if self.backends_for is not None:
+                limit *= self.backends_for(model)
+            state = _ModelState(max_in_flight=max(1, limit // self.workers))
+            self._models[model] = state
+        return state
+
+    def _retry_after(self, state: _ModelState) -> float:
+        return state.avg_hold * (state.waiting + 1) / state.max_in_flight
+
+    def _overloaded(self, model: str, state: _ModelState, reason: str, status: int):
+        return SchedulerOverloaded(
+            model, reason, math.ceil(self._retry_after(state)), status
+        )
+
+    def _preempt_lower(self, state: _ModelState, priority: Priority) -> bool:
+        """Вытесняет из очереди самый низкоприоритетный ожидающий запрос.
+
+        Место в очереди освобождается сразу, а не когда вытесненный запрос
+        проснется: иначе новый запрос на время превысил бы max_queue.
+        """
+        victim = None
+        for entry in state.heap:
+            future = entry[2]
+            if future.done() or entry[0] <= priority:
+                continue
+            if victim is None or entry[:2] > victim[:2]:
+                victim = entry
+        if victim is None:
+            return False
+        state.heap.remove(victim)
+        heapq.heapify(state.heap)
+        state.waiting -= 1
+        state.preempted += 1
+        victim[2].set_exception(
+            self._overloaded(victim[3], state, "preempted by higher priority", 503)
+        )
+        return True
+
+    async def acquire(
+        self, model: str, priority: Priority = Priority.NORMAL
+    ) -> Ticket:
+        """Ждет свободный слот генерации для модели"""
+        state = self._state(model)
+        ticket = Ticket(model=model, priority=priority)
+        enqueued_at = time.monotonic()
+
+        if state.in_flight < state.max_in_flight and state.waiting == 0:
+            state.in_flight += 1
+            return self._grant(state, ticket, enqueued_at)
+
+        if state.waiting >= self.max_queue and not self._preempt_lower(state, priority):
+            state.rejected += 1
+            raise self._overloaded(model, state, "queue is full", 429)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(state.heap, (priority, next(self._sequence), future, model))
+        state.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if self._preempted(future):
+                # Вытеснен одновременно с таймаутом, очередь уже учла это
+                state.rejected += 1
+                raise future.exception()
+            if not self._granted(future):
+                future.cancel()
+                state.waiting -= 1
+                state.timed_out += 1
+                raise self._overloaded(model, state, "queue wait timed out", 503)
+        except SchedulerOverloaded:
+            # Вытеснен: из очереди его уже убрал _preempt_lower
+            state.rejected += 1
+            raise
+        except asyncio.CancelledError:
+            if not self._preempted(future):
+                state.waiting -= 1
+            if self._granted(future):
+                # Слот уже передан этому запросу - отдаем его следующему
+                self._hand_off(state)
+            else:
+                future.cancel()
+            raise
+        state.waiting -= 1
+        return self._grant(state, ticket, enqueued_at)
+
+    @staticmethod
+    def _granted(future: asyncio.Future) -> bool:
+        return future.done() and not future.cancelled() and future.exception() is None
+
+    @staticmethod
+    def _preempted(future: asyncio.Future) -> bool:
+        return future.done() and not future.cancelled() and future.exception() is not None
+
+    def _grant(self, state: _ModelState, ticket: Ticket, enqueued_at: float) -> Ticket:
+        now = time.monotonic()
+        ticket.granted_at = now
+        state.admitted += 1
+        state.waits.append(now - enqueued_at)
+        return ticket
+
+    def _hand_off(self, state: _ModelState) -> None:
+        """Передает освободившийся слот следующему ожидающему"""
+        while state.heap:
+            _, _, future, _ = heapq.heappop(state.heap)
+            if not future.done():
+                future.set_result(None)
+                return
+        state.in_flight -= 1
+
+    def release(self, ticket: Ticket) -> None:
+        """Вернуть слот; повторный вызов для того же билета ничего не делает"""
+        if ticket.released:
+            return
+        ticket.released = True
+        state = self._state(ticket.model)
+        held = time.monotonic() - ticket.granted_at
+        state.avg_hold = 0.8 * state.avg_hold + 0.2 * held
+        self._hand_off(state)
+
+    @asynccontextmanager
+    async def slot(
+        self, model: str, priority: Priority = Priority.NORMAL
+    ) -> AsyncIterator[Ticket]:
+        ticket = await self.acquire(model, priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> dict[str, Any]:
+        """Глубина очередей и время ожидания по моделям"""
+        models = {}
+        for model, state in self._models.items():
+            waits = sorted(state.waits)
+            models[model] = {
+                "max_in_flight": state.max_in_flight,
+                "in_flight": state.in_flight,
+                "queue_depth": state.waiting,
+                "admitted": state.admitted,
+                "rejected": state.rejected,
+                "timed_out": state.timed_out,
+                "preempted": state.preempted,
+                "avg_generation_seconds": round(state.avg_hold, 3),
+                "wait_seconds": {
+                    "p50": round(_percentile(waits, 0.50), 4),
+                    "p95": round(_percentile(waits, 0.95), 4),
+                    "max": round(waits[-1], 4) if waits else 0.0,
+                },
+            }
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "models": models,
+        }
@@ -0,0 +1,197 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Ключ метаданных фрагмента с id документа, из которого он получен
+DOC_ID_KEY = "kb_doc_id"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    file_name TEXT,
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_id TEXT PRIMARY KEY,
+    doc_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_by_doc ON chunks (doc_id);
+"""
+
+
+def legacy_doc_id(file_name: Optional[str]) -> str:
+    """Стабильный id для фрагментов, загруженных до появления id документов"""
+    return uuid.uuid5(uuid.NAMESPACE_URL, f"kb-file:{file_name or ''}").hex
+
+
+class DocumentIndex:
+    """Индекс документ -> id фрагментов в Chroma (SQLite рядом с базой).
+
+    По нему удаление и замена документа - это удаление фрагментов пачками
+    по id, без перебора метаданных коллекции, а список документов
+    листается страницами по курсору без загрузки всех метаданных.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.created = not self.path.exists()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(documents)")}
+            if "bytes" not in columns:
+                self._conn.execute("ALTER TABLE documents ADD COLUMN bytes INTEGER NOT NULL DEFAULT 0")
+        # Счетчики для статистики меняются вместе с таблицами, без запросов на чтение
+        self.documents = 0
+        self.chunks = 0
+        self.bytes = 0
+        self.file_chunks: Counter = Counter()
+        self._load_totals()
+
+    def _load_totals(self) -> None:
+        rows = self._conn.execute(
+            "SELECT file_name, COUNT(*), SUM(chunk_count), SUM(bytes) FROM documents GROUP BY file_name"
+        ).fetchall()
+        self.file_chunks = Counter({file_name: chunks for file_name, _, chunks, _ in rows})
+        self.documents = sum(row[1] for row in rows)
+        self.chunks = sum(row[2] for row in rows)
+        self.bytes = sum(row[3] for row in rows)
+
+    def _account(self, file_name: Optional[str], documents: int, chunks: int, size: int) -> None:
+        self.documents += documents
+        self.chunks += chunks
+        self.bytes += size
+        self.file_chunks[file_name] += chunks
+        if self.file_chunks[file_name] <= 0:
+            del self.file_chunks[file_name]
+
+    def _row_totals(self, doc_id: str) -> Optional[tuple]:
+        return self._conn.execute(
+            "SELECT file_name, chunk_count, bytes FROM documents WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+
+    def put(self, doc_id: str, file_name: Optional[str], chunk_ids: List[str], size: int = 0) -> None:
+        """Записать документ с новым набором фрагментов (старые забываются); size - байты текста"""
+        now = time.time()
+        with self._lock, self._conn:
+            previous = self._row_totals(doc_id)
+            self._conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, doc_id) VALUES (?, ?)",
+                ((chunk_id, doc_id) for chunk_id in chunk_ids),
+            )
+            # upsert сохраняет rowid, поэтому замена не сдвигает документ в списке
+            self._conn.execute(
+                "INSERT INTO documents (doc_id, file_name, chunk_count, bytes, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (doc_id) DO UPDATE SET "
+                "file_name = excluded.file_name, chunk_count = excluded.chunk_count, "
+                "bytes = excluded.bytes, updated_at = excluded.updated_at",
+                (doc_id, file_name, len(chunk_ids), size, now, now),
+            )
+            if previous is not None:
+                self._account(previous[0], -1, -previous[1], -previous[2])
+            self._account(file_name, 1, len(chunk_ids), size)
+
+    def remove(self, doc_id: str) -> bool:
+        with self._lock, self._conn:
+            previous = self._row_totals(doc_id)
+            self._conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            if previous is None:
+                return False
+            self._account(previous[0], -1, -previous[1], -previous[2])
+            return True
+
+    def chunk_ids(self, doc_id: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT chunk_id FROM chunks WHERE doc_id = ?", (doc_id,))
+            return [row[0] for row in rows]
+
+    def get(self, doc_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT doc_id, file_name, chunk_count, bytes, created_at, updated_at FROM documents WHERE doc_id = ?",
+                (doc_id,),
+            ).fetchone()
+        return self._as_dict(row) if row else None
+
+    def list(self, limit: int = 50, cursor: Optional[int] = None) -> Tuple[List[Dict], Optional[int]]:
+        """Страница документов в порядке загрузки и курсор следующей страницы"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid, doc_id, file_name, chunk_count, bytes, created_at, updated_at FROM documents "
+                "WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (cursor or 0, limit + 1),
+            ).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [self._as_dict(row[1:]) for row in rows[:limit]], next_cursor
+
+    def count(self) -> int:
+        return self.documents
+
+    def stats(self, top_files: int = 20) -> Dict:
+        with self._lock:
+            return {
+                "documents": self.documents,
+                "chunks": self.chunks,
+                "bytes": self.bytes,
+                "files": len(self.file_chunks),
+                "top_files_by_chunks": dict(self.file_chunks.most_common(top_files)),
+            }
+
+    def rebuild(self, pages: Iterable[Tuple[List[str], List[Dict], List[str]]]) -> int:
+        """Построить индекс заново по страницам (ids, metadatas, texts) коллекции.
+
+        Фрагменты без DOC_ID_KEY (загруженные раньше) группируются по имени файла.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM documents")
+            for ids, metadatas, texts in pages:
+                rows = []
+                for chunk_id, metadata, text in zip(ids, metadatas, texts):
+                    metadata = metadata or {}
+                    file_name = metadata.get("file_name")
+                    doc_id = metadata.get(DOC_ID_KEY) or legacy_doc_id(file_name)
+                    rows.append((chunk_id, doc_id, file_name, len((text or "").encode("utf-8"))))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunks (chunk_id, doc_id) VALUES (?, ?)",
+                    ((chunk_id, doc_id) for chunk_id, doc_id, _, _ in rows),
+                )
+                self._conn.executemany(
+                    "INSERT INTO documents (doc_id, file_name, chunk_count, bytes, created_at, updated_at) "
+                    "VALUES (?, ?, 1, ?, ?, ?) ON CONFLICT (doc_id) DO UPDATE SET "
+                    "chunk_count = chunk_count + 1, bytes = bytes + excluded.bytes",
+                    ((doc_id, file_name, size, now, now) for _, doc_id, file_name, size in rows),
+                )
+            self._load_totals()
+        logger.info("Rebuilt document index: %d documents", self.documents)
+        return self.documents
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _as_dict(row: tuple) -> Dict:
+        doc_id, file_name, chunk_count, size, created_at, updated_at = row
+        return {
+            "document_id": doc_id,
+            "file_name": file_name,
+            "chunk_count": chunk_count,
+            "bytes": size,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
@@ -0,0 +1,382 @@
+"""Синхронизация базы знаний с папками на файловом сервере.
+
+SYNC_DIRS - одна или несколько папок (через os.pathsep). Новые, измененные
+и удаленные файлы попадают в IngestComponent: изменения отслеживаются
+через watchdog (inotify, FSEvents, ReadDirectoryChangesW), а без него или
+при нехватке inotify watches - обходом папок раз в SYNC_POLL_INTERVAL.
+
+Состояние (mtime, размер, sha256, id документа) хранится в SQLite рядом
+с базой. При запуске папки обходятся только через stat: содержимое
+читается лишь у файлов, у которых изменились mtime или размер, а если
+хэш совпал (файл просто «тронули»), документ не загружается заново.
+
+Всплеск событий по файлу (копирование, сохранение в несколько приемов)
+схлопывается: файл уходит в обработку через SYNC_DEBOUNCE_SECONDS после
+последнего события. Загрузка идет в одном фоновом потоке через
+ограниченную очередь; когда она заполнена, новые изменения копятся в
+словаре ожидающих, по одной записи на файл.
+"""
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SYNC_DIRS = os.getenv("SYNC_DIRS", "")
+SYNC_EXTENSIONS = {
+    ext.strip().lower() for ext in os.getenv("SYNC_EXTENSIONS", ".pdf,.docx,.txt,.md,.json").split(",") if ext.strip()
+}
+SYNC_DEBOUNCE_SECONDS = float(os.getenv("SYNC_DEBOUNCE_SECONDS", "2"))
+SYNC_QUEUE_SIZE = int(os.getenv("SYNC_QUEUE_SIZE", "1000"))
+# Обход папок без watchdog; с watchdog - страховочный обход на случай потерянных событий
+SYNC_POLL_INTERVAL = float(os.getenv("SYNC_POLL_INTERVAL", "60"))
+SYNC_RESCAN_INTERVAL = float(os.getenv("SYNC_RESCAN_INTERVAL", "3600"))
+# 0 - только polling, даже если watchdog установлен
+SYNC_USE_WATCHDOG = os.getenv("SYNC_USE_WATCHDOG", "1") == "1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+"""
+
+
+class FileRecord:
+    __slots__ = ("mtime_ns", "size", "sha256", "doc_id")
+
+    def __init__(self, mtime_ns: int, size: int, sha256: str, doc_id: str):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.sha256 = sha256
+        self.doc_id = doc_id
+
+
+class SyncState:
+    """Синхронизированные файлы: SQLite на диске и копия в памяти для обходов"""
+
+    def __init__(self, path: Path):
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+        self.files: Dict[str, FileRecord] = {
+            row[0]: FileRecord(*row[1:])
+            for row in self._conn.execute("SELECT path, mtime_ns, size, sha256, doc_id FROM files")
+        }
+
+    def get(self, path: str) -> Optional[FileRecord]:
+        return self.files.get(path)
+
+    def put(self, path: str, record: FileRecord) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, mtime_ns, size, sha256, doc_id, synced_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (path, record.mtime_ns, record.size, record.sha256, record.doc_id, time.time()),
+            )
+        self.files[path] = record
+
+    def remove(self, path: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.files.pop(path, None)
+
+    def under(self, directory: str) -> List[str]:
+        prefix = directory.rstrip(os.sep) + os.sep
+        return [path for path in list(self.files) if path.startswith(prefix)]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sync_doc_id(path: str) -> str:
+    """Стабильный id документа для файла: замена версии не плодит дубликатов"""
+    return uuid.uuid5(uuid.NAMESPACE_URL, f"kb-sync:{path}").hex
+
+
+class _EventHandler:
+    """Обработчик watchdog: Observer вызывает dispatch(event) для каждого события"""
+
+    def __init__(self, sync: "FolderSync"):
+        self.sync = sync
+
+    def dispatch(self, event: Any) -> None:
+        paths = [event.src_path] + ([event.dest_path] if getattr(event, "dest_path", "") else [])
+        for path in paths:
+            path = os.fsdecode(path)
+            if event.is_directory:
+                # Папку переместили, удалили или скопировали целиком - сверяем все ее файлы
+                if event.event_type in ("created", "deleted", "moved"):
+                    self.sync.schedule_scan(path)
+            else:
+                self.sync.schedule(path)
+
+
+class FolderSync:
+    def __init__(
+        self,
+        ingest_component: Any,
+        roots: List[str],
+        state_path: Path,
+        debounce: float = SYNC_DEBOUNCE_SECONDS,
+        queue_size: int = SYNC_QUEUE_SIZE,
+        poll_interval: float = SYNC_POLL_INTERVAL,
+        rescan_interval: float = SYNC_RESCAN_INTERVAL,
+        use_watchdog: bool = SYNC_USE_WATCHDOG,
+    ):
+        self.ingest_component = ingest_component
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.state = SyncState(state_path)
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.use_watchdog = use_watchdog
+        self.mode = "polling"
+        # Путь -> когда обработать (time.monotonic()); новое событие отодвигает срок
+        self._pending: Dict[str, float] = {}
+        self._pending_scans: Set[str] = set()
+        self._changed = threading.Condition()
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._observer: Any = None
+        self._threads: List[threading.Thread] = []
+        self.counts = {"ingested": 0, "deleted": 0, "unchanged": 0, "failed": 0}
+        self.last_scan: Dict[str, Any] = {}
+
+    @classmethod
+    def from_env(cls, ingest_component: Any, data_dir: str) -> Optional["FolderSync"]:
+        """FolderSync по SYNC_DIRS или None, если синхронизация не настроена"""
+        roots = [root for root in SYNC_DIRS.split(os.pathsep) if root.strip()]
+        if not roots:
+            return None
+        return cls(ingest_component, roots, Path(data_dir) / "folder_sync.sqlite3")
+
+    # ==================== Обнаружение изменений ====================
+
+    def _supported(self, path: str) -> bool:
+        name = os.path.basename(path)
+        # Временные файлы Office и скрытые файлы
+        if name.startswith(("~$", ".")):
+            return False
+        return os.path.splitext(name)[1].lower() in SYNC_EXTENSIONS
+
+    def schedule(self, path: str, delay: Optional[float] = None) -> None:
+        if not self._supported(path):
+            return
+        with self._changed:
+            self._pending[os.path.abspath(path)] = time.monotonic() + (self.debounce if delay is None else delay)
+            self._changed.notify()
+
+    def schedule_scan(self, directory: str) -> None:
+        with self._changed:
+            self._pending_scans.add(os.path.abspath(directory))
+            self._changed.notify()
+
+    def _walk(self, root: str) -> Iterator[Tuple[str, os.stat_result]]:
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = os.scandir(directory)
+            except OSError as e:
+                logger.warning("Cannot list %s: %s", directory, e)
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not entry.name.startswith("."):
+                                stack.append(entry.path)
+                        elif entry.is_file() and self._supported(entry.name):
+                            yield entry.path, entry.stat()
+                    except OSError:
+                        continue
+
+    def scan(self, root: str) -> int:
+        """Сверить папку с состоянием только по stat; возвращает число измененных файлов"""
+        started = time.monotonic()
+        seen: Set[str] = set()
+        changed = 0
+        for path, stat in self._walk(root):
+            seen.add(path)
+            record = self.state.get(path)
+            if record is None or (record.mtime_ns, record.size) != (stat.st_mtime_ns, stat.st_size):
+                self.schedule(path, delay=0)
+                changed += 1
+        for path in self.state.under(root):
+            if path not in seen:
+                self.schedule(path, delay=0)
+                changed += 1
+        self.last_scan = {
+            "root": root,
+            "files": len(seen),
+            "changed": changed,
+            "seconds": round(time.monotonic() - started, 3),
+            "at": time.time(),
+        }
+        if changed:
+            logger.info("Folder scan of %s: %d files, %d changed", root, len(seen), changed)
+        return changed
+
+    def _start_watching(self) -> None:
+        if not self.use_watchdog:
+            return
+        try:
+            from watchdog.observers import Observer
+        except ImportError:
+            logger.info("watchdog is not installed, polling %s every %.0f s", self.roots, self.poll_interval)
+            return
+        observer = Observer()
+        handler = _EventHandler(self)
+        try:
+            for root in self.roots:
+                observer.schedule(handler, root, recursive=True)
+            observer.start()
+        except OSError as e:
+            # Например, закончились inotify watches (fs.inotify.max_user_watches)
+            logger.warning("File watching failed (%s), polling every %.0f s instead", e, self.poll_interval)
+            return
+        self._observer = observer
+        self.mode = "watchdog"
+
+    # ==================== Потоки ====================
+
+    def _dispatch_loop(self) -> None:
+        """Сроки дебаунса, обходы по расписанию и передача готовых файлов в очередь"""
+        interval = self.rescan_interval if self.mode == "watchdog" else self.poll_interval
+        next_scan = time.monotonic() + interval
+        while not self._stopping.is_set():
+            with self._changed:
+                now = time.monotonic()
+                due = [path for path, at in self._pending.items() if at <= now]
+                for path in due:
+                    del self._pending[path]
+                scans, self._pending_scans = self._pending_scans, set()
+                if not due and not scans and now < next_scan:
+                    wake_at = min([next_scan, *self._pending.values()])
+                    self._changed.wait(wake_at - now)
+                    continue
+            for directory in scans:
+                self.scan(directory)
+            if time.monotonic() >= next_scan:
+                for root in self.roots:
+                    self.scan(root)
+                next_scan = time.monotonic() + interval
+            for path in due:
+                # Очередь полна - ждем загрузчик; новые события тем временем копятся в _pending
+                while not self._stopping.is_set():
+                    try:
+                        self._queue.put(path, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+
+    def _worker_loop(self) -> None:
+        while True:
+            path = self._queue.get()
+            if path is None or self._stopping.is_set():
+                return
+            try:
+                self._sync_file(path)
+            except Exception as e:
+                self.counts["failed"] += 1
+                logger.error("Folder sync failed for %s: %s", path, e)
+
+    def _relative_name(self, path: str) -> str:
+        for root in self.roots:
+            if path.startswith(root.rstrip(os.sep) + os.sep):
+                return Path(os.path.relpath(path, root)).as_posix()
+        return os.path.basename(path)
+
+    def _sync_file(self, path: str) -> None:
+        record = self.state.get(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if record is not None:
+                self.ingest_component.delete_document(record.doc_id)
+                self.state.remove(path)
+                self.counts["deleted"] += 1
+                logger.info("Folder sync removed %s", path)
+            return
+        if record is not None and (record.mtime_ns, record.size) == (stat.st_mtime_ns, stat.st_size):
+            return
+
+        digest = _file_sha256(path)
+        if os.stat(path).st_mtime_ns != stat.st_mtime_ns:
+            # Файл еще пишется - вернемся после следующего дебаунса
+            self.schedule(path)
+            return
+        doc_id = record.doc_id if record is not None else sync_doc_id(path)
+        updated = FileRecord(stat.st_mtime_ns, stat.st_size, digest, doc_id)
+        if record is not None and record.sha256 == digest:
+            self.state.put(path, updated)
+            self.counts["unchanged"] += 1
+            return
+        if self.ingest_component.ingest_file(path, doc_id=doc_id, file_name=self._relative_name(path)):
+            self.state.put(path, updated)
+            self.counts["ingested"] += 1
+            logger.info("Folder sync ingested %s", path)
+        else:
+            # Состояние не обновляем: файл попадет в следующий обход
+            self.counts["failed"] += 1
+
+    def start(self) -> None:
+        self._start_watching()
+        for root in self.roots:
+            # Изменения, пока сервис не работал
+            self.schedule_scan(root)
+        for target, name in ((self._dispatch_loop, "folder-sync"), (self._worker_loop, "folder-sync-ingest")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Folder sync started for %s (%s)", self.roots, self.mode)
+
+    def close(self) -> None:
+        self._stopping.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        with self._changed:
+            self._changed.notify_all()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        for thread in self._threads:
+            thread.join(timeout=30)
+        self.state.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._changed:
+            pending = len(self._pending)
+        return {
+            "roots": self.roots,
+            "mode": self.mode,
+            "tracked_files": len(self.state.files),
+            "pending": pending,
+            "queued": self._queue.qsize(),
+            **self.counts,
+            "last_scan": self.last_scan,
+        }
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Как часто перепроверять внешние зависимости и сколько ждать ответа
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "5"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "3"))
+
+
+class ProbeResult:
+    """Последний результат одной проверки"""
+
+    def __init__(self) -> None:
+        self.ok: Optional[bool] = None
+        self.detail: Any = None
+        self.error: Optional[str] = None
+        self.latency_ms = 0.0
+        self.checked_at: Optional[float] = None
+
+    def status(self, stale_after: float) -> str:
+        if self.checked_at is None:
+            return "unknown"
+        if time.monotonic() - self.checked_at > stale_after:
+            # Фоновая проверка зависла или цикл остановлен
+            return "stale"
+        return "healthy" if self.ok else "unavailable"
+
+
+class HealthMonitor:
+    """Кэш проверок зависимостей, который обновляется в фоне.
+
+    /health и балансировщик читают готовые результаты и не ждут Ollama
+    или базу знаний: каждая проверка выполняется раз в interval секунд
+    в отдельной задаче, с таймаутом.
+    """
+
+    def __init__(self, interval: float = HEALTH_PROBE_INTERVAL, timeout: float = HEALTH_PROBE_TIMEOUT):
+        self.interval = interval
+        self.timeout = timeout
+        self.stale_after = interval * 3 + timeout
+        self._probes: Dict[str, Callable[[], Awaitable[Any]]] = {}
+        self._results: Dict[str, ProbeResult] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Set[asyncio.Task] = set()
+
+    def register(self, name: str, probe: Callable[[], Awaitable[Any]]) -> None:
+        """probe() возвращает подробности для ответа или бросает исключение"""
+        self._probes[name] = probe
+        self._results.setdefault(name, ProbeResult())
+        if self._task is not None:
+            # Зарегистрирована после старта (база знаний загрузилась) - проверить сразу, не ждать цикла
+            self._pending.add(asyncio.create_task(self._run_probe(name)))
+            self._pending = {task for task in self._pending if not task.done()}
+
+    async def _run_probe(self, name: str) -> None:
+        result = self._results[name]
+        started = time.monotonic()
+        try:
+            result.detail = await asyncio.wait_for(self._probes[name](), self.timeout)
+            result.ok = True
+            result.error = None
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if result.ok is not False:
+                logger.warning("Health probe %s failed: %s", name, error)
+            result.ok = False
+            result.error = error
+        result.latency_ms = round((time.monotonic() - started) * 1000, 2)
+        result.checked_at = time.monotonic()
+
+    async def refresh(self) -> None:
+        await asyncio.gather(*(self._run_probe(name) for name in list(self._probes)))
+
+    async def _loop(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in self._pending:
+            task.cancel()
+
+    def status(self, name: str) -> str:
+        result = self._results.get(name)
+        return result.status(self.stale_after) if result else "unknown"
+
+    def detail(self, name: str) -> Any:
+        result = self._results.get(name)
+        return result.detail if result and result.ok else None
+
+    def snapshot(self) -> Dict[str, Dict]:
+        now = time.monotonic()
+        return {
+            name: {
+                "status": result.status(self.stale_after),
+                "latency_ms": result.latency_ms,
+                "checked_seconds_ago": round(now - result.checked_at, 1) if result.checked_at else None,
+                "error": result.error,
+            }
+            for name, result in self._results.items()
+        }
@@ -0,0 +1,335 @@
+"""Общий процесс индекса для режима с несколькими воркерами.
+
+Каждый воркер uvicorn с обычным RAGService загружает свою копию модели
+эмбеддингов и открывает свой Chroma PersistentClient на той же папке.
+В многопроцессном режиме (API_WORKERS > 1 в app.py) модель и Chroma
+живут в одном процессе индекса - он единственный пишет в хранилище, -
+а воркеры ходят к нему через UNIX сокет (named pipe в Windows) с
+RemoteIngestComponent, у которого тот же интерфейс, что у IngestComponent.
+
+Общие у воркеров только модель и индекс. Сессии диалога, реестр запросов
+для отмены по id и планировщик генераций остаются в памяти каждого
+воркера, поэтому при API_WORKERS > 1 сессии и /api/rag/query/{id}/cancel
+отключены (501), а лимиты планировщика делятся на число воркеров.
+
+Запросы от всех воркеров попадают в один EmbeddingDispatcher и считаются
+общими батчами. Кэшей индекса у воркеров нет, поэтому после записи им
+нечего сбрасывать: следующий поиск уже идет по новому индексу.
+
+Отдельный запуск (из папки backend):
+
+    RAG_INDEX_AUTHKEY=... python -m rag_system.index_server --data-dir ./data
+    RAG_INDEX_AUTHKEY=... RAG_INDEX_ADDRESS=./data/index.sock API_WORKERS=4 uvicorn app:app --workers 4
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Сколько воркер ждет процесс индекса при старте (загрузка модели эмбеддингов)
+RAG_INDEX_CONNECT_TIMEOUT = float(os.getenv("RAG_INDEX_CONNECT_TIMEOUT", "120"))
+
+# Методы IngestComponent, доступные воркерам
+EXPOSED_METHODS = {
+    "query_with_scores",
+    "ingest_file",
+    "get_stats",
+    "health_check",
+    "embed_texts",
+    "embedding_stats",
+    "flush",
+    "export_snapshot",
+    "import_snapshot",
+    "delete_document",
+    "get_document",
+    "list_documents",
+    "collect_metrics",
+}
+
+
+class IndexServerError(RuntimeError):
+    """Процесс индекса недоступен или вернул ошибку"""
+
+
+class IndexReplyError(IndexServerError):
+    """Вызов в процессе индекса выполнен, но его результат не удалось передать.
+
+    Повторять вызов нельзя: изменения (загрузка, удаление) уже сделаны.
+    """
+
+
+def index_address() -> Optional[str]:
+    """Адрес процесса индекса, если воркер работает в многопроцессном режиме"""
+    return os.getenv("RAG_INDEX_ADDRESS") or None
+
+
+def default_address(data_dir: str = "./data") -> str:
+    if sys.platform == "win32":
+        return r"\\.\pipe\corporate-assistant-index"
+    return str(Path(data_dir) / "index.sock")
+
+
+def _authkey() -> bytes:
+    authkey = os.getenv("RAG_INDEX_AUTHKEY")
+    if not authkey:
+        raise IndexServerError("RAG_INDEX_AUTHKEY is not set")
+    return authkey.encode()
+
+
+def _is_running(address: str, authkey: bytes) -> bool:
+    try:
+        Client(address, authkey=authkey).close()
+        return True
+    except AuthenticationError:
+        # Слушает процесс с другим ключом - это все равно занятый адрес
+        return True
+    except (OSError, EOFError):
+        return False
+
+
+class IndexServer:
+    """Сервер поверх IngestComponent: поток на соединение, вызовы по имени метода"""
+
+    def __init__(self, ingest_component: Any, address: str, authkey: bytes):
+        self.ingest_component = ingest_component
+        self.address = address
+        self.authkey = authkey
+        self.connections = 0
+        self.calls: Dict[str, int] = {}
+        self._listener: Optional[Listener] = None
+
+    def _listen(self) -> Listener:
+        if _is_running(self.address, self.authkey):
+            # Писатель в хранилище должен быть один
+            raise IndexServerError(f"Index server is already running at {self.address}")
+        if sys.platform != "win32" and os.path.exists(self.address):
+            # Сокет от упавшего процесса
+            os.unlink(self.address)
+        listener = Listener(self.address, authkey=self.authkey)
+        if sys.platform != "win32":
+            os.chmod(self.address, 0o600)
+        return listener
+
+    def _handle(self, conn: Connection) -> None:
+        with conn:
+            while True:
+                try:
+                    method, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                self.calls[method] = self.calls.get(method, 0) + 1
+                try:
+                    if method not in EXPOSED_METHODS:
+                        raise IndexServerError(f"Method {method} is not exposed")
+                    reply = (True, getattr(self.ingest_component, method)(*args))
+                except Exception as e:
+                    logger.warning("Index call %s failed: %s", method, e)
+                    # Исключение передается воркеру как есть, чтобы API ответил тем же кодом
+                    reply = (False, e)
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    return
+                except Exception as e:
+                    # Ответ не сериализуется; send сначала сериализует, так что в сокет ничего не ушло
+                    if reply[0]:
+                        logger.error("Index call %s succeeded but its result cannot be sent: %s", method, e)
+                        failure = IndexReplyError(
+                            f"Index call {method} succeeded but its result cannot be sent: "
+                            f"{type(e).__name__}: {e}"
+                        )
+                    else:
+                        # Исключение не сериализуется - отправляем текст
+                        failure = f"{type(reply[1]).__name__}: {reply[1]}"
+                    try:
+                        conn.send((False, failure))
+                    except (EOFError, OSError):
+                        return
+
+    def serve_forever(self) -> None:
+        self._listener = self._listen()
+        logger.info("Index server listening on %s", self.address)
+        while True:
+            try:
+                conn = self._listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                if self._listener is None:
+                    return
+                # Клиент с неверным ключом или оборванное рукопожатие
+                logger.warning("Rejected index connection: %s", e)
+                continue
+            self.connections += 1
+            threading.Thread(target=self._handle, args=(conn,), name="index-conn", daemon=True).start()
+
+    def close(self) -> None:
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.close()
+
+
+class RemoteIngestComponent:
+    """Клиент процесса индекса с интерфейсом IngestComponent.
+
+    Соединение нельзя использовать из двух потоков сразу, поэтому
+    держим пул: поток берет свободное соединение или открывает новое.
+    """
+
+    def __init__(self, address: str, authkey: Optional[bytes] = None,
+                 connect_timeout: float = RAG_INDEX_CONNECT_TIMEOUT):
+        self.address = address
+        self.authkey = authkey or _authkey()
+        self.connection_errors = 0
+        self._idle: List[Connection] = []
+        self._lock = threading.Lock()
+        self._wait_until_available(connect_timeout)
+
+    def _connect(self) -> Connection:
+        try:
+            return Client(self.address, authkey=self.authkey)
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise IndexServerError(f"Index server at {self.address} is unavailable: {e}") from e
+
+    def _wait_until_available(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._idle.append(self._connect())
+                break
+            except IndexServerError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+        logger.info("Connected to index server at %s", self.address)
+
+    def call(self, method: str, *args: Any) -> Any:
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+        try:
+            conn.send((method, args))
+            ok, payload = conn.recv()
+        except (EOFError, OSError) as e:
+            # Без повтора: неизвестно, выполнил ли процесс индекса вызов
+            # (ingest_file без doc_id загрузил бы файл второй раз)
+            conn.close()
+            self.connection_errors += 1
+            raise IndexServerError(f"Index server call {method} failed: {e}") from e
+        with self._lock:
+            self._idle.append(conn)
+        if not ok:
+            raise payload if isinstance(payload, Exception) else IndexServerError(payload)
+        return payload
+
+    def query_with_scores(self, question: str, top_k: int = 5) -> list:
+        return self.call("query_with_scores", question, top_k)
+
+    def query(self, question: str, top_k: int = 5) -> list:
+        return [doc.node for doc in self.query_with_scores(question, top_k)]
+
+    def ingest_file(self, file_path: str, doc_id: Optional[str] = None, file_name: Optional[str] = None) -> bool:
+        # Путь должен быть виден процессу индекса - он на той же машине
+        return self.call("ingest_file", str(Path(file_path).resolve()), doc_id, file_name)
+
+    def delete_document(self, doc_id: str) -> bool:
+        return self.call("delete_document", doc_id)
+
+    def get_document(self, doc_id: str) -> Optional[dict]:
+        return self.call("get_document", doc_id)
+
+    def list_documents(self, limit: int = 50, cursor: Optional[int] = None) -> dict:
+        return self.call("list_documents", limit, cursor)
+
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        return self.call("embed_texts", texts)
+
+    def embedding_stats(self) -> dict:
+        return self.call("embedding_stats")
+
+    def collect_metrics(self) -> dict:
+        return self.call("collect_metrics")
+
+    def get_stats(self) -> dict:
+        try:
+            stats = self.call("get_stats")
+        except IndexServerError as e:
+            return {"document_count": 0, "error": str(e), "status": "error"}
+        stats["index_server"] = {"address": self.address, "connection_errors": self.connection_errors}
+        return stats
+
+    def health_check(self) -> dict:
+        try:
+            return self.call("health_check")
+        except IndexServerError as e:
+            return {"status": "unhealthy", "error": str(e)}
+
+    def flush(self) -> None:
+        self.call("flush")
+
+    def export_snapshot(self, path: str) -> dict:
+        return self.call("export_snapshot", str(Path(path).resolve()))
+
+    def import_snapshot(self, path: str, replace: bool = False) -> dict:
+        return self.call("import_snapshot", str(Path(path).resolve()), replace)
+
+    def close(self) -> None:
+        # Сохранение при остановке делает сам процесс индекса
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def run_server(data_dir: str = "./data", address: Optional[str] = None) -> None:
+    """Точка входа процесса индекса: загрузить модель и Chroma, обслуживать воркеров"""
+    logging.basicConfig(level=logging.INFO)
+    from .folder_sync import FolderSync
+    from .ingest_component import IngestComponent
+
+    address = address or index_address() or default_address(data_dir)
+    ingest_component = IngestComponent(persist_dir=data_dir)
+    server = IndexServer(ingest_component, address, _authkey())
+    # Синхронизация с папками (SYNC_DIRS) - здесь, а не в воркерах: писатель один
+    folder_sync = FolderSync.from_env(ingest_component, data_dir)
+    if folder_sync is not None:
+        ingest_component.folder_sync = folder_sync
+        folder_sync.start()
+    # terminate() из app.py: выходим через finally, чтобы сохранить индекс
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.close()
+        if folder_sync is not None:
+            folder_sync.close()
+        ingest_component.close()
+
+
+def start_index_process(data_dir: str = "./data") -> multiprocessing.Process:
+    """Запустить процесс индекса и передать воркерам адрес и ключ через окружение"""
+    os.environ.setdefault("RAG_INDEX_ADDRESS", default_address(data_dir))
+    os.environ.setdefault("RAG_INDEX_AUTHKEY", secrets.token_hex(16))
+    process = multiprocessing.Process(
+        target=run_server, args=(data_dir, os.environ["RAG_INDEX_ADDRESS"]), name="rag-index"
+    )
+    process.start()
+    return process
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default="./data")
+    parser.add_argument("--address", default=None)
+    args = parser.parse_args()
+    run_server(args.data_dir, args.address)
@@ -1,25 +1,71 @@
 import logging
+import os
+import threading
 import time
+import uuid
 from pathlib import Path
-from typing import List
-from llama_index.core import VectorStoreIndex
-from llama_index.core.schema import Document
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from typing import Dict, List, Optional
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import (
+    Document,
+    MetadataMode,
+    NodeRelationship,
+    NodeWithScore,
+    QueryBundle,
+    RelatedNodeInfo,
+    TextNode,
+)
 from llama_index.core.storage import StorageContext
 from llama_index.vector_stores.chroma import ChromaVectorStore
 import chromadb
 
-from .ingest_helper import IngestionHelper
+from .document_index import DOC_ID_KEY, DocumentIndex
+from .ingest_helper import INGEST_STAGE_SECONDS, IngestionHelper
+from .persistence import GroupCommit, IngestJournal
+from .profiling import track_allocations
+from .snapshot import export_snapshot, import_snapshot, replace_from_snapshot
+from .components.embedding.batching import BatchingEmbedding
+from .components.embedding.embedding_component import describe_embed_model
+from .utils import metrics, resilience
+from .utils.chroma import batched, max_batch_size
+from .utils.resilience import CircuitOpen
+from .utils.retry import RETRIES
 
 logger = logging.getLogger(__name__)
 
+KB_QUERY_SECONDS = metrics.histogram(
+    "kb_query_seconds", "Knowledge base search stages: embed (query vector), search (Chroma)", ["stage"]
+)
+KB_ERRORS = metrics.counter("kb_errors_total", "Knowledge base operations failed after all attempts", ["operation"])
+
+COLLECTION_NAME = "corporate_docs"
+# Как часто пересчитывать размер базы на диске
+KB_DISK_USAGE_TTL = float(os.getenv("KB_DISK_USAGE_TTL", "30"))
+# Пауза перед первым повтором операции с Chroma; дальше растет вдвое, со случайным разбросом
+CHROMA_RETRY_DELAY = float(os.getenv("CHROMA_RETRY_DELAY", "0.2"))
+CHROMA_RETRY_MAX_DELAY = float(os.getenv("CHROMA_RETRY_MAX_DELAY", "2"))
+
 class IngestComponent:
     def __init__(self, persist_dir: str = "./data/chroma_db", max_retries: int = 3):
         self.persist_dir = Path(persist_dir)
         self.persist_dir.mkdir(parents=True, exist_ok=True)
         self.max_retries = max_retries
+        # Пока Chroma отказывает, поиск и запись отклоняются сразу, без повторов
+        self.breaker = resilience.breaker("chroma")
+        # FolderSync, если задан SYNC_DIRS; запускает и закрывает владелец компонента
+        self.folder_sync = None
         
         self.ingestion_helper = IngestionHelper()
+        # Эмбеддинги запросов от одновременных пользователей считаются общими батчами
+        self.embed_model = BatchingEmbedding(self.ingestion_helper.embed_model)
+        # Записи в индекс по одной; версия растет после каждой записи (для /health)
+        self._write_lock = threading.Lock()
+        self.index_version = 0
+        self.embedding_dimension = len(
+            self.ingestion_helper.embed_model.get_text_embedding("dimension probe")
+        )
+        self._disk_usage = (0.0, 0)
         
         self.vector_store = self._initialize_vector_store()
         self.storage_context = StorageContext.from_defaults(
@@ -27,19 +73,27 @@ class IngestComponent:
         )
         
         self.index = self._initialize_index()
+        # Документ -> фрагменты: удаление и замена без перебора коллекции
+        self.documents = DocumentIndex(self.persist_dir / "documents.sqlite3")
+        if self.documents.created and self.vector_store._collection.count():
+            self._rebuild_document_index()
+        # Индекс сохраняется группами; id фрагментов незавершенных записей - в журнале
+        self.journal = IngestJournal(self.persist_dir / "ingest_journal.jsonl")
+        self._recover_from_journal()
+        self.group_commit = GroupCommit(self._persist, self._write_lock)
     
     def _initialize_vector_store(self):
         """Инициализирует векторное хранилище с retry логикой"""
         for attempt in range(self.max_retries):
             try:
-                chroma_client = chromadb.PersistentClient(path=str(self.persist_dir))
-                document_collection = chroma_client.get_or_create_collection("corporate_docs")
+                self.chroma_client = chromadb.PersistentClient(path=str(self.persist_dir))
+                document_collection = self.chroma_client.get_or_create_collection(COLLECTION_NAME)
                 return ChromaVectorStore(chroma_collection=document_collection)
             except Exception as e:
                 logger.warning("Vector store initialization attempt %d failed: %s", attempt + 1, e)
                 if attempt == self.max_retries - 1:
                     raise
-                time.sleep(1)
+                time.sleep(resilience.backoff(attempt + 1, CHROMA_RETRY_DELAY, CHROMA_RETRY_MAX_DELAY))
     
     def _initialize_index(self):
         """Инициализирует или загружает индекс"""
@@ -48,7 +102,7 @@ class IngestComponent:
                 # Пытаемся загрузить существующий индекс
                 index = VectorStoreIndex.from_vector_store(
                     vector_store=self.vector_store,
-                    embed_model=self.ingestion_helper.embed_model,
+                    embed_model=self.embed_model,
                     storage_context=self.storage_context
                 )
                 logger.info("Loaded existing vector store index")
@@ -60,90 +114,336 @@ class IngestComponent:
                     index = VectorStoreIndex.from_documents(
                         [],
                         storage_context=self.storage_context,
-                        embed_model=self.ingestion_helper.embed_model
+                        embed_model=self.embed_model
                     )
                     index.storage_context.persist(persist_dir=self.persist_dir)
                     return index
                 logger.warning("Index loading attempt %d failed, retrying: %s", attempt + 1, e)
-                time.sleep(1)
+                time.sleep(resilience.backoff(attempt + 1, CHROMA_RETRY_DELAY, CHROMA_RETRY_MAX_DELAY))
     
-    def ingest_file(self, file_path: str) -> bool:
-        """Добавляет файл в базу знаний с семантическим разбиением"""
+    @track_allocations("ingest_file")
+    def ingest_file(self, file_path: str, doc_id: Optional[str] = None, file_name: Optional[str] = None) -> bool:
+        """Добавляет файл в базу знаний с семантическим разбиением.
+
+        doc_id - стабильный id документа; если документ с таким id уже есть,
+        его фрагменты заменяются новыми (после вставки новых).
+        """
         file_path = Path(file_path)
         if not file_path.exists():
             logger.error("File not found: %s", file_path)
             return False
+        file_name = file_name or file_path.name
+        doc_id = doc_id or uuid.uuid4().hex
         
         for attempt in range(self.max_retries):
             try:
                 documents = self.ingestion_helper.transform_file_into_documents(
-                    file_path.name, file_path
+                    file_name, file_path
                 )
                 
                 if not documents:
                     logger.warning("No documents extracted from %s", file_path)
                     return False
                 
-                logger.info("Ingesting %s semantic documents from %s", len(documents), file_path)
+                nodes = self._build_nodes(doc_id, documents)
+                logger.info("Ingesting %s chunks from %s as document %s", len(nodes), file_name, doc_id)
                 
-                # Вставляем документы в индекс
-                for document in documents:
-                    self.index.insert(document)
-                
-                # Сохраняем изменения
-                self.index.storage_context.persist(persist_dir=self.persist_dir)
-                logger.info("Successfully ingested %s with %s semantic documents", 
-                           file_path, len(documents))
+                chunk_ids = [node.node_id for node in nodes]
+                size = sum(len(node.get_content().encode("utf-8")) for node in nodes)
+                insert_started = time.perf_counter()
+                with self._write_lock:
+                    # Сначала журнал (только id): по нему восстановление допишет
+                    # индекс документов или уберет недовставленные фрагменты
+                    self.journal.append({"doc_id": doc_id, "file": file_name, "chunks": chunk_ids})
+                    try:
+                        with self.breaker.guard():
+                            self.index.insert_nodes(nodes)
+                    except Exception:
+                        self._abort_insert(doc_id, chunk_ids)
+                        raise
+                    self._replace_chunks(doc_id, file_name, chunk_ids, size)
+                    # Сохранение на диск - пачкой, см. GroupCommit
+                    self.group_commit.record(len(nodes))
+                INGEST_STAGE_SECONDS.labels("insert").observe(time.perf_counter() - insert_started)
+                self._mark_changed()
+                logger.info("Successfully ingested %s with %s chunks", file_name, len(nodes))
                 return True
                 
+            except CircuitOpen as e:
+                logger.error("Ingestion of %s rejected: %s", file_path, e)
+                KB_ERRORS.labels("ingest").inc()
+                return False
             except Exception as e:
                 logger.warning("Ingestion attempt %d failed for %s: %s", attempt + 1, file_path, e)
                 if attempt == self.max_retries - 1:
                     logger.error("All ingestion attempts failed for %s", file_path)
+                    KB_ERRORS.labels("ingest").inc()
                     return False
-                time.sleep(2 ** attempt)
-    
+                RETRIES.labels("IngestComponent.ingest_file").inc()
+                time.sleep(resilience.backoff(attempt + 1, CHROMA_RETRY_DELAY * 5, CHROMA_RETRY_MAX_DELAY * 2))
+
+    def _build_nodes(self, doc_id: str, documents: List[Document]) -> List[TextNode]:
+        """Фрагменты документа с явными id, id документа в метаданных и готовыми эмбеддингами"""
+        nodes = run_transformations(documents, Settings.transformations)
+        for node in nodes:
+            node.metadata[DOC_ID_KEY] = doc_id
+            node.excluded_embed_metadata_keys = [*node.excluded_embed_metadata_keys, DOC_ID_KEY]
+            node.excluded_llm_metadata_keys = [*node.excluded_llm_metadata_keys, DOC_ID_KEY]
+            node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=doc_id)
+        # Эмбеддинги считаются до захвата замка записи: модель не держит другие записи
+        with metrics.timed(INGEST_STAGE_SECONDS.labels("embed")):
+            embeddings = self.ingestion_helper.embed_model.get_text_embedding_batch(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            )
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+        return nodes
+
+    def _delete_chunks(self, chunk_ids: List[str]) -> None:
+        for batch in batched(chunk_ids, max_batch_size(self.chroma_client)):
+            self.vector_store._collection.delete(ids=list(batch))
+
+    def _replace_chunks(self, doc_id: str, file_name: str, chunk_ids: List[str], size: int) -> None:
+        """Записать новые фрагменты документа и удалить фрагменты прежней версии; size - байты текста"""
+        current = set(chunk_ids)
+        stale = [c for c in self.documents.chunk_ids(doc_id) if c not in current]
+        if stale:
+            # Надгробие до удаления: иначе восстановление вернет прежнюю версию из журнала
+            self.journal.append({"doc_id": doc_id, "deleted": stale})
+            self._delete_chunks(stale)
+        self.documents.put(doc_id, file_name, chunk_ids, size)
+
+    def _rebuild_document_index(self) -> None:
+        """Индекс документов по метаданным коллекции: первый запуск и импорт снимка"""
+        collection = self.vector_store._collection
+        page_size = max_batch_size(self.chroma_client)
+
+        def pages():
+            for offset in range(0, collection.count(), page_size):
+                page = collection.get(limit=page_size, offset=offset, include=["metadatas", "documents"])
+                yield page["ids"], page["metadatas"], page["documents"]
+
+        self.documents.rebuild(pages())
+
+    def delete_document(self, doc_id: str) -> bool:
+        """Удалить документ и все его фрагменты"""
+        with self._write_lock:
+            if self.documents.get(doc_id) is None:
+                return False
+            chunk_ids = self.documents.chunk_ids(doc_id)
+            # Загрузка документа может еще лежать в журнале, надгробие не даст ее повторить
+            self.journal.append({"doc_id": doc_id, "deleted": chunk_ids})
+            self._delete_chunks(chunk_ids)
+            self.documents.remove(doc_id)
+        self._mark_changed()
+        logger.info("Deleted document %s", doc_id)
+        return True
+
+    def get_document(self, doc_id: str) -> Optional[Dict]:
+        return self.documents.get(doc_id)
+
+    def list_documents(self, limit: int = 50, cursor: Optional[int] = None) -> Dict:
+        documents, next_cursor = self.documents.list(limit, cursor)
+        return {"documents": documents, "next_cursor": next_cursor, "total": self.documents.count()}
+
+    def _persist(self) -> None:
+        with metrics.timed(INGEST_STAGE_SECONDS.labels("persist")):
+            self.index.storage_context.persist(persist_dir=self.persist_dir)
+            self.journal.reset()
+
+    def _abort_insert(self, doc_id: str, chunk_ids: List[str]) -> None:
+        """Убрать частично вставленные фрагменты и пометить загрузку в журнале как неудачную"""
+        try:
+            self._delete_chunks(chunk_ids)
+        except Exception as e:
+            logger.warning("Could not roll back document %s: %s", doc_id, e)
+        self.journal.append({"doc_id": doc_id, "aborted": chunk_ids})
+
+    def _stored_chunk_sizes(self, chunk_ids: List[str]) -> Dict[str, int]:
+        """Какие из фрагментов уже есть в Chroma и размер их текста в байтах"""
+        sizes = {}
+        for batch in batched(chunk_ids, max_batch_size(self.chroma_client)):
+            page = self.vector_store._collection.get(ids=list(batch), include=["documents"])
+            sizes.update(
+                (chunk_id, len((text or "").encode("utf-8")))
+                for chunk_id, text in zip(page["ids"], page["documents"])
+            )
+        return sizes
+
+    def _recover_from_journal(self) -> None:
+        """Довести до конца загрузки и удаления, прерванные падением процесса.
+
+        Chroma сохраняет фрагменты сразу при вставке, поэтому журнал хранит
+        только id. Если в Chroma есть все фрагменты загрузки, она дописывается
+        в индекс документов, если часть - вставка не завершилась (клиент не
+        получил ответ), и фрагменты удаляются. Записи применяются по порядку:
+        удаление отменяет загрузки перед ним, но не повторную загрузку после.
+        """
+        entries = self.journal.read()
+        if not entries:
+            return
+        aborted = {chunk_id for entry in entries for chunk_id in entry.get("aborted", [])}
+        replayed = 0
+        for entry in entries:
+            if "aborted" in entry:
+                continue
+            if "deleted" in entry:
+                deleted = set(entry["deleted"])
+                self._delete_chunks(entry["deleted"])
+                # Удален весь документ, а не прежняя версия при замене
+                if not [c for c in self.documents.chunk_ids(entry["doc_id"]) if c not in deleted]:
+                    self.documents.remove(entry["doc_id"])
+                replayed += 1
+                continue
+            # Журнал прежнего формата хранил фрагменты целиком
+            chunk_ids = entry.get("chunks") or [node["id_"] for node in entry.get("nodes", [])]
+            if not chunk_ids or chunk_ids[0] in aborted:
+                continue
+            stored = self._stored_chunk_sizes(chunk_ids)
+            if len(stored) < len(chunk_ids):
+                self._delete_chunks(list(stored))
+                continue
+            self._replace_chunks(entry["doc_id"], entry["file"], chunk_ids, sum(stored.values()))
+            replayed += 1
+        self._persist()
+        logger.info("Recovered %d of %d journaled changes", replayed, len(entries))
+
+    def _embedding_signature(self) -> tuple:
+        """Имя модели и размерность векторов - по ним проверяется совместимость снимков"""
+        return self.ingestion_helper.embed_model.model_name, self.embedding_dimension
+
+    def export_snapshot(self, path: str) -> dict:
+        """Выгрузить базу знаний (тексты, метаданные и векторы) в файл снимка"""
+        model_name, dimension = self._embedding_signature()
+        with self._write_lock:
+            return export_snapshot(self.vector_store._collection, Path(path), model_name, dimension)
+
+    @track_allocations("import_snapshot")
+    def import_snapshot(self, path: str, replace: bool = False) -> dict:
+        """Загрузить снимок без пересчета эмбеддингов; replace - сначала очистить базу"""
+        model_name, dimension = self._embedding_signature()
+        # Журнал относится к текущей базе: сохраняем и очищаем до замены
+        self.group_commit.flush()
+        with self._write_lock:
+            if replace:
+                # Текущая коллекция удаляется только после успешной загрузки снимка
+                result = replace_from_snapshot(
+                    self.chroma_client, COLLECTION_NAME, Path(path), model_name, dimension
+                )
+                self.vector_store = self._initialize_vector_store()
+                self.storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
+                self.index = self._initialize_index()
+            else:
+                result = import_snapshot(
+                    self.vector_store._collection, self.chroma_client, Path(path), model_name, dimension
+                )
+            self._rebuild_document_index()
+        self._mark_changed()
+        return result
+
+    def flush(self) -> None:
+        """Сохранить индекс на диск сейчас, не дожидаясь GroupCommit"""
+        self.group_commit.flush()
+
+    def close(self) -> None:
+        """Сохранить накопленные изменения при остановке"""
+        self.group_commit.close()
+        self.embed_model.dispatcher.close()
+        self.documents.close()
+
+    def _mark_changed(self) -> None:
+        with self._write_lock:
+            self.index_version += 1
+
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги коротких текстов (вопросов) через общий батчер"""
+        return self.embed_model.dispatcher.embed_many(texts)
+
+    def embedding_stats(self) -> dict:
+        return self.embed_model.dispatcher.stats()
+
     def query(self, question: str, top_k: int = 5) -> List[Document]:
         """Ищет релевантные документы для вопроса"""
+        return [doc.node for doc in self.query_with_scores(question, top_k)]
+
+    def query_with_scores(self, question: str, top_k: int = 5) -> List[NodeWithScore]:
+        """Ищет релевантные документы вместе с оценками близости"""
         if not question or not question.strip():
             logger.warning("Empty query received")
             return []
             
-        for attempt in range(self.max_retries):
-            try:
-                retriever = self.index.as_retriever(similarity_top_k=top_k)
-                relevant_docs = retriever.retrieve(question.strip())
-                found_documents = [doc.node for doc in relevant_docs]
-                
-                logger.debug("Query '%s' found %s documents", question, len(found_documents))
-                
-                # Логируем найденные документы для отладки
-                for i, doc in enumerate(found_documents):
-                    logger.debug("Doc %d: %s (similarity: %.4f)", 
-                                i, doc.metadata.get('file_name', 'Unknown'), 
-                                relevant_docs[i].score if hasattr(relevant_docs[i], 'score') else 0)
-                
-                return found_documents
-                
-            except Exception as e:
-                logger.warning("Query attempt %d failed: %s", attempt + 1, e)
-                if attempt == self.max_retries - 1:
-                    logger.error("All query attempts failed for: %s", question)
-                    return []
-                time.sleep(1)
+        try:
+            # Вектор вопроса считаем сами, чтобы разделить время эмбеддинга и поиска
+            with metrics.timed(KB_QUERY_SECONDS.labels("embed")):
+                embedding = self.embed_model.get_query_embedding(question.strip())
+            retriever = self.index.as_retriever(similarity_top_k=top_k)
+            query = QueryBundle(question.strip(), embedding=embedding)
+            with metrics.timed(KB_QUERY_SECONDS.labels("search")):
+                relevant_docs = resilience.call(
+                    "IngestComponent.query_with_scores",
+                    lambda: retriever.retrieve(query),
+                    breaker=self.breaker,
+                    tries=self.max_retries,
+                    delay=CHROMA_RETRY_DELAY,
+                    max_delay=CHROMA_RETRY_MAX_DELAY,
+                )
+        except CircuitOpen as e:
+            logger.warning("Knowledge base search skipped: %s", e)
+            KB_ERRORS.labels("query").inc()
+            return []
+        except Exception as e:
+            logger.error("All query attempts failed for: %s (%s)", question, e)
+            KB_ERRORS.labels("query").inc()
+            return []
+            
+        logger.debug("Query '%s' found %s documents", question, len(relevant_docs))
+        
+        # Логируем найденные документы для отладки
+        for i, doc in enumerate(relevant_docs):
+            logger.debug("Doc %d: %s (similarity: %.4f)", 
+                        i, doc.node.metadata.get('file_name', 'Unknown'), 
+                        doc.score or 0)
+        
+        return relevant_docs
     
+    def _disk_bytes(self) -> int:
+        """Размер базы на диске; обход папки не чаще раза в KB_DISK_USAGE_TTL секунд"""
+        checked_at, size = self._disk_usage
+        if time.monotonic() - checked_at >= KB_DISK_USAGE_TTL:
+            size = 0
+            for path in self.persist_dir.rglob("*"):
+                try:
+                    if path.is_file():
+                        size += path.stat().st_size
+                except OSError:
+                    # Файл удалили во время обхода (сегменты Chroma, журнал)
+                    continue
+            self._disk_usage = (time.monotonic(), size)
+        return size
+
     def get_stats(self) -> dict:
-        """Возвращает статистику базы знаний"""
+        """Возвращает статистику базы знаний.
+
+        Счетчики ведет DocumentIndex при загрузке и удалении, поэтому здесь
+        нет запросов к Chroma.
+        """
         try:
-            collection = self.vector_store._collection
-            count = collection.count() if hasattr(collection, 'count') else 0
+            totals = self.documents.stats()
             return {
-                "document_count": count,
+                "document_count": totals["chunks"],
+                **totals,
                 "vector_store": "ChromaDB",
-                "embedding_model": "paraphrase-multilingual-MiniLM-L12-v2",
+                "embedding_model": describe_embed_model(self.ingestion_helper.embed_model),
+                "embedding_dimension": self.embedding_dimension,
+                "disk_bytes": self._disk_bytes(),
                 "persist_dir": str(self.persist_dir),
+                "index_version": self.index_version,
+                "persistence": self.group_commit.stats(),
+                "journal_entries": self.journal.entries,
                 "status": "active",
                 "retry_config": f"{self.max_retries} attempts",
+                "circuit_breakers": resilience.breaker_states(),
+                "folder_sync": self.folder_sync.stats() if self.folder_sync is not None else None,
                 "splitter": "semantic"
             }
         except Exception as e:
@@ -154,6 +454,10 @@ class IngestComponent:
                 "status": "error"
             }
     
+    def collect_metrics(self) -> dict:
+        """Метрики процесса индекса для /metrics воркеров (многопроцессный режим)"""
+        return metrics.collect(process="index")
+
     def health_check(self) -> dict:
         """Проверка здоровья компонента"""
         try:
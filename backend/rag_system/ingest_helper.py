@@ -1,22 +1,37 @@
 import logging
+import os
 from pathlib import Path
 from typing import List
 from llama_index.core.schema import Document
 from llama_index.core.node_parser import SemanticSplitterNodeParser
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.readers import StringIterableReader
+from .components.embedding.embedding_component import create_embed_model
+from .utils import metrics
 
 logger = logging.getLogger(__name__)
 
+# Параметры семантического разбиения: сколько соседних предложений сравнивать
+# и перцентиль расстояния, после которого начинается новый фрагмент
+# (выше - крупнее фрагменты). Подбираются tools/retrieval_bench.py
+SEMANTIC_SPLITTER_BUFFER_SIZE = int(os.getenv("SEMANTIC_SPLITTER_BUFFER_SIZE", "1"))
+SEMANTIC_SPLITTER_BREAKPOINT_PERCENTILE = float(os.getenv("SEMANTIC_SPLITTER_BREAKPOINT_PERCENTILE", "95"))
+
+# stage: load, split (здесь), embed, insert, persist (IngestComponent)
+INGEST_STAGE_SECONDS = metrics.histogram(
+    "kb_ingest_stage_seconds", "Document ingestion stages: load, split, embed, insert, persist", ["stage"]
+)
+INGEST_FALLBACKS = metrics.counter(
+    "kb_ingest_fallbacks_total", "Files split with the plain reader after semantic splitting failed"
+)
+
 class IngestionHelper:
     """Хелпер для обработки файлов с семантическим разбиением"""
     
     def __init__(self):
         try:
-            # Используем русскоязычную модель для лучшего качества
-            self.embed_model = HuggingFaceEmbedding(
-                model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-            )
+            # Используем русскоязычную модель для лучшего качества,
+            # бэкенд (PyTorch или ONNX Runtime) задается EMBEDDING_BACKEND
+            self.embed_model = create_embed_model()
         except Exception as e:
             logger.warning("Failed to load multilingual embedding model, using fallback: %s", e)
             from llama_index.embeddings.mock import MockEmbedding
@@ -24,8 +39,8 @@ class IngestionHelper:
         
         # Создаем семантический сплиттер с оптимальными параметрами для русских текстов
         self.splitter = SemanticSplitterNodeParser(
-            buffer_size=1,
-            breakpoint_percentile_threshold=95,
+            buffer_size=SEMANTIC_SPLITTER_BUFFER_SIZE,
+            breakpoint_percentile_threshold=SEMANTIC_SPLITTER_BREAKPOINT_PERCENTILE,
             embed_model=self.embed_model
         )
     
@@ -33,7 +48,8 @@ class IngestionHelper:
         """Преобразует файл в документы"""
         try:
             # Сначала загружаем файл как один большой документ
-            raw_documents = self._load_file_to_documents(file_name, file_data)
+            with metrics.timed(INGEST_STAGE_SECONDS.labels("load")):
+                raw_documents = self._load_file_to_documents(file_name, file_data)
             
             if not raw_documents:
                 logger.warning("No documents extracted from %s", file_name)
@@ -41,14 +57,15 @@ class IngestionHelper:
             
             # Применяем семантическое разбиение к каждому документу
             all_nodes = []
-            for doc in raw_documents:
-                # Добавляем метаданные перед разбиением
-                doc.metadata["file_name"] = file_name
-                doc.metadata["original_doc_id"] = doc.doc_id
-                
-                # Разбиваем документ на семантические узлы
-                nodes = self.splitter.get_nodes_from_documents([doc])
-                all_nodes.extend(nodes)
+            with metrics.timed(INGEST_STAGE_SECONDS.labels("split")):
+                for doc in raw_documents:
+                    # Добавляем метаданные перед разбиением
+                    doc.metadata["file_name"] = file_name
+                    doc.metadata["original_doc_id"] = doc.doc_id
+                    
+                    # Разбиваем документ на семантические узлы
+                    nodes = self.splitter.get_nodes_from_documents([doc])
+                    all_nodes.extend(nodes)
             
             # Преобразуем узлы обратно в документы с сохранением метаданных
             documents = self._nodes_to_documents(all_nodes, file_name)
@@ -58,6 +75,7 @@ class IngestionHelper:
             
         except Exception as e:
             logger.error("Error processing file %s: %s", file_name, e)
+            INGEST_FALLBACKS.inc()
             # используем обычное разбиение
             return self._fallback_transform(file_name, file_data)
 
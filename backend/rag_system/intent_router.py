@@ -0,0 +1,325 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INTENT_RAG = "rag"
+INTENT_GENERAL = "general"
+
+# Насколько сходство с центроидом "rag" должно превышать "general"
+INTENT_EMBEDDING_MARGIN = float(os.getenv("INTENT_EMBEDDING_MARGIN", "0.03"))
+INTENT_CACHE_SIZE = int(os.getenv("INTENT_CACHE_SIZE", "1024"))
+INTENT_EVAL_PATH = Path(__file__).parent / "intent_eval.jsonl"
+
+# Окончания по типам склонения. Основа без окончаний ловила бы и чужие
+# слова: "правил" - "правильно", "подпис" - "подписка", "отчет" - "отчетливо"
+_FEM_A = "а|ы|и|е|у|ой|ою|ам|ами|ах"            # процедура, заявка
+_MASC = "|а|у|е|ом|ы|и|ов|ам|ами|ах"            # документ, отпуск
+_NEUT_O = "о|а|у|е|ом|ам|ами|ах|"               # правило
+_NEUT_IE = "ие|ия|ию|ием|ии|ий|иям|иями|иях"    # положение, заявление
+_FEM_IA = "ия|ии|ию|ией|ий|иям|иями|иях"        # компания, инструкция
+_ADJ = "ый|ий|ой|ая|яя|ое|ее|ые|ие|ого|его|ому|ему|ым|им|ом|ем|ей|ую|юю|ых|их|ыми|ими"
+
+# Слова о процессах компании со всеми словоформами ("отпуска",
+# "командировки", "оформляется"), которые не ловит поиск подстроки
+RAG_TERMS: Dict[str, str] = {
+    "оформ": r"оформ(?:ить|ил|ила|или|лю|ит|ят|лять|ляю|ляет|ляется|ляются|лен|лена|лено|лены|ленн(?:%s))" % _ADJ,
+    "оформление": r"оформлен(?:%s)" % _NEUT_IE,
+    "процедура": r"процедур(?:%s)" % _FEM_A,
+    "инструкция": r"инструкц(?:%s)" % _FEM_IA,
+    "документ": r"документ(?:%s)" % _MASC,
+    "шаблон": r"шаблон(?:%s)" % _MASC,
+    "бланк": r"бланк(?:%s)" % _MASC,
+    "регламент": r"регламент(?:%s)" % _MASC,
+    "политика": r"политик(?:%s)" % _FEM_A,
+    "правило": r"правил(?:%s)" % _NEUT_O,
+    "требование": r"требован(?:%s)" % _NEUT_IE,
+    "стандарт": r"стандарт(?:%s)" % _MASC,
+    "положение": r"положен(?:%s)" % _NEUT_IE,
+    "приказ": r"приказ(?:%s)" % _MASC,
+    "распоряжение": r"распоряжен(?:%s)" % _NEUT_IE,
+    "компания": r"компан(?:%s)" % _FEM_IA,
+    "организация": r"организац(?:%s)" % _FEM_IA,
+    "корпоративный": r"корпоративн(?:%s)" % _ADJ,
+    "внутренний": r"внутренн(?:%s)" % _ADJ,
+    "командировка": r"командиров(?:к(?:%s)|ок|очн(?:%s))" % (_FEM_A, _ADJ),
+    "отпуск": r"отпуск(?:%s|н(?:%s))" % (_MASC, _ADJ),
+    "увольнение": r"увольнен(?:%s)" % _NEUT_IE,
+    "уволить": r"увол(?:ить|иться|ил|ился|ила|илась|или|ились|ю|юсь|ят|ятся|ен|ена|ены)",
+    "увольнять": r"увольня(?:ть|ться|ет|ется|ют|ются)",
+    "прием на работу": r"прием(?:|а|е|у|ом) на работ(?:%s)" % _FEM_A,
+    "трудоустройство": r"трудоустр(?:оить|оиться|ойств(?:%s)|оен|оена)" % _NEUT_O,
+    "договор": r"договор(?:%s)" % _MASC,
+    "отчет": r"отчет(?:%s|н(?:%s)|ност(?:ь|и|ью))" % (_MASC, _ADJ),
+    "заявка": r"заяв(?:к(?:%s)|ок)" % _FEM_A,
+    "заявление": r"заявлен(?:%s)" % _NEUT_IE,
+    "согласовать": r"согласова(?:ть|л|ла|ли|н|на|но|ны|н(?:%s))" % _NEUT_IE,
+    "согласует": r"согласу(?:ю|ет|ют|ется|ются|ем)",
+    "подписать": r"подпис(?:ать|ал|ала|али|ан|ана|ано|аны|ыва(?:ть|ет|ют|ется|ются)|ь|и|ью|ей|ям|ями|ях)",
+    "подпишет": r"подпиш(?:у|ет|ут|ем)",
+    "больничный": r"больничн(?:%s)" % _ADJ,
+    "зарплата": r"зарплат(?:%s|н(?:%s))" % (_FEM_A, _ADJ),
+    "премия": r"прем(?:%s)" % _FEM_IA,
+    "отгул": r"отгул(?:%s)" % _MASC,
+    "мтуси": r"мтуси",
+    "деканат": r"деканат(?:%s)" % _MASC,
+    "кафедра": r"кафедр(?:%s)" % _FEM_A,
+    "стипендия": r"стипенд(?:%s)" % _FEM_IA,
+    "общежитие": r"общежит(?:%s)" % _NEUT_IE,
+    "пропуск": r"пропуск(?:%s)" % _MASC,
+}
+# Граница слова с обеих сторон: окончание должно закрывать слово
+_RAG_PATTERN = re.compile(r"\b(?:" + "|".join(RAG_TERMS.values()) + r")\b", re.IGNORECASE)
+
+# Примеры для центроидов: вопросы без ключевых слов, которые все равно
+# относятся к базе знаний, и общие вопросы к ассистенту
+INTENT_EXAMPLES: Dict[str, List[str]] = {
+    INTENT_RAG: [
+        "Куда обращаться, если сломался рабочий ноутбук?",
+        "Сколько дней можно отдыхать летом?",
+        "Кто утверждает поездку в другой город по работе?",
+        "Как получить справку с места работы?",
+        "Во сколько начинается рабочий день?",
+        "Что нужно сделать в первый рабочий день новому сотруднику?",
+        "Как перенести дни отдыха на следующий год?",
+        "Какие выплаты положены при рождении ребенка?",
+        "Кому сдавать авансовый отчет после поездки?",
+        "Как получить доступ к корпоративной почте?",
+    ],
+    INTENT_GENERAL: [
+        "Привет, как дела?",
+        "Напиши стихотворение про осень",
+        "Переведи на английский фразу доброе утро",
+        "Сколько будет двенадцать умножить на семь?",
+        "Расскажи анекдот",
+        "Что такое машинное обучение?",
+        "Объясни, как работает рекурсия в Python",
+        "Какая столица Франции?",
+        "Придумай название для кота",
+        "Спасибо, ты очень помог",
+    ],
+}
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().replace("ё", "е").split())
+
+
+@dataclass
+class IntentDecision:
+    intent: str
+    # keyword - совпадение слова из RAG_TERMS, embedding - ближе к центроиду, default - ничего не подошло
+    source: str
+    score: float = 0.0
+    matched: Optional[str] = None
+
+    @property
+    def use_rag(self) -> bool:
+        return self.intent == INTENT_RAG
+
+
+class IntentRouter:
+    """Выбор между ответом по базе знаний и общим ответом модели.
+
+    Сначала один скомпилированный regex по словоформам RAG_TERMS, затем, если
+    совпадений нет, сравнение эмбеддинга вопроса с центроидами примеров
+    каждого намерения. Центроиды считаются один раз (build_centroids),
+    эмбеддинги вопросов кэшируются, само решение - пара скалярных
+    произведений.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Optional[Callable[[List[str]], List[List[float]]]] = None,
+        examples: Dict[str, List[str]] = INTENT_EXAMPLES,
+        margin: float = INTENT_EMBEDDING_MARGIN,
+        cache_size: int = INTENT_CACHE_SIZE,
+    ):
+        self.embed_batch = embed_batch
+        self.examples = examples
+        self.margin = margin
+        self.cache_size = cache_size
+        self._intents: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.decisions: Dict[str, int] = {"keyword": 0, "embedding": 0, "default": 0}
+        self.routed: Dict[str, int] = {INTENT_RAG: 0, INTENT_GENERAL: 0}
+        self.decision_seconds = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self._centroids is not None
+
+    def build_centroids(self) -> None:
+        """Центроиды намерений; вызывается один раз при старте в фоне"""
+        if self.embed_batch is None:
+            return
+        started = time.monotonic()
+        intents, rows = [], []
+        for intent, phrases in self.examples.items():
+            vectors = self._normalize(np.asarray(self.embed_batch(phrases), dtype=np.float32))
+            intents.append(intent)
+            rows.append(vectors.mean(axis=0))
+        self._intents = intents
+        self._centroids = self._normalize(np.vstack(rows))
+        logger.info("Built %d intent centroids in %.2fs", len(intents), time.monotonic() - started)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def match(self, question: str) -> Optional[IntentDecision]:
+        found = _RAG_PATTERN.search(normalize_question(question))
+        if found is None:
+            return None
+        return IntentDecision(INTENT_RAG, "keyword", 1.0, found.group(0))
+
+    def embed(self, question: str) -> np.ndarray:
+        """Эмбеддинг вопроса из LRU кэша (вычисляется синхронно)"""
+        key = normalize_question(question)
+        vector = self._cache.get(key)
+        if vector is not None:
+            self._cache.move_to_end(key)
+            return vector
+        vector = self._normalize(np.asarray(self.embed_batch([key])[0], dtype=np.float32))
+        self._cache[key] = vector
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return vector
+
+    def _by_centroids(self, embedding: np.ndarray) -> IntentDecision:
+        similarity = self._centroids @ embedding
+        scores = dict(zip(self._intents, similarity.tolist()))
+        delta = scores.get(INTENT_RAG, 0.0) - scores.get(INTENT_GENERAL, 0.0)
+        intent = INTENT_RAG if delta > self.margin else INTENT_GENERAL
+        return IntentDecision(intent, "embedding", round(delta, 4))
+
+    def classify(self, question: str, embedding: Optional[np.ndarray] = None) -> IntentDecision:
+        """Решение по готовому эмбеддингу, без обращения к модели"""
+        decision = self.match(question)
+        if decision is None and embedding is not None and self._centroids is not None:
+            decision = self._by_centroids(embedding)
+        return decision or IntentDecision(INTENT_GENERAL, "default")
+
+    async def route(self, question: str) -> IntentDecision:
+        started = time.perf_counter()
+        decision = self.match(question)
+        if decision is None and self.ready:
+            # Модель эмбеддингов блокирует - считаем в потоке
+            key = normalize_question(question)
+            embedding = self._cache.get(key)
+            if embedding is None:
+                embedding = await asyncio.to_thread(self.embed, question)
+            decision = self._by_centroids(embedding)
+        decision = decision or IntentDecision(INTENT_GENERAL, "default")
+        self.decisions[decision.source] += 1
+        self.routed[decision.intent] += 1
+        self.decision_seconds += time.perf_counter() - started
+        return decision
+
+    def stats(self) -> Dict:
+        total = sum(self.decisions.values())
+        return {
+            "centroids_ready": self.ready,
+            "decisions": dict(self.decisions),
+            "routed": dict(self.routed),
+            "cached_embeddings": len(self._cache),
+            "avg_decision_ms": round(self.decision_seconds / total * 1000, 3) if total else 0.0,
+        }
+
+
+def _legacy_keyword_scan(question: str) -> bool:
+    """Прежняя проверка should_use_rag из app.py, для сравнения в отчете"""
+    question_lower = question.lower()
+    rag_keywords = [
+        'как оформить', 'процедура', 'инструкция', 'документ', 'шаблон',
+        'регламент', 'политика', 'правила', 'требования', 'стандарт',
+        'компании', 'организации', 'корпоративный', 'внутренний',
+        'командировка', 'отпуск', 'увольнение', 'прием', 'договор',
+        'отчет', 'заявка', 'согласование', 'подписание'
+    ]
+    return any(keyword in question_lower for keyword in rag_keywords)
+
+
+def load_eval_set(path: Path = INTENT_EVAL_PATH) -> List[Dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _percentile(values: Sequence[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+def evaluate(router: IntentRouter, samples: List[Dict]) -> Dict:
+    """Точность и задержка решения на размеченном наборе.
+
+    Эмбеддинги считаются заранее: задержка - это время самого решения,
+    как у запроса с эмбеддингом из кэша.
+    """
+    embeddings = {}
+    if router.ready:
+        for sample in samples:
+            embeddings[sample["question"]] = router.embed(sample["question"])
+
+    correct = legacy_correct = 0
+    latencies, errors = [], []
+    for sample in samples:
+        question, expected = sample["question"], sample["intent"]
+        started = time.perf_counter()
+        decision = router.classify(question, embeddings.get(question))
+        latencies.append(time.perf_counter() - started)
+        if decision.intent == expected:
+            correct += 1
+        else:
+            errors.append({
+                "question": question,
+                "expected": expected,
+                "got": decision.intent,
+                "source": decision.source,
+            })
+        legacy = INTENT_RAG if _legacy_keyword_scan(question) else INTENT_GENERAL
+        legacy_correct += legacy == expected
+
+    total = len(samples)
+    return {
+        "samples": total,
+        "accuracy": round(correct / total, 4) if total else 0.0,
+        "legacy_accuracy": round(legacy_correct / total, 4) if total else 0.0,
+        "embeddings": router.ready,
+        "latency_us": {
+            "p50": round(_percentile(latencies, 0.5) * 1e6, 1),
+            "p99": round(_percentile(latencies, 0.99) * 1e6, 1),
+            "max": round(max(latencies, default=0.0) * 1e6, 1),
+        },
+        "errors": errors,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Оценка роутера намерений на размеченном наборе")
+    parser.add_argument("--eval-set", type=Path, default=INTENT_EVAL_PATH)
+    parser.add_argument("--no-embeddings", action="store_true", help="только regex по словоформам")
+    args = parser.parse_args()
+
+    embed_batch = None
+    if not args.no_embeddings:
+        from .ingest_helper import IngestionHelper
+
+        embed_batch = IngestionHelper().embed_model.get_text_embedding_batch
+    router = IntentRouter(embed_batch)
+    router.build_centroids()
+    print(json.dumps(evaluate(router, load_eval_set(args.eval_set)), ensure_ascii=False, indent=2))
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Сохранять индекс после стольких новых фрагментов...
+INDEX_PERSIST_MAX_CHUNKS = int(os.getenv("INDEX_PERSIST_MAX_CHUNKS", "500"))
+# ...или через столько секунд после первой несохраненной записи
+INDEX_PERSIST_INTERVAL_SECONDS = float(os.getenv("INDEX_PERSIST_INTERVAL_SECONDS", "5"))
+
+
+class IngestJournal:
+    """Журнал изменений базы знаний с момента последнего сохранения индекса.
+
+    Каждая загрузка - одна JSON строка с id документа и id его фрагментов
+    ({"doc_id", "file", "chunks"}), записанная с fsync до вставки в Chroma.
+    Сами фрагменты и векторы хранит Chroma, журнал нужен, чтобы после падения
+    посреди записи согласовать с ней индекс документов. Удаления записываются
+    надгробиями ({"doc_id", "deleted"}), чтобы восстановление не вернуло
+    удаленный документ. После сохранения индекса журнал очищается.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._drop_torn_tail()
+        self.entries = len(self.read())
+
+    def _drop_torn_tail(self) -> None:
+        """Обрезать недописанную при падении строку, иначе к ней приклеится следующая запись"""
+        if not self.path.exists():
+            return
+        data = self.path.read_bytes()
+        if data and not data.endswith(b"\n"):
+            logger.warning("Dropping torn journal record in %s", self.path)
+            with open(self.path, "r+b") as f:
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def append(self, record: Dict) -> None:
+        line = json.dumps(record, ensure_ascii=False)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries += 1
+
+    def read(self) -> List[Dict]:
+        if not self.path.exists():
+            return []
+        entries = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning("Skipping corrupt journal record in %s", self.path)
+        return entries
+
+    def reset(self) -> None:
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries = 0
+
+
+class GroupCommit:
+    """Отложенное сохранение индекса: раз в max_chunks фрагментов, раз в
+    interval секунд или по явному flush(), а не после каждого файла.
+
+    lock - тот же замок, под которым идут записи в индекс, чтобы сохранение
+    не пересекалось со вставкой.
+    """
+
+    def __init__(
+        self,
+        persist_fn: Callable[[], None],
+        lock: threading.Lock,
+        max_chunks: int = INDEX_PERSIST_MAX_CHUNKS,
+        interval: float = INDEX_PERSIST_INTERVAL_SECONDS,
+    ):
+        self.persist_fn = persist_fn
+        self.lock = lock
+        self.max_chunks = max_chunks
+        self.interval = interval
+        self.pending_chunks = 0
+        self.dirty_since: Optional[float] = None
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="index-persist", daemon=True)
+        self._thread.start()
+
+    def record(self, chunks: int) -> None:
+        """Учесть записанные фрагменты; вызывается под lock"""
+        if self.dirty_since is None:
+            self.dirty_since = time.monotonic()
+        self.pending_chunks += chunks
+        if self.pending_chunks >= self.max_chunks:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if self.dirty_since is None:
+            return
+        started = time.monotonic()
+        self.persist_fn()
+        self.last_flush_seconds = round(time.monotonic() - started, 3)
+        self.flushes += 1
+        logger.info("Persisted index: %d chunks in %.3fs", self.pending_chunks, self.last_flush_seconds)
+        self.pending_chunks = 0
+        self.dirty_since = None
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush_locked()
+
+    def _run(self) -> None:
+        while not self._stop.wait(min(self.interval, 1.0)):
+            dirty_since = self.dirty_since
+            if dirty_since is not None and time.monotonic() - dirty_since >= self.interval:
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error("Background index persist failed: %s", e)
+
+    def close(self) -> None:
+        """Остановить фоновое сохранение и сохранить все накопленное"""
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> Dict:
+        return {
+            "pending_chunks": self.pending_chunks,
+            "max_chunks": self.max_chunks,
+            "interval_seconds": self.interval,
+            "flushes": self.flushes,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
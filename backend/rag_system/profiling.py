@@ -0,0 +1,306 @@
+"""Профилирование по запросу для рабочего процесса.
+
+Все выключено по умолчанию (PROFILING_ENABLED=0): middleware не
+добавляется, /admin/profile* отвечают 404, декоратор загрузок возвращает
+функцию без изменений - в горячем пути нет даже проверки флага.
+
+Три инструмента:
+- один запрос под cProfile: заголовок X-Profile: 1 или ?profile=1,
+  файл .prof сохраняется в PROFILE_DIR, имя - в заголовке X-Profile-ID;
+- сэмплирующий профайлер всего процесса на заданное время: стеки всех
+  потоков раз в interval, результат - collapsed stacks для flamegraph.pl
+  или speedscope;
+- tracemalloc для загрузки документов (PROFILE_INGEST_ALLOCATIONS=1):
+  разница снимков памяти до и после загрузки в текстовом отчете.
+
+Профили пишутся в процессе, который обработал запрос: при API_WORKERS > 1
+у каждого воркера свои, а загрузки идут в процессе индекса.
+"""
+import collections
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from io import StringIO
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+# Если задан - нужен в заголовке X-Profile-Token для профиля запроса и /admin/profile*
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "./data/profiles"))
+# Сколько последних файлов профилей хранить
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_INGEST_ALLOCATIONS = os.getenv("PROFILE_INGEST_ALLOCATIONS", "0") == "1"
+# Глубина стека tracemalloc и сколько строк в отчете
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+TRACEMALLOC_TOP = int(os.getenv("TRACEMALLOC_TOP", "30"))
+
+
+class ProfilerBusy(Exception):
+    """Сэмплирующий профайлер уже запущен в этом процессе"""
+
+
+def _profile_path(kind: str, suffix: str) -> Path:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return PROFILE_DIR / f"{stamp}-{kind}-{os.getpid()}-{uuid.uuid4().hex[:6]}{suffix}"
+
+
+def _prune() -> None:
+    files = sorted(PROFILE_DIR.glob("*"), key=lambda p: p.stat().st_mtime)
+    for path in files[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+        path.unlink(missing_ok=True)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    if not PROFILE_DIR.exists():
+        return []
+    return [
+        {"name": path.name, "bytes": path.stat().st_size,
+         "modified": datetime.fromtimestamp(path.stat().st_mtime, timezone.utc).isoformat()}
+        for path in sorted(PROFILE_DIR.iterdir(), reverse=True) if path.is_file()
+    ]
+
+
+def profile_file(name: str) -> Optional[Path]:
+    """Файл профиля по имени; None для чужих путей и несуществующих файлов"""
+    path = PROFILE_DIR / name
+    if Path(name).name != name or not path.is_file():
+        return None
+    return path
+
+
+def format_cprofile(path: Path, limit: int = 40, sort: str = "cumulative") -> str:
+    """Текстовая сводка .prof: самые дорогие функции"""
+    output = StringIO()
+    pstats.Stats(str(path), stream=output).strip_dirs().sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+
+def token_allowed(token: Optional[str]) -> bool:
+    return not PROFILING_TOKEN or token == PROFILING_TOKEN
+
+
+# ==================== Профиль одного запроса ====================
+
+class RequestProfilerMiddleware:
+    """ASGI middleware: запрос с X-Profile: 1 или ?profile=1 выполняется под cProfile.
+
+    cProfile видит весь поток цикла событий, поэтому в профиль попадают и
+    другие запросы, выполнявшиеся в это время; одновременно профилируется
+    только один запрос, остальные с флагом выполняются как обычно.
+    Добавляется в приложение только при PROFILING_ENABLED.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _requested(scope) -> bool:
+        headers = dict(scope.get("headers") or [])
+        flag = headers.get(b"x-profile", b"").decode()
+        if not flag:
+            flag = (parse_qs(scope.get("query_string", b"").decode()).get("profile") or [""])[0]
+        return flag.lower() in ("1", "true", "cprofile") and token_allowed(
+            headers.get(b"x-profile-token", b"").decode() or None
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+        if not self._lock.acquire(blocking=False):
+            logger.info("Profiler is busy, %s runs without profiling", scope.get("path"))
+            await self.app(scope, receive, send)
+            return
+
+        path = _profile_path("request", ".prof")
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", [])) + [(b"x-profile-id", path.name.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_with_profile_id)
+            finally:
+                profiler.disable()
+        finally:
+            self._lock.release()
+        profiler.dump_stats(str(path))
+        _prune()
+        logger.info("Profiled %s %s in %.1f ms: %s", scope.get("method"), scope.get("path"),
+                    (time.perf_counter() - started) * 1000, path.name)
+
+
+# ==================== Сэмплирующий профайлер процесса ====================
+
+class SamplingProfiler:
+    """Раз в interval секунд снимает стеки всех потоков (sys._current_frames).
+
+    Не ставит хуков на вызовы функций, поэтому код между снимками
+    выполняется с обычной скоростью. Результат - счетчики одинаковых
+    стеков в формате collapsed: "поток;функция (файл:строка);... N".
+    """
+
+    def __init__(self, seconds: float, interval: float):
+        self.seconds = seconds
+        self.interval = interval
+        self.path = _profile_path("sampling", ".collapsed")
+        self.samples = 0
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._stacks: collections.Counter = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        try:
+            while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)).replace(";", ":"))
+                    self._stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+        finally:
+            self.finished_at = time.time()
+            with open(self.path, "w", encoding="utf-8") as f:
+                for stack, count in self._stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            _prune()
+            logger.info("Sampling profile finished: %d samples in %s", self.samples, self.path.name)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "pid": os.getpid(),
+            "file": self.path.name,
+            "seconds": self.seconds,
+            "interval_ms": round(self.interval * 1000, 2),
+            "samples": self.samples,
+            "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "finished_at": datetime.fromtimestamp(self.finished_at, timezone.utc).isoformat()
+            if self.finished_at else None,
+        }
+
+
+_sampler: Optional[SamplingProfiler] = None
+_sampler_lock = threading.Lock()
+
+
+def start_sampling(seconds: float, interval: float = 0.005) -> Dict[str, Any]:
+    global _sampler
+    with _sampler_lock:
+        if _sampler is not None and _sampler.running:
+            raise ProfilerBusy(f"Sampling profile {_sampler.path.name} is already running")
+        _sampler = SamplingProfiler(min(seconds, PROFILE_MAX_SECONDS), max(interval, 0.001))
+        _sampler.start()
+        return _sampler.status()
+
+
+def stop_sampling() -> Optional[Dict[str, Any]]:
+    """Остановить досрочно; профиль записывается в файл в любом случае"""
+    sampler = _sampler
+    if sampler is None:
+        return None
+    sampler.stop()
+    return sampler.status()
+
+
+def sampling_status() -> Optional[Dict[str, Any]]:
+    return _sampler.status() if _sampler is not None else None
+
+
+# ==================== Память при загрузке документов ====================
+
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+
+
+@contextmanager
+def _allocation_report(job: str, description: str) -> Iterator[None]:
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        _tracemalloc_users += 1
+    before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        with _tracemalloc_lock:
+            _tracemalloc_users -= 1
+            if _tracemalloc_users == 0:
+                tracemalloc.stop()
+        # Одновременные загрузки попадают в отчеты друг друга: tracemalloc общий на процесс
+        diff = after.compare_to(before, "traceback")
+        net = sum(stat.size_diff for stat in diff)
+        path = _profile_path(f"alloc-{job}", ".txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"{job} {description}\n")
+            f.write(f"duration: {time.perf_counter() - started:.2f} s, net: {net / 1e6:.1f} MB, "
+                    f"traced peak: {peak / 1e6:.1f} MB\n\n")
+            for stat in diff[:TRACEMALLOC_TOP]:
+                f.write(f"{stat.size_diff / 1e6:+.2f} MB, {stat.count_diff:+d} blocks\n")
+                f.writelines(f"    {line}\n" for line in stat.traceback.format())
+        _prune()
+        logger.info("%s allocations: net %.1f MB, peak %.1f MB, report %s", job, net / 1e6, peak / 1e6, path.name)
+
+
+def track_allocations(job: str) -> Callable:
+    """Декоратор для загрузок: отчет tracemalloc на каждый вызов при PROFILE_INGEST_ALLOCATIONS=1.
+
+    Без флага возвращает функцию как есть.
+    """
+    def decorator(func: Callable) -> Callable:
+        if not PROFILE_INGEST_ALLOCATIONS:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _allocation_report(job, repr(args[1:] + tuple(kwargs.values()))[:200]):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
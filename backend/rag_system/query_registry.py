@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Awaitable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class QueryCancelled(Exception):
+    """Запрос отменен пользователем или клиент отключился"""
+
+
+class QueryHandle:
+    """Выполняющийся streaming запрос, который можно отменить"""
+
+    def __init__(self, query_id: str):
+        self.query_id = query_id
+        self.started_at = time.monotonic()
+        self.cancelled = asyncio.Event()
+        # "client" - кнопка "стоп", "disconnect" - клиент закрыл соединение
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: str) -> None:
+        if self.reason is None:
+            self.reason = reason
+            self.cancelled.set()
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        """Ждет awaitable, прерывая его при отмене запроса"""
+        task = asyncio.ensure_future(awaitable)
+        waiter = asyncio.ensure_future(self.cancelled.wait())
+        try:
+            await asyncio.wait((task, waiter), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+        if not task.done():
+            # Отмена до первого чанка: CancelledError снимает запрос из очереди планировщика
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+            raise QueryCancelled(self.reason)
+        return task.result()
+
+
+class QueryRegistry:
+    """Реестр выполняющихся streaming запросов для явной отмены по id"""
+
+    def __init__(self):
+        self._queries: Dict[str, QueryHandle] = {}
+        self.completed = 0
+        self.cancelled: Dict[str, int] = {"client": 0, "disconnect": 0}
+        self.cancelled_seconds = 0.0
+
+    def register(self, query_id: Optional[str] = None) -> QueryHandle:
+        query_id = query_id or str(uuid.uuid4())
+        if query_id in self._queries:
+            raise ValueError(f"Query {query_id} is already running")
+        handle = QueryHandle(query_id)
+        self._queries[query_id] = handle
+        return handle
+
+    def cancel(self, query_id: str, reason: str = "client") -> bool:
+        handle = self._queries.get(query_id)
+        if handle is None:
+            return False
+        handle.cancel(reason)
+        return True
+
+    def finish(self, handle: QueryHandle) -> None:
+        if self._queries.pop(handle.query_id, None) is None:
+            return
+        if handle.reason is None:
+            self.completed += 1
+            return
+        self.cancelled[handle.reason] = self.cancelled.get(handle.reason, 0) + 1
+        elapsed = time.monotonic() - handle.started_at
+        self.cancelled_seconds += elapsed
+        logger.info("Query %s cancelled (%s) after %.2fs", handle.query_id, handle.reason, elapsed)
+
+    def stats(self) -> Dict:
+        return {
+            "active": len(self._queries),
+            "completed": self.completed,
+            "cancelled": dict(self.cancelled),
+            "cancelled_seconds_total": round(self.cancelled_seconds, 3),
+        }
@@ -1,32 +1,124 @@
-from typing import Dict
-import ollama
+import asyncio
+import os
+import time
+import uuid
+from contextlib import aclosing
+from typing import AsyncGenerator, Dict, List, Optional, Tuple, Union
 from .ingest_component import IngestComponent
-from typing import Generator, Dict
+from .components.llm.ollama_client import OllamaClient
+from .components.llm.router import OllamaRouter
+from .components.llm.scheduler import GenerationScheduler, Priority, SchedulerOverloaded
+from .components.llm.cascade import ModelCascade
+from .chat_sessions import SESSION_NUM_CTX, SESSION_NUM_PREDICT, ChatSession, ChatSessionStore
+from .folder_sync import FolderSync
+from .intent_router import IntentRouter
+from .tracing import Trace, describe_chunks, start_trace
+from .utils import metrics
+from .utils.resilience import CircuitOpen
+
+SESSION_SYSTEM_PROMPT = (
+    "Ты корпоративный AI-ассистент МТУСИ. Отвечай ТОЛЬКО на основе информации "
+    "из базы знаний, которая приводится в сообщениях пользователя. Если информации "
+    "недостаточно, так и скажи."
+)
+
+# endpoint: query (/api/rag/query), stream (/api/rag/query/stream), session (диалоги)
+RAG_STAGE_SECONDS = metrics.histogram(
+    "rag_stage_seconds", "RAG request stages: retrieve, prompt, queue, generate, total", ["endpoint", "stage"]
+)
+RAG_TIME_TO_FIRST_TOKEN = metrics.histogram(
+    "rag_time_to_first_token_seconds", "From the question to the first streamed answer token", ["endpoint"]
+)
+RAG_ERRORS = metrics.counter("rag_errors_total", "RAG requests answered with an error", ["endpoint"])
+
+# Сколько ждать поиска по базе знаний; поток поиска при этом не прерывается
+KB_QUERY_TIMEOUT = float(os.getenv("KB_QUERY_TIMEOUT", "10"))
+
+
+async def _prepend(first: Optional[Dict], stream: AsyncGenerator[Dict, None]) -> AsyncGenerator[Dict, None]:
+    """Уже полученный первый чанк и остаток потока; None - поток был пуст"""
+    if first is None:
+        return
+    yield first
+    async for chunk in stream:
+        yield chunk
+
 
 class RAGService:
-    def __init__(self, data_dir: str = "./data"):
-        self.ingest_component = IngestComponent(persist_dir=data_dir)
+    def __init__(
+        self,
+        data_dir: str = "./data",
+        llm_client: Optional[Union[OllamaClient, OllamaRouter]] = None,
+        scheduler: Optional[GenerationScheduler] = None,
+        ingest_component=None,
+    ):
+        # В многопроцессном режиме - клиент общего процесса индекса (index_server.py)
+        self.ingest_component = ingest_component or IngestComponent(persist_dir=data_dir)
+        # Синхронизация с папками (SYNC_DIRS) - в процессе, который пишет в индекс
+        self.folder_sync = FolderSync.from_env(self.ingest_component, data_dir) if ingest_component is None else None
+        if self.folder_sync is not None:
+            self.ingest_component.folder_sync = self.folder_sync
+            self.folder_sync.start()
+        # Общий пул соединений к Ollama, передается из lifespan приложения
+        self.llm_client = llm_client
+        # Контроль допуска генераций, общий с остальными эндпоинтами
+        self.scheduler = scheduler or GenerationScheduler()
+        # Многоходовые диалоги: история, кэш промпта и контекст Ollama
+        self.sessions = ChatSessionStore()
         # self.model = "llama3.1:8b"
         # self.model = "llama3.2:1b"
         self.model = "qwen2.5:0.5b"
+        # Каскад моделей по сложности вопроса (LLM_CASCADE_TIERS), по умолчанию только self.model
+        self.cascade = ModelCascade.from_env(self.model)
+        # Нужна ли база знаний для вопроса /api/chat (regex по основам + центроиды эмбеддингов)
+        self.intent_router = IntentRouter(self.ingest_component.embed_texts)
     
-    def add_document(self, file_path: str) -> Dict:
-        """Добавить документ в базу знаний"""
+    def add_document(self, file_path: str, doc_id: Optional[str] = None, file_name: Optional[str] = None) -> Dict:
+        """Добавить документ в базу знаний (или заменить документ с тем же doc_id)"""
+        doc_id = doc_id or uuid.uuid4().hex
         try:
-            success = self.ingest_component.ingest_file(file_path)
+            success = self.ingest_component.ingest_file(file_path, doc_id=doc_id, file_name=file_name)
             return {
                 "success": success,
+                "document_id": doc_id,
                 "file_path": file_path,
                 "message": "Document successfully added to knowledge base" if success else "Failed to add document"
             }
         except Exception as e:
             return {"success": False, "error": str(e)}
+
+    def delete_document(self, doc_id: str) -> bool:
+        """Удалить документ и все его фрагменты из базы знаний"""
+        return self.ingest_component.delete_document(doc_id)
+
+    def get_document(self, doc_id: str) -> Optional[Dict]:
+        return self.ingest_component.get_document(doc_id)
+
+    def list_documents(self, limit: int = 50, cursor: Optional[int] = None) -> Dict:
+        """Страница списка документов; next_cursor - для следующей страницы"""
+        return self.ingest_component.list_documents(limit, cursor)
     
-    def query_documents(self, question: str) -> Dict:
+    async def _retrieve(self, question: str, endpoint: str, trace: Trace) -> Tuple[List, List[float]]:
+        """Поиск фрагментов в отдельном потоке, чтобы не блокировать event loop"""
+        with trace.span("retrieve", RAG_STAGE_SECONDS.labels(endpoint, "retrieve")) as span:
+            try:
+                results = await asyncio.wait_for(
+                    asyncio.to_thread(self.ingest_component.query_with_scores, question), KB_QUERY_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Knowledge base search timed out after {KB_QUERY_TIMEOUT:.0f} s") from None
+            nodes, scores = [r.node for r in results], [r.score or 0.0 for r in results]
+            span["chunks"] = describe_chunks(nodes, scores)
+        return nodes, scores
+
+    async def query_documents(self, question: str, priority: Priority = Priority.NORMAL) -> Dict:
         """Поиск по документам с генерацией ответа"""
+        request_started = time.monotonic()
+        trace = start_trace("rag.query", question)
         try:
-            relevant_docs = self.ingest_component.query(question)
+            relevant_docs, scores = await self._retrieve(question, "query", trace)
             
+            prompt_started = time.monotonic()
             context = "\n\n".join([doc.text for doc in relevant_docs[:3]])  # Берем топ-3
             
             if context:
@@ -49,32 +141,61 @@ class RAGService:
 
                 ОТВЕТ:
                 """
+            trace.record("prompt", prompt_started, RAG_STAGE_SECONDS.labels("query", "prompt"), context_chars=len(context))
             
-            response = ollama.generate(
-                model=self.model,
-                prompt=prompt,
-                options={'temperature': 0.3}
-            )
+            tier = self.cascade.route(question, scores[:3])
+            while True:
+                model = self.cascade.tiers[tier].model
+                started = time.monotonic()
+                async with self.scheduler.slot(model, priority):
+                    generation_started = time.monotonic()
+                    trace.record("queue", started, RAG_STAGE_SECONDS.labels("query", "queue"), model=model)
+                    response = await self.llm_client.generate({
+                        "model": model,
+                        "prompt": prompt,
+                        "options": {'temperature': 0.3}
+                    })
+                    trace.record(
+                        "generate", generation_started, RAG_STAGE_SECONDS.labels("query", "generate"),
+                        model=model, eval_count=response.get("eval_count"),
+                    )
+                self.cascade.record_latency(tier, time.monotonic() - started)
+                # Ответ не опирается на контекст - переспрашиваем модель крупнее
+                if not self.cascade.should_escalate(tier, response['response'], context):
+                    break
+                tier += 1
             
+            RAG_STAGE_SECONDS.labels("query", "total").observe(time.monotonic() - request_started)
+            trace.finish()
             return {
                 "answer": response['response'],
+                "model": model,
                 "sources_used": len(relevant_docs),
                 "sources_preview": [doc.metadata.get('file_name', 'Unknown') for doc in relevant_docs[:3]],
-                "context_length": len(context)
+                "context_length": len(context),
+                "trace_id": trace.trace_id
             }
             
+        except SchedulerOverloaded:
+            trace.finish("overloaded")
+            raise
+        except CircuitOpen:
+            trace.finish("circuit_open")
+            raise
         except Exception as e:
+            RAG_ERRORS.labels("query").inc()
+            trace.finish("error", str(e))
             return {"error": str(e), "answer": "Извините, произошла ошибка при поиске в документах"}
     
-    def query_documents_stream(self, question: str) -> Generator[Dict, None, None]:
+    async def query_documents_stream(
+        self, question: str, priority: Priority = Priority.INTERACTIVE
+    ) -> AsyncGenerator[Dict, None]:
         """Streaming версия поиска по документам"""
+        request_started = time.monotonic()
+        trace = start_trace("rag.stream", question)
         try:
-            print("Вопрос: ", question, " \n")
-            relevant_docs = self.ingest_component.query(question)
+            relevant_docs, scores = await self._retrieve(question, "stream", trace)
             context = "\n\n".join([doc.text for doc in relevant_docs[:3]])
-            context1 = relevant_docs[0].text
-            context2 = relevant_docs[1].text
-            context3 = relevant_docs[2].text
             
             if not context:
                 # Нет документов - сразу возвращаем сообщение об отсутствии информации
@@ -89,9 +210,11 @@ class RAGService:
                     "content": "В базе знаний МТУСИ нет информации по данному вопросу.",
                     "done": True
                 }
+                trace.finish("no_sources")
                 return
             
             
+            prompt_started = time.monotonic()
             prompt = f"""Ты корпоративный AI-ассистент МТУСИ. 
 
             ИНФОРМАЦИЯ ИЗ БАЗЫ ЗНАНИЙ:
@@ -102,49 +225,201 @@ class RAGService:
             Отвечай ТОЛЬКО на основе информации из базы знаний. 
 
             ОТВЕТ:"""
-
-            print("Контекст 1: \n", context1, "\n")
-            print("Контекст 2: \n", context2, "\n")
-            print("Контекст 3: \n", context3)
-            
-            # Streaming генерация через Ollama
-            stream = ollama.chat(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                stream=True,
-                options={'temperature': 0.1, 'num_predict': 400}
-            )
-            
-            # Отправляем информацию об источниках сначала
-            yield {
-                "type": "sources", 
-                "sources": [doc.metadata.get('file_name', 'Unknown') for doc in relevant_docs[:3]],
-                "sources_count": len(relevant_docs),
-                "has_sources": True
-            }
+            trace.record("prompt", prompt_started, RAG_STAGE_SECONDS.labels("stream", "prompt"), context_chars=len(context))
             
-            # Затем streaming ответ
-            full_response = ""
-            for chunk in stream:
-                if 'message' in chunk and 'content' in chunk['message']:
-                    content = chunk['message']['content']
-                    full_response += content
+            # В стриминге эскалация невозможна: ответ уже у пользователя
+            tier = self.cascade.route(question, scores[:3])
+            model = self.cascade.tiers[tier].model
+            started = time.monotonic()
+            async with self.scheduler.slot(model, priority):
+                generation_started = time.monotonic()
+                trace.record("queue", started, RAG_STAGE_SECONDS.labels("stream", "queue"), model=model)
+                # aclosing: если клиент ушел, HTTP запрос к Ollama закрывается
+                # сразу и генерация прекращается
+                answer_parts = []
+                async with aclosing(self.llm_client.stream("/api/chat", {
+                    "model": model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "options": {'temperature': 0.1, 'num_predict': 400}
+                })) as stream:
+                    # Первый чанк Ollama до первого кадра: разомкнутый автомат
+                    # становится 503 с Retry-After, а не ошибкой внутри потока
+                    chunk = await anext(stream, None)
+                    # Отправляем информацию об источниках сначала
                     yield {
-                        "type": "content", 
-                        "content": content,
-                        "done": False
+                        "type": "sources", 
+                        "sources": [doc.metadata.get('file_name', 'Unknown') for doc in relevant_docs[:3]],
+                        "sources_count": len(relevant_docs),
+                        "has_sources": True,
+                        "trace_id": trace.trace_id
                     }
+                    
+                    # Затем streaming ответ
+                    async for chunk in _prepend(chunk, stream):
+                        if 'message' in chunk and 'content' in chunk['message']:
+                            content = chunk['message']['content']
+                            if not answer_parts:
+                                first_token = time.monotonic() - request_started
+                                RAG_TIME_TO_FIRST_TOKEN.labels("stream").observe(first_token)
+                                trace.set(first_token_ms=round(first_token * 1000, 2))
+                            answer_parts.append(content)
+                            yield {
+                                "type": "content", 
+                                "content": content,
+                                "done": False
+                            }
+                trace.record(
+                    "generate", generation_started, RAG_STAGE_SECONDS.labels("stream", "generate"),
+                    model=model, chunks=len(answer_parts),
+                )
+            self.cascade.record_latency(tier, time.monotonic() - started)
+            RAG_STAGE_SECONDS.labels("stream", "total").observe(time.monotonic() - request_started)
+            trace.finish()
             
             # Финальный chunk
             yield {
                 "type": "content",
                 "content": "",
                 "done": True,
-                "full_response": full_response
+                "full_response": "".join(answer_parts)
             }
             
+        except SchedulerOverloaded:
+            trace.finish("overloaded")
+            raise
+        except CircuitOpen:
+            trace.finish("circuit_open")
+            raise
         except Exception as e:
+            RAG_ERRORS.labels("stream").inc()
+            trace.finish("error", str(e))
             yield {"type": "error", "content": f"Ошибка: {str(e)}"}
+        finally:
+            # Клиент отключился посреди ответа
+            trace.finish("cancelled")
+
+    def create_session(self) -> ChatSession:
+        """Новая сессия диалога"""
+        return self.sessions.create(SESSION_SYSTEM_PROMPT)
+
+    async def query_session_stream(
+        self, session: ChatSession, question: str, priority: Priority = Priority.INTERACTIVE
+    ) -> AsyncGenerator[Dict, None]:
+        """Streaming ответ в рамках сессии диалога.
+
+        Системный промпт и прошлые реплики не отправляются заново: Ollama
+        получает свой context от прошлого ответа и только новый фрагмент
+        (ChatSession.build_prompt).
+        """
+        request_started = time.monotonic()
+        trace = start_trace("rag.session", question, session_id=session.session_id)
+        async with session.lock:
+            try:
+                relevant_docs, scores = await self._retrieve(question, "session", trace)
+                context = "\n\n".join([doc.text for doc in relevant_docs[:3]])
+                tier = self.cascade.route(question, scores[:3])
+                model = self.cascade.tiers[tier].model
+                if context:
+                    user_message = f"ИНФОРМАЦИЯ ИЗ БАЗЫ ЗНАНИЙ:\n{context}\n\nВОПРОС: {question}"
+                else:
+                    user_message = f"ВОПРОС: {question}"
+
+                started = time.monotonic()
+                async with self.scheduler.slot(model, priority):
+                    prompt_started = time.monotonic()
+                    trace.record("queue", started, RAG_STAGE_SECONDS.labels("session", "queue"), model=model)
+                    generation = session.build_prompt(user_message, model)
+                    trace.record(
+                        "prompt", prompt_started, RAG_STAGE_SECONDS.labels("session", "prompt"),
+                        context_chars=len(context), context_reused="context" in generation,
+                    )
+                    generation_started = time.monotonic()
+                    answer_parts = []
+                    ollama_context = None
+                    async with aclosing(self.llm_client.stream("/api/generate", {
+                        "model": model,
+                        **generation,
+                        # num_ctx явно: под это окно обрезается история сессии
+                        "options": {'temperature': 0.1, 'num_predict': SESSION_NUM_PREDICT, 'num_ctx': SESSION_NUM_CTX}
+                    })) as stream:
+                        # Как в query_documents_stream: отказ Ollama - до первого кадра
+                        chunk = await anext(stream, None)
+                        yield {
+                            "type": "sources",
+                            "session_id": session.session_id,
+                            "sources": [doc.metadata.get('file_name', 'Unknown') for doc in relevant_docs[:3]],
+                            "sources_count": len(relevant_docs),
+                            "has_sources": bool(context),
+                            "context_reused": "context" in generation,
+                            "trace_id": trace.trace_id,
+                        }
+
+                        async for chunk in _prepend(chunk, stream):
+                            content = chunk.get("response")
+                            if content:
+                                if not answer_parts:
+                                    first_token = time.monotonic() - request_started
+                                    RAG_TIME_TO_FIRST_TOKEN.labels("session").observe(first_token)
+                                    trace.set(first_token_ms=round(first_token * 1000, 2))
+                                answer_parts.append(content)
+                                yield {"type": "content", "content": content, "done": False}
+                            if chunk.get("done"):
+                                ollama_context = chunk.get("context")
+                    trace.record(
+                        "generate", generation_started, RAG_STAGE_SECONDS.labels("session", "generate"),
+                        model=model, chunks=len(answer_parts),
+                    )
+
+                self.cascade.record_latency(tier, time.monotonic() - started)
+                RAG_STAGE_SECONDS.labels("session", "total").observe(time.monotonic() - request_started)
+                trace.finish()
+                full_response = "".join(answer_parts)
+                session.add_answer(full_response, model, ollama_context)
+                self.sessions.turn_finished(session)
+                yield {
+                    "type": "content",
+                    "content": "",
+                    "done": True,
+                    "full_response": full_response
+                }
+
+            except SchedulerOverloaded:
+                trace.finish("overloaded")
+                raise
+            except CircuitOpen:
+                trace.finish("circuit_open")
+                raise
+            except Exception as e:
+                RAG_ERRORS.labels("session").inc()
+                trace.finish("error", str(e))
+                yield {"type": "error", "content": f"Ошибка: {str(e)}"}
+            finally:
+                # Ошибка или клиент отключился посреди ответа - вопрос без ответа не храним
+                session.discard_question()
+                trace.finish("cancelled")
+
+    def flush_knowledge_base(self) -> None:
+        """Сохранить индекс на диск, не дожидаясь очередной группы записей"""
+        self.ingest_component.flush()
+
+    def export_knowledge_base(self, path: str) -> Dict:
+        """Выгрузить базу знаний в файл снимка (rag_system/snapshot.py)"""
+        return self.ingest_component.export_snapshot(path)
+
+    def import_knowledge_base(self, path: str, replace: bool = False) -> Dict:
+        """Загрузить снимок базы знаний без пересчета эмбеддингов"""
+        return self.ingest_component.import_snapshot(path, replace=replace)
+
+    def close(self) -> None:
+        if self.folder_sync is not None:
+            self.folder_sync.close()
+        self.ingest_component.close()
+
+    def index_metrics(self) -> Dict:
+        """Метрики отдельного процесса индекса; в своем процессе они и так в /metrics"""
+        if isinstance(self.ingest_component, IngestComponent):
+            return {}
+        return self.ingest_component.collect_metrics()
 
     def get_knowledge_base_stats(self) -> Dict:
         """Получить статистику базы знаний"""
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+from .index_server import RemoteIngestComponent, index_address
+
+if TYPE_CHECKING:
+    from .rag_service import RAGService
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceNotReady(Exception):
+    """RAG сервис еще загружается или не смог загрузиться"""
+
+    def __init__(self, state: str, stage: Optional[str] = None, error: Optional[str] = None):
+        self.state = state
+        self.stage = stage
+        self.error = error
+        super().__init__(f"RAG service is {state}" + (f" ({stage})" if stage else ""))
+
+
+class RAGServiceLoader:
+    """Фоновая загрузка RAG сервиса после старта сервера.
+
+    Импорт llama-index/chromadb, загрузка модели эмбеддингов и открытие
+    Chroma занимают секунды, поэтому выполняются в потоке из lifespan:
+    порт открывается сразу, а /ready показывает, на каком этапе загрузка.
+    """
+
+    # Этапы в порядке выполнения, для прогресса в /ready
+    STAGES = ["import", "build_service", "intent_centroids"]
+
+    def __init__(self, data_dir: str = "./data"):
+        self.data_dir = data_dir
+        self.service: Optional["RAGService"] = None
+        # pending -> loading -> ready, либо error
+        self.state = "pending"
+        self.stage: Optional[str] = None
+        self.stage_seconds: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._callbacks: List[Callable[["RAGService"], None]] = []
+
+    @contextmanager
+    def _stage(self, name: str):
+        self.stage = name
+        started = time.monotonic()
+        yield
+        self.stage_seconds[name] = round(time.monotonic() - started, 3)
+
+    def _load_sync(self) -> "RAGService":
+        with self._stage("import"):
+            from .rag_service import RAGService
+        with self._stage("build_service"):
+            address = index_address()
+            # Воркер в многопроцессном режиме: модель и Chroma в процессе индекса
+            ingest_component = RemoteIngestComponent(address) if address else None
+            service = RAGService(self.data_dir, ingest_component=ingest_component)
+        with self._stage("intent_centroids"):
+            service.intent_router.build_centroids()
+        return service
+
+    def on_ready(self, callback: Callable[["RAGService"], None]) -> None:
+        """Вызвать callback с сервисом сразу после загрузки (или сейчас, если уже загружен)"""
+        if self.service is not None:
+            callback(self.service)
+        else:
+            self._callbacks.append(callback)
+
+    async def load(self) -> None:
+        self.state = "loading"
+        self.started_at = time.monotonic()
+        try:
+            service = await asyncio.to_thread(self._load_sync)
+        except Exception as e:
+            self.state = "error"
+            self.error = str(e)
+            logger.exception("Failed to load RAG service at stage %s", self.stage)
+            return
+        finally:
+            self.finished_at = time.monotonic()
+
+        self.service = service
+        self.state = "ready"
+        self.stage = None
+        for callback in self._callbacks:
+            callback(service)
+        self._callbacks.clear()
+        logger.info("RAG service loaded in %.2fs: %s", self.finished_at - self.started_at, self.stage_seconds)
+
+    def get(self) -> "RAGService":
+        if self.service is None:
+            raise ServiceNotReady(self.state, self.stage, self.error)
+        return self.service
+
+    @property
+    def progress(self) -> float:
+        if self.state == "ready":
+            return 1.0
+        return round(len(self.stage_seconds) / len(self.STAGES), 2)
+
+    def status(self) -> Dict:
+        end = self.finished_at or time.monotonic()
+        return {
+            "state": self.state,
+            "stage": self.stage,
+            "progress": self.progress,
+            "elapsed_seconds": round(end - self.started_at, 3) if self.started_at else 0.0,
+            "stage_seconds": dict(self.stage_seconds),
+            "error": self.error,
+        }
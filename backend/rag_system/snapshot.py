@@ -0,0 +1,200 @@
+"""Снимок базы знаний: экспорт и импорт коллекции Chroma без пересчета эмбеддингов.
+
+Формат - zip без сжатия:
+
+    manifest.json    модель эмбеддингов, размерность, число записей
+    records.jsonl    id, текст и метаданные, по строке на запись
+    embeddings.npy   float32 массив [count, dimension], строки в порядке records.jsonl
+
+Векторы пишутся и читаются страницами, поэтому память не зависит от
+размера базы, а скорость импорта упирается в диск и запись в Chroma.
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from .utils.chroma import max_batch_size
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = "corporate-assistant-kb-snapshot"
+SNAPSHOT_VERSION = 1
+# Записей за один get/add к Chroma
+SNAPSHOT_PAGE_SIZE = int(os.getenv("SNAPSHOT_PAGE_SIZE", "5000"))
+
+_MANIFEST = "manifest.json"
+_RECORDS = "records.jsonl"
+_EMBEDDINGS = "embeddings.npy"
+# Коллекция, в которую загружается снимок до подмены основной
+_STAGING_SUFFIX = "__import"
+
+
+class SnapshotError(ValueError):
+    """Снимок поврежден или не подходит к текущей модели эмбеддингов"""
+
+
+def read_manifest(path: Path) -> Dict:
+    try:
+        with zipfile.ZipFile(path) as zf:
+            manifest = json.loads(zf.read(_MANIFEST))
+    except (zipfile.BadZipFile, KeyError, json.JSONDecodeError) as e:
+        raise SnapshotError(f"Not a knowledge base snapshot: {e}") from e
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Unknown snapshot format: {manifest.get('format')}")
+    if manifest.get("version", 0) > SNAPSHOT_VERSION:
+        raise SnapshotError(f"Snapshot version {manifest['version']} is newer than supported {SNAPSHOT_VERSION}")
+    return manifest
+
+
+def check_snapshot(path: Path, embedding_model: str, dimension: int) -> Dict:
+    """Манифест снимка, если снимок подходит к текущей модели эмбеддингов"""
+    manifest = read_manifest(path)
+    if manifest["embedding_model"] != embedding_model or manifest["dimension"] != dimension:
+        raise SnapshotError(
+            f"Snapshot was built with {manifest['embedding_model']} ({manifest['dimension']}d), "
+            f"current model is {embedding_model} ({dimension}d)"
+        )
+    return manifest
+
+
+def export_snapshot(collection: Any, path: Path, embedding_model: str, dimension: int,
+                    page_size: int = SNAPSHOT_PAGE_SIZE) -> Dict:
+    """Выгрузить коллекцию в файл снимка; записи в коллекцию на это время должны быть остановлены"""
+    started = time.monotonic()
+    path = Path(path)
+    count = collection.count()
+    tmp_path = path.with_name(path.name + ".tmp")
+
+    try:
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf, \
+                tempfile.TemporaryFile("w+", encoding="utf-8") as records:
+            written = 0
+            with zf.open(_EMBEDDINGS, "w", force_zip64=True) as f:
+                np.lib.format.write_array_header_2_0(
+                    f, {"descr": "<f4", "fortran_order": False, "shape": (count, dimension)}
+                )
+                for offset in range(0, count, page_size):
+                    page = collection.get(
+                        limit=page_size, offset=offset, include=["embeddings", "documents", "metadatas"]
+                    )
+                    vectors = np.ascontiguousarray(page["embeddings"], dtype="<f4")
+                    if vectors.shape[1:] != (dimension,):
+                        raise SnapshotError(f"Collection has {vectors.shape[1:]} vectors, expected {dimension}")
+                    f.write(vectors.tobytes())
+                    for record in zip(page["ids"], page["documents"], page["metadatas"]):
+                        records.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    written += len(page["ids"])
+            if written != count:
+                raise SnapshotError(f"Collection changed during export: {written} of {count} records")
+
+            # Тексты копим во временном файле: в zip нельзя писать два файла сразу
+            records.seek(0)
+            with zf.open(_RECORDS, "w", force_zip64=True) as f:
+                for line in records:
+                    f.write(line.encode("utf-8"))
+
+            manifest = {
+                "format": SNAPSHOT_FORMAT,
+                "version": SNAPSHOT_VERSION,
+                "embedding_model": embedding_model,
+                "dimension": dimension,
+                "count": count,
+                "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            }
+            zf.writestr(_MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2))
+    except BaseException:
+        # Иначе недописанный .tmp остается на диске после каждой неудачной выгрузки
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    os.replace(tmp_path, path)
+    logger.info("Exported %d records to %s in %.2fs", count, path, time.monotonic() - started)
+    return manifest
+
+
+def _iter_batches(zf: zipfile.ZipFile, manifest: Dict, batch_size: int) -> Iterator[Tuple[List, np.ndarray, List, List]]:
+    dimension = manifest["dimension"]
+    with zf.open(_EMBEDDINGS) as vectors_file, zf.open(_RECORDS) as records_file:
+        major, minor = np.lib.format.read_magic(vectors_file)
+        if major == 1:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(vectors_file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(vectors_file)
+        if shape != (manifest["count"], dimension) or fortran_order or dtype != np.dtype("<f4"):
+            raise SnapshotError(f"Embeddings array {shape} {dtype} does not match the manifest")
+
+        row_bytes = dimension * 4
+        remaining = manifest["count"]
+        while remaining:
+            rows = min(batch_size, remaining)
+            data = vectors_file.read(rows * row_bytes)
+            if len(data) != rows * row_bytes:
+                raise SnapshotError("Snapshot embeddings are truncated")
+            ids, documents, metadatas = [], [], []
+            for _ in range(rows):
+                record_id, document, metadata = json.loads(records_file.readline())
+                ids.append(record_id)
+                documents.append(document)
+                metadatas.append(metadata)
+            yield ids, np.frombuffer(data, dtype="<f4").reshape(rows, dimension), documents, metadatas
+            remaining -= rows
+
+
+def import_snapshot(collection: Any, chroma_client: Any, path: Path, embedding_model: str,
+                    dimension: int) -> Dict:
+    """Загрузить снимок в пустую коллекцию пачками максимального для Chroma размера"""
+    started = time.monotonic()
+    manifest = check_snapshot(path, embedding_model, dimension)
+    if collection.count():
+        raise SnapshotError("Knowledge base is not empty, import requires replace")
+
+    batch_size = min(max_batch_size(chroma_client), SNAPSHOT_PAGE_SIZE)
+    loaded = 0
+    with zipfile.ZipFile(path) as zf:
+        for ids, vectors, documents, metadatas in _iter_batches(zf, manifest, batch_size):
+            # chromadb 0.4 принимает только списки
+            collection.add(ids=ids, embeddings=vectors.tolist(), documents=documents, metadatas=metadatas)
+            loaded += len(ids)
+            logger.debug("Imported %d/%d records", loaded, manifest["count"])
+
+    elapsed = time.monotonic() - started
+    logger.info("Imported %d records from %s in %.2fs", loaded, path, elapsed)
+    return {**manifest, "imported": loaded, "seconds": round(elapsed, 2)}
+
+
+def replace_from_snapshot(chroma_client: Any, name: str, path: Path, embedding_model: str,
+                          dimension: int) -> Dict:
+    """Заменить коллекцию name содержимым снимка.
+
+    Снимок загружается в отдельную коллекцию и подменяет name только после
+    успешной загрузки: поврежденный или чужой снимок не трогает текущую базу.
+    """
+    check_snapshot(path, embedding_model, dimension)
+    staging_name = f"{name}{_STAGING_SUFFIX}"
+    # Остаток прерванного импорта
+    _drop_collection(chroma_client, staging_name)
+    staging = chroma_client.create_collection(staging_name)
+    try:
+        result = import_snapshot(staging, chroma_client, path, embedding_model, dimension)
+    except BaseException:
+        _drop_collection(chroma_client, staging_name)
+        raise
+    chroma_client.delete_collection(name)
+    staging.modify(name=name)
+    return result
+
+
+def _drop_collection(chroma_client: Any, name: str) -> None:
+    try:
+        chroma_client.delete_collection(name)
+    except Exception:
+        # Нет такой коллекции: chromadb бросает ValueError или NotFoundError по версии
+        pass
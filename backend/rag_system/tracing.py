@@ -0,0 +1,146 @@
+"""Трассировка запросов к базе знаний вместо print() в горячем пути.
+
+Trace - один запрос с trace_id и спанами (retrieve, prompt, queue,
+generate). Спаны пишутся всегда - это пара чисел в списке, а в лог трасса
+уходит одной JSON строкой только если запрос попал в выборку
+(TRACE_SAMPLE_RATE) или закончился ошибкой. Вместо текстов фрагментов -
+их id, файл и оценка близости.
+
+Запись в лог не блокирует запрос: логгер трасс пишет в ограниченную
+очередь, а в консоль или файл строки выводит отдельный поток
+(QueueListener). Если очередь полна, строка отбрасывается и считается.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from .utils import metrics
+
+# Доля запросов, трассы которых пишутся в лог (ошибки пишутся всегда)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+# Файл для трасс; по умолчанию - stderr
+TRACE_LOG_FILE = os.getenv("TRACE_LOG_FILE", "")
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+# Сколько символов вопроса попадает в трассу
+TRACE_MAX_QUESTION_CHARS = int(os.getenv("TRACE_MAX_QUESTION_CHARS", "200"))
+
+trace_logger = logging.getLogger("rag_system.trace")
+
+TRACES_DROPPED = metrics.counter("rag_traces_dropped_total", "Trace records dropped because the log queue was full")
+
+
+class Trace:
+    def __init__(self, name: str, sampled: bool, **attributes: Any):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.sampled = sampled
+        self.attributes: Dict[str, Any] = attributes
+        self.spans: List[Dict[str, Any]] = []
+        self.started = time.monotonic()
+        self.finished = False
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def record(self, name: str, started: float, metric=None, **attributes: Any) -> float:
+        """Спан от started (time.monotonic()) до текущего момента; metric - гистограмма для той же длительности"""
+        duration = time.monotonic() - started
+        if metric is not None:
+            metric.observe(duration)
+        self.spans.append({
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2),
+            **attributes,
+        })
+        return duration
+
+    @contextmanager
+    def span(self, name: str, metric=None, **attributes: Any) -> Iterator[Dict[str, Any]]:
+        """Спан на блок кода; в отданный dict можно дописать атрибуты"""
+        started = time.monotonic()
+        extra: Dict[str, Any] = dict(attributes)
+        try:
+            yield extra
+        finally:
+            self.record(name, started, metric, **extra)
+
+    def finish(self, status: str = "ok", error: Optional[str] = None) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        if not (self.sampled or error):
+            return
+        record = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "status": status,
+            "duration_ms": round((time.monotonic() - self.started) * 1000, 2),
+            **self.attributes,
+            "spans": self.spans,
+        }
+        if error:
+            record["error"] = error
+        trace_logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def start_trace(name: str, question: Optional[str] = None, **attributes: Any) -> Trace:
+    sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    if question is not None:
+        attributes["question"] = question[:TRACE_MAX_QUESTION_CHARS]
+        attributes["question_chars"] = len(question)
+    return Trace(name, sampled, **attributes)
+
+
+def describe_chunks(nodes: List, scores: List[float]) -> List[Dict[str, Any]]:
+    """Фрагменты для трассы: id, файл и оценка вместо текста"""
+    return [
+        {"id": node.node_id, "file": node.metadata.get("file_name"), "score": round(score, 4)}
+        for node, score in zip(nodes, scores)
+    ]
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при полной очереди отбрасывает запись, а не ждет"""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            TRACES_DROPPED.inc()
+
+
+def start_trace_logging() -> logging.handlers.QueueListener:
+    """Вывод трасс через очередь и отдельный поток; вызывается при старте приложения"""
+    if TRACE_LOG_FILE:
+        target: logging.Handler = logging.handlers.RotatingFileHandler(
+            TRACE_LOG_FILE, maxBytes=50 * 1024 * 1024, backupCount=5, encoding="utf-8"
+        )
+    else:
+        target = logging.StreamHandler(sys.stderr)
+    target.setFormatter(logging.Formatter("%(message)s"))
+    log_queue: queue.Queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    trace_logger.handlers = [handler]
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+    listener = logging.handlers.QueueListener(log_queue, target, respect_handler_level=False)
+    listener.start()
+    return listener
+
+
+def stop_trace_logging(listener: logging.handlers.QueueListener) -> None:
+    """Дописать оставшиеся в очереди трассы и закрыть вывод"""
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    trace_logger.handlers = []
+    trace_logger.propagate = True
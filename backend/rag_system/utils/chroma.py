@@ -0,0 +1,20 @@
+from collections.abc import Iterator, Sequence
+from typing import Any
+
+# Размер пачки, если клиент Chroma его не сообщает
+DEFAULT_MAX_BATCH_SIZE = 5000
+
+
+def max_batch_size(chroma_client: Any) -> int:
+    """Максимальный размер одного add/delete для клиента Chroma.
+
+    get_max_batch_size() в новых chromadb, свойство max_batch_size в 0.4.x.
+    """
+    if hasattr(chroma_client, "get_max_batch_size"):
+        return chroma_client.get_max_batch_size()
+    return getattr(chroma_client, "max_batch_size", DEFAULT_MAX_BATCH_SIZE)
+
+
+def batched(items: Sequence[Any], size: int) -> Iterator[Sequence[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
@@ -0,0 +1,63 @@
+import bisect
+import threading
+from typing import Dict, Sequence
+
+# Границы по умолчанию для длительностей в секундах: от 1 мс до 1 минуты
+DEFAULT_SECONDS_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин.
+
+    Хранит только счетчики по корзинам, сумму и количество, поэтому
+    observe() - это bisect и пара сложений, а память не растет с числом
+    наблюдений. Квантили оцениваются по верхней границе корзины.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_SECONDS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # Последняя корзина - все, что больше верхней границы (+Inf)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля; значения выше последней границы дают эту границу"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                break
+        return self.buckets[min(index, len(self.buckets) - 1)]
+
+    def cumulative(self) -> list:
+        """Пары (граница, накопленный счетчик), как в формате Prometheus"""
+        total = 0
+        result = []
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), self.counts):
+            total += bucket_count
+            result.append((bound, total))
+        return result
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "avg": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
@@ -0,0 +1,26 @@
+import asyncio
+import os
+import time
+
+from . import metrics
+
+# Как часто проверять задержку event loop
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.1"))
+
+EVENT_LOOP_LAG_SECONDS = metrics.histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop woke up a sleeping task",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+
+async def monitor_event_loop_lag(interval: float = EVENT_LOOP_LAG_INTERVAL) -> None:
+    """Задача на время жизни приложения: насколько позже срока просыпается sleep.
+
+    Большая задержка значит, что кто-то блокирует event loop (синхронный
+    вызов в обработчике) - тогда растут задержки всех запросов сразу.
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - started - interval))
@@ -0,0 +1,201 @@
+"""Метрики процесса в текстовом формате Prometheus (GET /metrics).
+
+Без prometheus_client: счетчики и гистограммы на utils/histogram.py,
+регистрация - на уровне модуля рядом с кодом, который их пишет:
+
+    RETRIEVAL_SECONDS = metrics.histogram("rag_retrieval_seconds", "...")
+    with metrics.timed(RETRIEVAL_SECONDS):
+        ...
+
+Запись - это поиск серии по меткам в dict и пара сложений под замком,
+поэтому метрики можно держать включенными в продакшене.
+"""
+import abc
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from .histogram import DEFAULT_SECONDS_BUCKETS, Histogram
+
+
+class CounterValue:
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _Family(abc.ABC):
+    """Метрика со всеми сериями (сочетаниями значений меток)"""
+
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _new_child(self) -> object:
+        """Значение новой серии"""
+
+    def labels(self, *values: object):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _label_text(self, key: Tuple[str, ...], const: str, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        pairs.extend(pair for pair in (const, extra) if pair)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self, const: str = "") -> List[str]:
+        """Строки серий; const - метка для всех серий, например 'process="index"'"""
+        lines: List[str] = []
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child, const))
+        return lines
+
+    @abc.abstractmethod
+    def _render_child(self, key: Tuple[str, ...], child, const: str) -> List[str]:
+        """Строки одной серии в формате Prometheus"""
+
+
+class Counter(_Family):
+    type = "counter"
+
+    def _new_child(self) -> CounterValue:
+        return CounterValue()
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Для метрики без меток"""
+        self.labels().inc(amount)
+
+    def _render_child(self, key: Tuple[str, ...], child: CounterValue, const: str) -> List[str]:
+        return [f"{self.name}{self._label_text(key, const)} {_number(child.value)}"]
+
+
+class HistogramFamily(_Family):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_SECONDS_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self) -> Histogram:
+        return Histogram(self.buckets)
+
+    def observe(self, value: float) -> None:
+        """Для метрики без меток"""
+        self.labels().observe(value)
+
+    def _render_child(self, key: Tuple[str, ...], child: Histogram, const: str) -> List[str]:
+        lines = [
+            f"{self.name}_bucket{self._label_text(key, const, f'le={_quote(_number(bound))}')} {count}"
+            for bound, count in child.cumulative()
+        ]
+        lines.append(f"{self.name}_sum{self._label_text(key, const)} {_number(child.sum)}")
+        lines.append(f"{self.name}_count{self._label_text(key, const)} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._families: Dict[str, _Family] = {}
+        self._lock = threading.Lock()
+
+    def register(self, family: _Family) -> _Family:
+        with self._lock:
+            existing = self._families.get(family.name)
+            if existing is None:
+                self._families[family.name] = family
+                return family
+        if type(existing) is not type(family) or existing.labelnames != family.labelnames:
+            raise ValueError(f"Metric {family.name} is already registered with another type or labels")
+        return existing
+
+    def collect(self, process: str = "") -> Dict[str, Tuple[str, str, List[str]]]:
+        """Непустые метрики: имя -> (help, type, строки серий).
+
+        process добавляется меткой ко всем сериям - так метрики процесса
+        индекса (index_server.py) не пересекаются с метриками воркера.
+        """
+        const = f'process="{_escape(process)}"' if process else ""
+        return {
+            family.name: (family.help, family.type, family.samples(const))
+            for family in list(self._families.values())
+            if family._children
+        }
+
+    def render(self, *extra: Dict[str, Tuple[str, str, List[str]]]) -> str:
+        """Текст для /metrics; extra - результаты collect() других процессов"""
+        merged = self.collect()
+        for collected in extra:
+            for name, (help, type, lines) in collected.items():
+                if name in merged:
+                    merged[name][2].extend(lines)
+                else:
+                    merged[name] = (help, type, list(lines))
+        output: List[str] = []
+        for name, (help, type, lines) in merged.items():
+            output.append(f"# HELP {name} {help}")
+            output.append(f"# TYPE {name} {type}")
+            output.extend(lines)
+        return "\n".join(output) + "\n" if output else ""
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_SECONDS_BUCKETS) -> HistogramFamily:
+    return REGISTRY.register(HistogramFamily(name, help, labelnames, buckets))
+
+
+def collect(process: str = "") -> Dict[str, Tuple[str, str, List[str]]]:
+    return REGISTRY.collect(process)
+
+
+def render(*extra: Dict[str, Tuple[str, str, List[str]]]) -> str:
+    return REGISTRY.render(*extra)
+
+
+@contextmanager
+def timed(metric) -> Iterator[None]:
+    """Записать длительность блока в секундах (Histogram или серию HistogramFamily)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.observe(time.perf_counter() - started)
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _quote(value: str) -> str:
+    return f'"{value}"'
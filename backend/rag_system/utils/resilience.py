@@ -0,0 +1,312 @@
+"""Повторы с джиттером, автоматы защиты и таймауты для вызовов зависимостей.
+
+Автомат защиты (circuit breaker) - один на зависимость (ollama, chroma).
+После BREAKER_FAILURE_THRESHOLD ошибок подряд он размыкается, и вызовы
+сразу получают CircuitOpen, не дожидаясь таймаутов. Через
+BREAKER_RESET_TIMEOUT секунд пропускается один пробный вызов: успех
+замыкает автомат, ошибка размыкает снова.
+
+    OLLAMA_BREAKER = resilience.breaker("ollama")
+    result = await resilience.acall("ollama.generate", lambda: client.generate(payload),
+                                    breaker=OLLAMA_BREAKER, timeout=60, tries=3)
+
+Паузы между повторами - со случайной величиной от 0 до delay * 2^n
+(full jitter), чтобы воркеры не повторяли запросы одновременно.
+Асинхронные повторы ждут через asyncio.sleep и не занимают поток.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+from . import metrics
+from .retry import RETRIES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Ошибок подряд до размыкания и сколько секунд автомат разомкнут
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "15"))
+
+BREAKER_REJECTIONS = metrics.counter(
+    "circuit_breaker_rejections_total", "Calls rejected without trying because the breaker was open", ["name"]
+)
+BREAKER_TRANSITIONS = metrics.counter(
+    "circuit_breaker_transitions_total", "Circuit breaker state changes", ["name", "state"]
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Зависимость недоступна, вызов отклонен без попытки"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable, retry in {retry_after:.0f} s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            self.state = state
+            BREAKER_TRANSITIONS.labels(self.name, state).inc()
+
+    def before_call(self) -> None:
+        """Разрешить вызов или бросить CircuitOpen"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            waited = time.monotonic() - self._opened_at
+            if self.state == OPEN and waited >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                # Один пробный вызов, остальные отклоняются до его результата
+                self._trial_in_flight = True
+                return
+            self.rejected += 1
+        BREAKER_REJECTIONS.labels(self.name).inc()
+        raise CircuitOpen(self.name, max(1.0, self.reset_timeout - waited))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+            if self.state != CLOSED:
+                logger.info("Circuit breaker %s closed", self.name)
+                self._set_state(CLOSED)
+
+    def record_failure(self, error: BaseException) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error) or type(error).__name__
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self._opened_at = time.monotonic()
+                logger.warning("Circuit breaker %s opened after %d failures: %s",
+                               self.name, self.consecutive_failures, self.last_error)
+                self._set_state(OPEN)
+
+    def release(self) -> None:
+        """Вызов завершился без результата (отмена, ошибка клиента) - освободить пробный вызов"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    @contextmanager
+    def guard(self, is_failure: Optional[Callable[[Exception], bool]] = None) -> Iterator[None]:
+        """Блок кода как один вызов зависимости; is_failure отделяет ее отказы от ошибок вызывающего"""
+        self.before_call()
+        try:
+            yield
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self.record_failure(e)
+            else:
+                self.release()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "rejected": self.rejected,
+                "last_error": self.last_error,
+                "open_for_seconds": (
+                    round(time.monotonic() - self._opened_at, 1) if self.state != CLOSED else None
+                ),
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name: str, **kwargs: Any) -> CircuitBreaker:
+    """Автомат защиты зависимости; один на имя в процессе"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **kwargs)
+        return _breakers[name]
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    return {name: b.snapshot() for name, b in list(_breakers.items())}
+
+
+def backoff(attempt: int, delay: float, max_delay: float) -> float:
+    """Пауза перед повтором attempt (с 1): случайная от 0 до min(max_delay, delay * 2^(attempt-1))"""
+    return random.uniform(0, min(max_delay, delay * 2 ** (attempt - 1)))
+
+
+def _failed(error: Exception, predicate: Optional[Callable[[Exception], bool]]) -> bool:
+    return predicate is None or predicate(error)
+
+
+def _is_open(breaker: Optional[CircuitBreaker]) -> bool:
+    """Автомат разомкнулся на этой ошибке - повтор все равно будет отклонен"""
+    return breaker is not None and breaker.state == OPEN
+
+
+def call(
+    operation: str,
+    func: Callable[[], T],
+    *,
+    breaker: Optional[CircuitBreaker] = None,
+    tries: int = 1,
+    delay: float = 0.1,
+    max_delay: float = 2.0,
+    retry_on: Optional[Callable[[Exception], bool]] = None,
+) -> T:
+    """Синхронный вызов с автоматом и повторами; для кода, который уже выполняется в потоке"""
+    for attempt in range(1, tries + 1):
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = func()
+        except Exception as e:
+            if breaker is not None:
+                breaker.record_failure(e)
+            if attempt == tries or not _failed(e, retry_on) or _is_open(breaker):
+                raise
+            pause = backoff(attempt, delay, max_delay)
+            RETRIES.labels(operation).inc()
+            logger.warning("%s failed (%s), retrying in %.2f seconds", operation, e, pause)
+            time.sleep(pause)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+    raise AssertionError("unreachable")
+
+
+async def acall(
+    operation: str,
+    func: Callable[[], Awaitable[T]],
+    *,
+    breaker: Optional[CircuitBreaker] = None,
+    timeout: Optional[float] = None,
+    tries: int = 1,
+    delay: float = 0.2,
+    max_delay: float = 5.0,
+    retry_on: Optional[Callable[[Exception], bool]] = None,
+    is_failure: Optional[Callable[[Exception], bool]] = None,
+) -> T:
+    """Асинхронный вызов: таймаут на попытку, автомат, повторы с джиттером.
+
+    is_failure - какие ошибки считаются отказом зависимости (по умолчанию все),
+    retry_on - какие из них повторять. Таймаут - отказ, но не повторяется:
+    повтор удвоил бы ожидание.
+    """
+    for attempt in range(1, tries + 1):
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = await asyncio.wait_for(func(), timeout) if timeout else await func()
+        except asyncio.TimeoutError as e:
+            error = TimeoutError(f"{operation} timed out after {timeout} s")
+            if breaker is not None:
+                breaker.record_failure(error)
+            raise error from e
+        except Exception as e:
+            failure = _failed(e, is_failure)
+            if breaker is not None and failure:
+                breaker.record_failure(e)
+            elif breaker is not None:
+                breaker.release()
+            if attempt == tries or not (failure and _failed(e, retry_on)) or _is_open(breaker):
+                raise
+            pause = backoff(attempt, delay, max_delay)
+            RETRIES.labels(operation).inc()
+            logger.warning("%s failed (%s), retrying in %.2f seconds", operation, e, pause)
+            await asyncio.sleep(pause)
+            continue
+        except BaseException:
+            if breaker is not None:
+                breaker.release()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        return result
+    raise AssertionError("unreachable")
+
+
+async def astream(
+    operation: str,
+    factory: Callable[[], AsyncIterator[T]],
+    *,
+    breaker: Optional[CircuitBreaker] = None,
+    tries: int = 1,
+    delay: float = 0.2,
+    max_delay: float = 5.0,
+    retry_on: Optional[Callable[[Exception], bool]] = None,
+    is_failure: Optional[Callable[[Exception], bool]] = None,
+) -> AsyncIterator[T]:
+    """Поток с автоматом и повторами до первого элемента; после него ошибка передается как есть"""
+    for attempt in range(1, tries + 1):
+        if breaker is not None:
+            breaker.before_call()
+        started = False
+        stream = factory()
+        try:
+            async for item in stream:
+                if not started:
+                    started = True
+                    if breaker is not None:
+                        breaker.record_success()
+                yield item
+            if not started and breaker is not None:
+                breaker.record_success()
+            return
+        except Exception as e:
+            if started:
+                raise
+            failure = _failed(e, is_failure)
+            if breaker is not None and failure:
+                breaker.record_failure(e)
+            elif breaker is not None:
+                breaker.release()
+            if attempt == tries or not (failure and _failed(e, retry_on)) or _is_open(breaker):
+                raise
+            pause = backoff(attempt, delay, max_delay)
+            RETRIES.labels(operation).inc()
+            logger.warning("%s failed (%s), retrying in %.2f seconds", operation, e, pause)
+            await asyncio.sleep(pause)
+        except BaseException:
+            if not started and breaker is not None:
+                breaker.release()
+            raise
+        finally:
+            await stream.aclose()
@@ -0,0 +1,89 @@
+import asyncio
+import functools
+import logging
+import random
+import time
+from collections.abc import Callable
+from typing import Any
+
+from . import metrics
+
+retry_logger = logging.getLogger(__name__)
+
+RETRIES = metrics.counter("rag_retries_total", "Repeated attempts after a failure", ["operation"])
+
+
+def _next_delay(
+    delay: float,
+    max_delay: float | None,
+    backoff: float,
+    jitter: float | tuple[float, float],
+) -> float:
+    delay *= backoff
+    delay += random.uniform(*jitter) if isinstance(jitter, tuple) else jitter
+    if max_delay is not None:
+        delay = min(delay, max_delay)
+    return delay
+
+
+def retry(
+    exceptions: Any = Exception,
+    *,
+    is_async: bool = False,
+    tries: int = -1,
+    delay: float = 0,
+    max_delay: float | None = None,
+    backoff: float = 1,
+    jitter: float | tuple[float, float] = 0,
+    logger: logging.Logger = retry_logger,
+) -> Callable[..., Any]:
+    """Retry decorator for sync and async functions.
+
+    :param exceptions: exception class (or tuple of classes) to retry on.
+    :param is_async: whether the decorated function is a coroutine function.
+    :param tries: maximum number of attempts, -1 means unlimited.
+    :param delay: initial delay between attempts, in seconds.
+    :param max_delay: upper bound for the delay.
+    :param backoff: multiplier applied to the delay after each attempt.
+    :param jitter: extra seconds added to the delay, fixed or (min, max) range.
+    :param logger: logger used to report failed attempts.
+    """
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        if is_async:
+
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                _tries, _delay = tries, delay
+                while True:
+                    try:
+                        return await func(*args, **kwargs)
+                    except exceptions as e:
+                        _tries -= 1
+                        if _tries == 0:
+                            raise
+                        RETRIES.labels(func.__qualname__).inc()
+                        logger.warning("%s, retrying in %.1f seconds...", e, _delay)
+                        await asyncio.sleep(_delay)
+                        _delay = _next_delay(_delay, max_delay, backoff, jitter)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            _tries, _delay = tries, delay
+            while True:
+                try:
+                    return func(*args, **kwargs)
+                except exceptions as e:
+                    _tries -= 1
+                    if _tries == 0:
+                        raise
+                    RETRIES.labels(func.__qualname__).inc()
+                    logger.warning("%s, retrying in %.1f seconds...", e, _delay)
+                    time.sleep(_delay)
+                    _delay = _next_delay(_delay, max_delay, backoff, jitter)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import suppress
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+# Токены копятся и уходят одним SSE событием раз в интервал или по набору
+# лимита. 0 в любом из параметров - каждый токен отдельным событием.
+SSE_FLUSH_INTERVAL_MS = float(os.getenv("SSE_FLUSH_INTERVAL_MS", "50"))
+SSE_FLUSH_MAX_TOKENS = int(os.getenv("SSE_FLUSH_MAX_TOKENS", "16"))
+# Как часто между отправками проверять, что клиент еще подключен
+SSE_DISCONNECT_CHECK_MS = float(os.getenv("SSE_DISCONNECT_CHECK_MS", "500"))
+# Сколько прочитанных, но не отправленных чанков держать на поток. Если клиент
+# читает медленно, чтение модели останавливается, а не копится в памяти
+SSE_MAX_PENDING_CHUNKS = int(os.getenv("SSE_MAX_PENDING_CHUNKS", "256"))
+
+if orjson is not None:
+    dumps = orjson.dumps
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj: Any) -> bytes:
+        return _encoder.encode(obj).encode("utf-8")
+
+
+# Неизменные части события с фрагментом ответа кодируются один раз
+_DATA = b"data: "
+_END = b"\n\n"
+_CONTENT_HEAD = b'data: {"type":"content","content":'
+_CONTENT_TAIL = b',"done":false}\n\n'
+
+
+def sse_frame(chunk: dict[str, Any]) -> bytes:
+    return _DATA + dumps(chunk) + _END
+
+
+def content_frame(text: str) -> bytes:
+    return _CONTENT_HEAD + dumps(text) + _CONTENT_TAIL
+
+
+def _is_token(chunk: dict[str, Any]) -> bool:
+    return chunk.get("type") == "content" and not chunk.get("done")
+
+
+# Метки в очереди SSECoalescer.stream рядом с чанками
+_EOF = object()
+_FLUSH = object()
+_CANCELLED = object()
+
+
+def _cancel_timer(timer: asyncio.TimerHandle | None) -> None:
+    if timer is not None:
+        timer.cancel()
+
+
+class SSECoalescer:
+    """Склейка токенов модели в редкие SSE события.
+
+    Первый токен уходит сразу, чтобы не увеличивать время до первого слова,
+    дальше токены копятся до flush_interval_ms или max_tokens. Служебные
+    чанки (sources, error, финальный) отправляются сразу, предварительно
+    сбросив накопленное, поэтому порядок событий не меняется.
+    """
+
+    def __init__(
+        self,
+        flush_interval_ms: float = SSE_FLUSH_INTERVAL_MS,
+        max_tokens: int = SSE_FLUSH_MAX_TOKENS,
+        disconnect_check_ms: float = SSE_DISCONNECT_CHECK_MS,
+        max_pending: int = SSE_MAX_PENDING_CHUNKS,
+    ) -> None:
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_tokens = max_tokens
+        self.disconnect_check_interval = disconnect_check_ms / 1000
+        self.max_pending = max(1, max_pending)
+        self.enabled = flush_interval_ms > 0 and max_tokens > 1
+        self.streams = 0
+        self.tokens = 0
+        self.frames = 0
+        self.bytes = 0
+
+    def frame(self, chunk: dict[str, Any]) -> bytes:
+        data = sse_frame(chunk)
+        self.frames += 1
+        self.bytes += len(data)
+        return data
+
+    def _flush(self, parts: list[str]) -> bytes:
+        data = content_frame("".join(parts))
+        parts.clear()
+        self.frames += 1
+        self.bytes += len(data)
+        return data
+
+    async def stream(
+        self,
+        chunks: AsyncIterator[dict[str, Any]],
+        is_disconnected: Callable[[], Awaitable[bool]] | None = None,
+        cancelled: asyncio.Event | None = None,
+    ) -> AsyncIterator[bytes]:
+        """SSE события для чанков RAG сервиса.
+
+        Поток завершается, если is_disconnected сообщает об отключении
+        клиента или выставлено событие cancelled - даже посреди ожидания
+        токена; накопленные токены при отмене еще отправляются. Вызывающий
+        код закрывает chunks и освобождает модель.
+
+        Чанки читает одна задача на весь поток и кладет в очередь; туда же
+        таймер сброса буфера и ожидание отмены кладут свои метки. На токен
+        приходится put/get очереди, без новых задач и asyncio.wait. Чанков в
+        очереди не больше max_pending: дальше чтение ждет отправки, а метки
+        кладутся всегда, поэтому таймер и отмена не блокируются.
+        """
+        self.streams += 1
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        room = asyncio.Semaphore(self.max_pending)
+        parts: list[str] = []
+        first_token_sent = False
+        flush_timer: asyncio.TimerHandle | None = None
+        next_check = time.monotonic() + self.disconnect_check_interval
+
+        async def read() -> None:
+            try:
+                async for chunk in chunks:
+                    await room.acquire()
+                    queue.put_nowait(chunk)
+            except Exception as e:
+                queue.put_nowait(e)
+            else:
+                queue.put_nowait(_EOF)
+
+        async def wait_cancelled() -> None:
+            await cancelled.wait()
+            queue.put_nowait(_CANCELLED)
+
+        reader = asyncio.ensure_future(read())
+        cancel_waiter = asyncio.ensure_future(wait_cancelled()) if cancelled else None
+        try:
+            while True:
+                item = await queue.get()
+                if item is _EOF or item is _CANCELLED:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if isinstance(item, dict):
+                    room.release()
+
+                if item is _FLUSH:
+                    # Модель задумалась - отдаем накопленное по таймеру
+                    flush_timer = _cancel_timer(flush_timer)
+                    if parts:
+                        yield self._flush(parts)
+                elif _is_token(item):
+                    self.tokens += 1
+                    parts.append(item["content"])
+                    if first_token_sent and self.enabled and len(parts) < self.max_tokens:
+                        if flush_timer is None:
+                            flush_timer = loop.call_later(self.flush_interval, queue.put_nowait, _FLUSH)
+                        continue
+                    first_token_sent = True
+                    flush_timer = _cancel_timer(flush_timer)
+                    yield self._flush(parts)
+                else:
+                    flush_timer = _cancel_timer(flush_timer)
+                    if parts:
+                        yield self._flush(parts)
+                    yield self.frame(item)
+
+                if is_disconnected is not None and time.monotonic() >= next_check:
+                    next_check = time.monotonic() + self.disconnect_check_interval
+                    if await is_disconnected():
+                        logger.info("SSE client disconnected, stopping stream")
+                        return
+            if parts:
+                yield self._flush(parts)
+        finally:
+            _cancel_timer(flush_timer)
+            if cancel_waiter is not None:
+                cancel_waiter.cancel()
+            # Генератор нельзя закрыть, пока в нем висит __anext__
+            reader.cancel()
+            with suppress(BaseException):
+                await reader
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "coalescing": self.enabled,
+            "flush_interval_ms": self.flush_interval * 1000,
+            "max_tokens": self.max_tokens,
+            "max_pending": self.max_pending,
+            "encoder": "orjson" if orjson is not None else "json",
+            "streams": self.streams,
+            "tokens": self.tokens,
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "tokens_per_frame": round(self.tokens / self.frames, 2) if self.frames else 0.0,
+        }
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Тесты импортируют rag_system так же, как app.py - из папки backend
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,63 @@
+"""Склейка запросов эмбеддингов в батчи: метрики и отказ модели"""
+import threading
+
+import pytest
+
+pytest.importorskip("llama_index.core")
+
+from rag_system.components.embedding.batching import EmbeddingDispatcher  # noqa: E402
+from rag_system.utils import metrics  # noqa: E402
+
+
+class Interrupted(BaseException):
+    """Как KeyboardInterrupt: не Exception"""
+
+
+def fake_embed(texts):
+    return [[float(len(text))] for text in texts]
+
+
+def test_batches_are_exported_to_metrics():
+    dispatcher = EmbeddingDispatcher(fake_embed, max_wait_ms=50)
+    try:
+        assert dispatcher.embed_many(["а", "бб", "а"]) == [[1.0], [2.0], [1.0]]
+    finally:
+        dispatcher.close()
+    assert dispatcher.stats()["deduplicated"] == 1
+    collected = metrics.collect()
+    for name in ("embedding_batch_size", "embedding_queue_wait_seconds", "embedding_forward_seconds"):
+        assert name in collected
+    assert "embedding_batch_size_bucket" in metrics.render()
+
+
+# Исключение поднимается дальше и завершает поток диспетчера - это и проверяем
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_base_exception_fails_waiters_instead_of_hanging():
+    calls = []
+    model_entered = threading.Event()
+    release_model = threading.Event()
+
+    def embed(texts):
+        calls.append(texts)
+        if len(calls) == 1:
+            model_entered.set()
+            release_model.wait(5)
+            raise Interrupted()
+        return fake_embed(texts)
+
+    dispatcher = EmbeddingDispatcher(embed, max_batch_size=1, max_wait_ms=0)
+    try:
+        first = dispatcher.submit("а")
+        assert model_entered.wait(5)
+        # Ждет в очереди, пока модель занята первым батчем
+        queued = dispatcher.submit("бб")
+        release_model.set()
+        with pytest.raises(Interrupted):
+            first.result(timeout=5)
+        with pytest.raises(Interrupted):
+            queued.result(timeout=5)
+        assert dispatcher.stats()["errors"] == 1
+        # Поток перезапускается на следующем запросе
+        assert dispatcher.submit("ввв").result(timeout=5) == [3.0]
+    finally:
+        dispatcher.close()
@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+pytest.importorskip("llama_index.core")
+
+from rag_system.chat_sessions import ChatSession  # noqa: E402
+from rag_system.components.llm.ollama_client import OllamaClient  # noqa: E402
+
+MODEL = "qwen2.5:0.5b"
+SYSTEM = "Ты корпоративный ассистент"
+
+
+class FakeGenerate:
+    """/api/generate как у Ollama: context возвращается только без raw"""
+
+    def __init__(self):
+        self.payloads = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        self.payloads.append(payload)
+        final = {"response": "", "done": True}
+        if not payload.get("raw"):
+            final["context"] = list(payload.get("context") or []) + [len(self.payloads)] * 10
+        lines = [{"response": f"ответ {len(self.payloads)}", "done": False}, final]
+        return httpx.Response(200, content="".join(json.dumps(line) + "\n" for line in lines).encode())
+
+
+def _turn(client: OllamaClient, session: ChatSession, question: str) -> None:
+    async def run():
+        generation = session.build_prompt(question, MODEL)
+        answer, context = [], None
+        async for chunk in client.stream("/api/generate", {"model": MODEL, **generation}):
+            answer.append(chunk["response"])
+            if chunk.get("done"):
+                context = chunk.get("context")
+        session.add_answer("".join(answer), MODEL, context)
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def ollama():
+    return FakeGenerate()
+
+
+@pytest.fixture
+def client(ollama):
+    client = OllamaClient(base_url="http://ollama:11434", transport=httpx.MockTransport(ollama))
+    yield client
+    asyncio.run(client.aclose())
+
+
+def test_second_turn_sends_context_instead_of_history(client, ollama):
+    session = ChatSession("s", SYSTEM, prompt_style="chatml")
+    _turn(client, session, "Как оформить отпуск?")
+    _turn(client, session, "А командировку?")
+
+    first, second = ollama.payloads
+    assert "raw" not in first and "context" not in first
+    assert SYSTEM in first["prompt"]
+    assert second["context"] == [1] * 10
+    # Только новый фрагмент: системный промпт и прошлый вопрос уже в context
+    assert SYSTEM not in second["prompt"] and "отпуск" not in second["prompt"]
+    assert second["prompt"].startswith("<|im_end|>\n<|im_start|>user\nА командировку?")
+    assert session.ollama_context.tolist() == [1] * 10 + [2] * 10
+
+
+def test_history_is_trimmed_to_token_budget(client, ollama):
+    session = ChatSession("s", SYSTEM, prompt_style="chatml", token_budget=60)
+    for i in range(4):
+        _turn(client, session, f"вопрос {i} " + "слово " * 20)
+    # context растет на 10 токенов за ответ, вопрос - около 50: держится одна пара
+    assert session.trimmed_turns >= 2
+    assert session.messages[0].content == SYSTEM
+    assert [m.role.value for m in session.messages] == ["system", "user", "assistant"]
+    assert "context" not in ollama.payloads[-1]
+
+
+def test_failed_turn_is_discarded(client, ollama):
+    session = ChatSession("s", SYSTEM, prompt_style="chatml")
+    _turn(client, session, "Как оформить отпуск?")
+    session.build_prompt("Вопрос без ответа", MODEL)
+    session.discard_question()
+    _turn(client, session, "А командировку?")
+    assert "Вопрос без ответа" not in ollama.payloads[-1]["prompt"]
+    assert ollama.payloads[-1]["context"] == [1] * 10
@@ -0,0 +1,65 @@
+from rag_system.document_index import DOC_ID_KEY, DocumentIndex, legacy_doc_id
+
+
+def _fill(index: DocumentIndex, count: int) -> None:
+    for i in range(count):
+        index.put(f"doc{i}", f"file{i % 2}.txt", [f"doc{i}-c{j}" for j in range(i + 1)], size=10 * (i + 1))
+
+
+def test_cursor_pages_cover_all_documents_in_upload_order(tmp_path):
+    index = DocumentIndex(tmp_path / "documents.sqlite3")
+    _fill(index, 5)
+    seen, cursor = [], None
+    while True:
+        page, cursor = index.list(limit=2, cursor=cursor)
+        assert len(page) <= 2
+        seen.extend(document["document_id"] for document in page)
+        if cursor is None:
+            break
+    assert seen == [f"doc{i}" for i in range(5)]
+
+
+def test_replacement_keeps_position_and_updates_counters(tmp_path):
+    index = DocumentIndex(tmp_path / "documents.sqlite3")
+    _fill(index, 3)
+    index.put("doc0", "file0.txt", ["new-c0", "new-c1", "new-c2", "new-c3"], size=100)
+    page, _ = index.list(limit=10)
+    assert [document["document_id"] for document in page] == ["doc0", "doc1", "doc2"]
+    assert index.chunk_ids("doc0") == ["new-c0", "new-c1", "new-c2", "new-c3"]
+    # doc0: 4 фрагмента вместо 1, размер 100 вместо 10
+    assert index.stats()["documents"] == 3
+    assert index.stats()["chunks"] == 4 + 2 + 3
+    assert index.stats()["bytes"] == 100 + 20 + 30
+    assert index.stats()["top_files_by_chunks"] == {"file0.txt": 7, "file1.txt": 2}
+
+
+def test_remove_updates_counters_and_counters_survive_reopen(tmp_path):
+    path = tmp_path / "documents.sqlite3"
+    index = DocumentIndex(path)
+    _fill(index, 4)
+    assert index.remove("doc1")
+    assert not index.remove("doc1")
+    assert index.chunk_ids("doc1") == []
+    expected = index.stats()
+    assert expected["documents"] == 3 and expected["chunks"] == 1 + 3 + 4
+    assert expected["top_files_by_chunks"] == {"file0.txt": 4, "file1.txt": 4}
+    index.close()
+
+    reopened = DocumentIndex(path)
+    assert not reopened.created
+    assert reopened.stats() == expected
+
+
+def test_rebuild_groups_legacy_chunks_by_file(tmp_path):
+    index = DocumentIndex(tmp_path / "documents.sqlite3")
+    _fill(index, 2)
+    pages = [
+        (["a1", "a2"], [{DOC_ID_KEY: "a", "file_name": "a.txt"}] * 2, ["текст", "x"]),
+        (["old1", "old2"], [{"file_name": "old.txt"}, {"file_name": "old.txt"}], ["y", "z"]),
+    ]
+    assert index.rebuild(pages) == 2
+    assert index.get("doc0") is None
+    assert sorted(index.chunk_ids("a")) == ["a1", "a2"]
+    legacy = index.get(legacy_doc_id("old.txt"))
+    assert legacy["chunk_count"] == 2 and legacy["bytes"] == 2
+    assert index.stats()["bytes"] == len("текст".encode("utf-8")) + 1 + 2
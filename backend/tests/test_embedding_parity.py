@@ -0,0 +1,45 @@
+"""ONNX бэкенд эмбеддингов должен давать те же векторы, что и PyTorch.
+
+Иначе индекс, построенный одним бэкендом, расходится с вопросами,
+закодированными другим. Нужны onnxruntime, optimum (экспорт) и
+llama-index-embeddings-huggingface; без них тест пропускается.
+"""
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("optimum.onnxruntime")
+pytest.importorskip("llama_index.embeddings.huggingface")
+
+import numpy as np  # noqa: E402
+from rag_system.components.embedding.embedding_component import EMBEDDING_MODEL, create_embed_model  # noqa: E402
+
+TEXTS = [
+    "Как оформить отпуск?",
+    "Сколько дней дается на согласование командировки?",
+    # Длиннее max_seq_length модели: проверяет, что обрезка у бэкендов одинаковая
+    "Сотрудник обязан согласовать командировку с непосредственным руководителем "
+    "не позднее чем за пять рабочих дней до выезда и оформить служебное задание. " * 8,
+]
+
+
+def _embed(backend: str, cache_dir: str, quantize: bool = False) -> np.ndarray:
+    model = create_embed_model(backend=backend, model_name=EMBEDDING_MODEL, quantize=quantize, cache_dir=cache_dir)
+    vectors = np.asarray(model.get_text_embedding_batch(TEXTS), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def cache_dir(tmp_path_factory) -> str:
+    # Экспорт ONNX во временную папку, а не в ./models/onnx
+    return str(tmp_path_factory.mktemp("onnx"))
+
+
+@pytest.fixture(scope="module")
+def torch_vectors(cache_dir) -> np.ndarray:
+    return _embed("torch", cache_dir)
+
+
+@pytest.mark.parametrize("quantize, min_cosine", [(False, 0.999), (True, 0.98)])
+def test_onnx_matches_torch(torch_vectors, cache_dir, quantize, min_cosine):
+    cosine = (torch_vectors * _embed("onnx", cache_dir, quantize)).sum(axis=1)
+    assert cosine.min() >= min_cosine, cosine.tolist()
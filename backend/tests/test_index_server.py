@@ -0,0 +1,60 @@
+"""Протокол процесса индекса на паре соединений Pipe, без сокета и Chroma"""
+import threading
+from multiprocessing import Pipe
+
+import pytest
+
+from rag_system.index_server import IndexReplyError, IndexServer, IndexServerError, RemoteIngestComponent
+
+
+class Component:
+    def __init__(self):
+        self.deleted = []
+
+    def delete_document(self, doc_id):
+        self.deleted.append(doc_id)
+        # Ответ, который нельзя передать воркеру
+        return lambda: doc_id
+
+    def get_document(self, doc_id):
+        raise KeyError(doc_id)
+
+    def list_documents(self, limit, cursor):
+        class Unpicklable(Exception):
+            pass
+
+        raise Unpicklable("local class")
+
+
+@pytest.fixture
+def remote():
+    component = Component()
+    server_end, client_end = Pipe()
+    server = IndexServer(component, address="unused", authkey=b"test")
+    thread = threading.Thread(target=server._handle, args=(server_end,), daemon=True)
+    thread.start()
+    client = RemoteIngestComponent.__new__(RemoteIngestComponent)
+    client.address = "pipe"
+    client.connection_errors = 0
+    client._idle = [client_end]
+    client._lock = threading.Lock()
+    yield client, component
+    client_end.close()
+    thread.join(1)
+
+
+def test_unsendable_result_is_reported_as_reply_error(remote):
+    client, component = remote
+    with pytest.raises(IndexReplyError, match="succeeded"):
+        client.delete_document("a")
+    assert component.deleted == ["a"]
+    # Соединение осталось рабочим
+    with pytest.raises(KeyError):
+        client.get_document("a")
+
+
+def test_unsendable_exception_is_sent_as_text(remote):
+    client, _ = remote
+    with pytest.raises(IndexServerError, match="Unpicklable: local class") as failed:
+        client.list_documents(10, None)
+    assert not isinstance(failed.value, IndexReplyError)
@@ -0,0 +1,150 @@
+"""Восстановление базы знаний по журналу после падения до сохранения индекса (GroupCommit)"""
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("llama_index.vector_stores.chroma")
+
+from llama_index.core.embeddings import MockEmbedding  # noqa: E402
+
+from rag_system import ingest_helper  # noqa: E402
+from rag_system.ingest_component import IngestComponent  # noqa: E402
+
+
+class Crash(BaseException):
+    """Падение процесса: в отличие от Exception, ingest_file его не перехватывает"""
+
+
+@pytest.fixture
+def open_component(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_helper, "create_embed_model", lambda: MockEmbedding(embed_dim=8))
+    opened = []
+
+    def open_component():
+        component = IngestComponent(persist_dir=str(tmp_path / "db"))
+        # Фоновое сохранение не должно успеть до "падения"
+        component.group_commit.interval = 3600
+        opened.append(component)
+        return component
+
+    yield open_component
+    for component in opened:
+        component.group_commit._stop.set()
+        component.embed_model.dispatcher.close()
+
+
+def crash(component: IngestComponent) -> None:
+    """Остановить компонент как при падении: без close() и без сохранения индекса"""
+    assert component.group_commit.flushes == 0
+    assert component.journal.read()
+    component.group_commit._stop.set()
+    component.embed_model.dispatcher.close()
+    component.documents.close()
+
+
+def write_file(tmp_path, name: str, sections: int = 1, topic: str = "командировку") -> str:
+    path = tmp_path / name
+    path.write_text(
+        "\n\n".join(f"Раздел {i}. " + f"Сотрудник согласует {topic} с руководителем заранее. " * 40
+                    for i in range(sections)),
+        encoding="utf-8",
+    )
+    return str(path)
+
+
+def stored_ids(component: IngestComponent, chunk_ids) -> list:
+    return component.vector_store._collection.get(ids=list(chunk_ids))["ids"]
+
+
+def test_upload_interrupted_before_document_index_is_recovered(tmp_path, open_component):
+    component = open_component()
+    component._replace_chunks = lambda *args: (_ for _ in ()).throw(Crash())
+    with pytest.raises(Crash):
+        component.ingest_file(write_file(tmp_path, "a.txt", sections=3), doc_id="a")
+    assert component.documents.get("a") is None
+    chunk_ids = component.journal.read()[0]["chunks"]
+    crash(component)
+
+    recovered = open_component()
+    document = recovered.documents.get("a")
+    assert document["chunk_count"] == len(chunk_ids)
+    assert sorted(recovered.documents.chunk_ids("a")) == sorted(chunk_ids)
+    assert recovered.journal.read() == []
+
+
+def test_partial_insert_is_rolled_back(tmp_path, open_component):
+    component = open_component()
+    insert_nodes = component.index.insert_nodes
+
+    def partial_insert(nodes):
+        insert_nodes(nodes[:1])
+        raise Crash()
+
+    component.index.insert_nodes = partial_insert
+    with pytest.raises(Crash):
+        component.ingest_file(write_file(tmp_path, "a.txt", sections=6), doc_id="a")
+    chunk_ids = component.journal.read()[0]["chunks"]
+    assert len(chunk_ids) > 1 and len(stored_ids(component, chunk_ids)) == 1
+    crash(component)
+
+    recovered = open_component()
+    assert recovered.documents.get("a") is None
+    assert stored_ids(recovered, chunk_ids) == []
+
+
+def test_deleted_document_stays_deleted(tmp_path, open_component):
+    component = open_component()
+    assert component.ingest_file(write_file(tmp_path, "a.txt"), doc_id="a")
+    assert component.ingest_file(write_file(tmp_path, "b.txt", topic="отпуск"), doc_id="b")
+    deleted_chunks = component.documents.chunk_ids("a")
+    assert component.delete_document("a")
+    crash(component)
+
+    recovered = open_component()
+    assert recovered.documents.get("a") is None
+    assert stored_ids(recovered, deleted_chunks) == []
+    assert recovered.documents.get("b") is not None
+    assert recovered.documents.stats()["documents"] == 1
+
+
+def test_reupload_after_delete_survives(tmp_path, open_component):
+    component = open_component()
+    path = write_file(tmp_path, "a.txt")
+    assert component.ingest_file(path, doc_id="a")
+    assert component.delete_document("a")
+    assert component.ingest_file(path, doc_id="a")
+    chunk_ids = component.documents.chunk_ids("a")
+    crash(component)
+
+    recovered = open_component()
+    assert sorted(recovered.documents.chunk_ids("a")) == sorted(chunk_ids)
+    assert len(stored_ids(recovered, chunk_ids)) == len(chunk_ids)
+
+
+def test_replaced_document_keeps_only_new_version(tmp_path, open_component):
+    component = open_component()
+    assert component.ingest_file(write_file(tmp_path, "a.txt"), doc_id="a")
+    old_chunks = component.documents.chunk_ids("a")
+    assert component.ingest_file(write_file(tmp_path, "a.txt", topic="отпуск"), doc_id="a")
+    new_chunks = component.documents.chunk_ids("a")
+    crash(component)
+
+    recovered = open_component()
+    assert sorted(recovered.documents.chunk_ids("a")) == sorted(new_chunks)
+    assert stored_ids(recovered, old_chunks) == []
+    assert recovered.documents.stats()["documents"] == 1
+
+
+def test_delete_interrupted_after_tombstone_is_completed(tmp_path, open_component):
+    component = open_component()
+    assert component.ingest_file(write_file(tmp_path, "a.txt"), doc_id="a")
+    chunk_ids = component.documents.chunk_ids("a")
+    # Надгробие записано, но фрагменты еще в Chroma: без него загрузка из журнала вернула бы документ
+    component._delete_chunks = lambda ids: (_ for _ in ()).throw(Crash())
+    with pytest.raises(Crash):
+        component.delete_document("a")
+    assert len(stored_ids(component, chunk_ids)) == len(chunk_ids)
+    crash(component)
+
+    recovered = open_component()
+    assert recovered.documents.get("a") is None
+    assert stored_ids(recovered, chunk_ids) == []
@@ -0,0 +1,30 @@
+"""Роутер намерений без модели эмбеддингов: только regex по словоформам RAG_TERMS"""
+import asyncio
+
+import pytest
+
+from rag_system.intent_router import INTENT_GENERAL, INTENT_RAG, IntentRouter, evaluate, load_eval_set
+
+# Сейчас 0.88; запас на пару спорных формулировок при правке словаря
+KEYWORD_ACCURACY_FLOOR = 0.85
+
+
+def test_keyword_path_accuracy_on_eval_set():
+    report = evaluate(IntentRouter(), load_eval_set())
+    assert not report["embeddings"]
+    assert report["samples"] >= 50
+    assert report["accuracy"] >= KEYWORD_ACCURACY_FLOOR, report["errors"]
+    assert report["accuracy"] > report["legacy_accuracy"]
+
+
+@pytest.mark.parametrize("question", ["Как оформить командировку?", "Где найти шаблон заявления на отпуск"])
+def test_word_forms_route_to_rag(question):
+    decision = asyncio.run(IntentRouter().route(question))
+    assert decision.intent == INTENT_RAG and decision.source == "keyword"
+
+
+def test_question_without_terms_falls_back_to_general():
+    router = IntentRouter()
+    decision = asyncio.run(router.route("Напиши стихотворение про осень"))
+    assert decision.intent == INTENT_GENERAL and decision.source == "default"
+    assert router.stats()["decisions"]["default"] == 1
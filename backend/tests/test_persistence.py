@@ -0,0 +1,55 @@
+import threading
+
+from rag_system.persistence import GroupCommit, IngestJournal
+
+
+def test_journal_drops_torn_tail(tmp_path):
+    path = tmp_path / "ingest_journal.jsonl"
+    journal = IngestJournal(path)
+    journal.append({"doc_id": "a", "file": "a.txt", "chunks": ["c1"]})
+    # Падение посреди записи второй строки
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"doc_id": "b", "fi')
+
+    reopened = IngestJournal(path)
+    assert reopened.entries == 1
+    reopened.append({"doc_id": "a", "deleted": ["c1"]})
+    assert IngestJournal(path).read() == [
+        {"doc_id": "a", "file": "a.txt", "chunks": ["c1"]},
+        {"doc_id": "a", "deleted": ["c1"]},
+    ]
+
+
+def test_journal_reset(tmp_path):
+    journal = IngestJournal(tmp_path / "ingest_journal.jsonl")
+    journal.append({"doc_id": "a", "file": "a.txt", "chunks": ["c1"]})
+    journal.reset()
+    assert journal.entries == 0 and journal.read() == []
+
+
+def test_group_commit_persists_by_chunk_count_and_on_close():
+    persisted = []
+    lock = threading.Lock()
+    commit = GroupCommit(lambda: persisted.append(commit.pending_chunks), lock, max_chunks=10, interval=3600)
+    with lock:
+        commit.record(4)
+        commit.record(4)
+    assert persisted == []
+    with lock:
+        commit.record(4)
+    assert persisted == [12]
+    with lock:
+        commit.record(1)
+    commit.close()
+    assert persisted == [12, 1]
+    assert commit.flushes == 2 and commit.stats()["pending_chunks"] == 0
+
+
+def test_group_commit_flushes_after_interval():
+    flushed = threading.Event()
+    lock = threading.Lock()
+    commit = GroupCommit(flushed.set, lock, max_chunks=1000, interval=0.05)
+    with lock:
+        commit.record(1)
+    assert flushed.wait(3)
+    commit.close()
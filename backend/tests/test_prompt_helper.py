@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip("llama_index.core")
+
+from llama_index.core.llms import ChatMessage, MessageRole  # noqa: E402
+
+from rag_system.components.llm.prompt_helper import (  # noqa: E402
+    ChatMLPromptStyle,
+    IncrementalChatMLPromptStyle,
+    IncrementalPromptRenderer,
+    get_prompt_style,
+)
+
+DIALOG = [
+    ChatMessage(role=MessageRole.SYSTEM, content="Система"),
+    ChatMessage(role=MessageRole.USER, content="Вопрос 1"),
+    ChatMessage(role=MessageRole.ASSISTANT, content="Ответ 1"),
+    ChatMessage(role=MessageRole.USER, content="Вопрос 2"),
+]
+
+
+def test_chatml_rendering_is_unchanged_for_existing_callers():
+    style = get_prompt_style("chatml")
+    assert type(style) is ChatMLPromptStyle
+    assert style.messages_to_prompt(DIALOG) == (
+        "<|im_start|>system\nСистема"
+        "<|im_end|>\n<|im_start|>user\nВопрос 1<|im_end|>\n"
+        "<|im_end|>\n<|im_start|>user\nВопрос 2<|im_end|>\n"
+        "<|im_start|>assistant\n"
+    )
+
+
+@pytest.mark.parametrize("name", ["chatml", "llama3", "tag"])
+def test_incremental_render_matches_full_render(name):
+    style = get_prompt_style(name, incremental=True)
+    assert style.supports_incremental
+    renderer = IncrementalPromptRenderer(style)
+    for end in range(2, len(DIALOG) + 1, 2):
+        assert renderer.render(DIALOG[:end]) == style.messages_to_prompt(DIALOG[:end])
+
+
+def test_continuation_after_answer():
+    renderer = IncrementalPromptRenderer(IncrementalChatMLPromptStyle())
+    first = renderer.render(DIALOG[:2])
+    continuation = renderer.continuation(DIALOG)
+    # Ответ модели обрывается перед <|im_end|>, поэтому продолжение начинается с него
+    assert first + "Ответ 1" + continuation == IncrementalChatMLPromptStyle().messages_to_prompt(DIALOG)
@@ -0,0 +1,156 @@
+"""Балансировщик Ollama на httpx.MockTransport: инстансы - разные хосты одного обработчика"""
+import asyncio
+import json
+from contextlib import aclosing
+
+import httpx
+import pytest
+
+from rag_system.components.llm.router import OllamaRouter
+from rag_system.utils import resilience
+
+A = "http://gpu1:11434"
+B = "http://gpu2:11434"
+MODEL = "qwen2.5:0.5b"
+
+
+class FakeOllama:
+    """Обработчик запросов: каждый хост отвечает потоком токенов, пока его не "сломали"."""
+
+    def __init__(self):
+        self.down: set = set()
+        self.break_after_first: set = set()
+        self.requests: list = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        host = f"http://{request.url.host}:{request.url.port}"
+        self.requests.append((host, request.url.path))
+        if host in self.down:
+            raise httpx.ConnectError("connection refused", request=request)
+        if request.url.path == "/api/ps":
+            return httpx.Response(200, json={"models": [{"model": MODEL, "name": MODEL}]})
+        if request.url.path == "/api/tags":
+            return httpx.Response(200, json={"models": [{"model": MODEL, "name": MODEL}]})
+        if host in self.break_after_first:
+            return httpx.Response(200, stream=BrokenStream(request))
+        lines = [{"response": "ответ ", "done": False}, {"response": "", "done": True}]
+        body = "".join(json.dumps(line) + "\n" for line in lines)
+        return httpx.Response(200, content=body.encode())
+
+    def hosts(self, path: str) -> list:
+        return [host for host, p in self.requests if p == path]
+
+
+class BrokenStream(httpx.AsyncByteStream):
+    """Первый токен, потом обрыв соединения"""
+
+    def __init__(self, request: httpx.Request):
+        self.request = request
+
+    async def __aiter__(self):
+        yield (json.dumps({"response": "нача", "done": False}) + "\n").encode()
+        raise httpx.RemoteProtocolError("peer closed connection", request=self.request)
+
+
+@pytest.fixture
+def ollama():
+    return FakeOllama()
+
+
+@pytest.fixture
+def router(ollama):
+    router = OllamaRouter(
+        [(A, None), (B, None)],
+        eject_after=2,
+        readmit_after=2,
+        retries=1,
+        transport=httpx.MockTransport(ollama),
+    )
+    # Свой автомат, чтобы отказы одного теста не размыкали общий "ollama"
+    router.breaker = resilience.CircuitBreaker("ollama-test")
+    yield router
+    asyncio.run(router.aclose())
+
+
+def collect(router, payload=None):
+    async def run():
+        async with aclosing(router.stream("/api/generate", payload or {"model": MODEL, "prompt": "q"})) as chunks:
+            return [chunk async for chunk in chunks]
+
+    return asyncio.run(run())
+
+
+def test_stream_fails_over_before_first_token(router, ollama):
+    ollama.down.add(A)
+    for _ in range(2):
+        chunks = collect(router)
+        assert [c["response"] for c in chunks] == ["ответ ", ""]
+    assert ollama.hosts("/api/generate").count(B) == 2
+    assert router.failovers >= 1
+
+
+def test_stream_does_not_fail_over_after_first_token(router, ollama):
+    ollama.break_after_first.update({A, B})
+    received = []
+
+    async def run():
+        async with aclosing(router.stream("/api/generate", {"model": MODEL, "prompt": "q"})) as chunks:
+            async for chunk in chunks:
+                received.append(chunk)
+
+    with pytest.raises(httpx.RemoteProtocolError):
+        asyncio.run(run())
+    # Повтор на другом инстансе продублировал бы уже отданный токен
+    assert len(received) == 1
+    assert len(ollama.hosts("/api/generate")) == 1
+    assert router.failovers == 0
+
+
+def test_backend_is_ejected_and_readmitted(router, ollama):
+    ollama.down.add(A)
+    for _ in range(4):
+        collect(router)
+    backend_a = router.backends[0]
+    assert not backend_a.healthy
+    assert backend_a.failures == 2
+    served = len(ollama.hosts("/api/generate"))
+    collect(router)
+    assert ollama.hosts("/api/generate")[served:] == [B]
+
+    ollama.down.discard(A)
+    ollama_sdk = pytest.importorskip("ollama")
+    backend_a._probe_client = ollama_sdk.Client(host=A, transport=httpx.MockTransport(ollama))
+
+    async def probe():
+        await router._probe(backend_a)
+
+    asyncio.run(probe())
+    assert not backend_a.healthy
+    asyncio.run(probe())
+    assert backend_a.healthy
+    assert backend_a.ejected_at is None
+
+
+def test_pick_prefers_least_outstanding(router):
+    backend_a, backend_b = router.backends
+    backend_a.outstanding = 3
+    assert {router._pick(MODEL, set()).url for _ in range(4)} == {B}
+    # При равной загрузке - по кругу
+    backend_a.outstanding = backend_b.outstanding
+    assert {router._pick(MODEL, set()).url for _ in range(4)} == {A, B}
+
+
+def test_pick_respects_model_list(ollama):
+    router = OllamaRouter([(A, ["llama3.1:8b"]), (B, None)], transport=httpx.MockTransport(ollama))
+    assert {router._pick(MODEL, set()).url for _ in range(4)} == {B}
+    assert router.backend_count(MODEL) == 1
+    asyncio.run(router.aclose())
+
+
+def test_ps_reports_failed_backend(router, ollama):
+    ollama.down.add(A)
+    running = asyncio.run(router.ps())
+    assert [m["backend"] for m in running["models"]] == [B]
+    assert "ConnectError" in running["backends"][A]["error"]
+    assert running["backends"][B] == {"models": [MODEL]}
+    assert router.backends[0].failures == 1
@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+
+from rag_system.components.llm.scheduler import GenerationScheduler, Priority, SchedulerOverloaded
+
+MODEL = "qwen2.5:0.5b"
+
+
+def _scheduler(**kwargs) -> GenerationScheduler:
+    kwargs.setdefault("max_in_flight", 1)
+    kwargs.setdefault("max_queue", 4)
+    kwargs.setdefault("queue_timeout", 5)
+    return GenerationScheduler(model_limits={}, **kwargs)
+
+
+async def _settle() -> None:
+    """Дать ожидающим задачам дойти до очереди или проснуться"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_waiters_are_served_by_priority():
+    async def run():
+        scheduler = _scheduler()
+        held = await scheduler.acquire(MODEL)
+        order = []
+
+        async def wait(priority):
+            ticket = await scheduler.acquire(MODEL, priority)
+            order.append(priority)
+            scheduler.release(ticket)
+
+        tasks = []
+        for priority in (Priority.BATCH, Priority.NORMAL, Priority.INTERACTIVE, Priority.NORMAL):
+            tasks.append(asyncio.create_task(wait(priority)))
+            await _settle()
+        scheduler.release(held)
+        await asyncio.gather(*tasks)
+        return order, scheduler.stats()["models"][MODEL]
+
+    order, stats = asyncio.run(run())
+    assert order == [Priority.INTERACTIVE, Priority.NORMAL, Priority.NORMAL, Priority.BATCH]
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+
+
+def test_full_queue_is_rejected_with_429():
+    async def run():
+        scheduler = _scheduler(max_queue=1)
+        await scheduler.acquire(MODEL)
+        waiter = asyncio.create_task(scheduler.acquire(MODEL, Priority.NORMAL))
+        await _settle()
+        with pytest.raises(SchedulerOverloaded) as overloaded:
+            await scheduler.acquire(MODEL, Priority.NORMAL)
+        waiter.cancel()
+        return overloaded.value, scheduler.stats()["models"][MODEL]
+
+    error, stats = asyncio.run(run())
+    assert error.status_code == 429
+    assert error.retry_after >= 1
+    assert stats["rejected"] == 1
+
+
+def test_interactive_request_preempts_lower_priority_waiter():
+    async def run():
+        scheduler = _scheduler(max_queue=1)
+        held = await scheduler.acquire(MODEL)
+        batch = asyncio.create_task(scheduler.acquire(MODEL, Priority.BATCH))
+        await _settle()
+        interactive = asyncio.create_task(scheduler.acquire(MODEL, Priority.INTERACTIVE))
+        await asyncio.sleep(0)
+        # Вытесненный запрос еще не проснулся, но его место уже свободно
+        depth = scheduler.stats()["models"][MODEL]["queue_depth"]
+        with pytest.raises(SchedulerOverloaded) as preempted:
+            await batch
+        scheduler.release(held)
+        ticket = await interactive
+        scheduler.release(ticket)
+        return depth, preempted.value, scheduler.stats()["models"][MODEL]
+
+    depth, error, stats = asyncio.run(run())
+    assert depth == 1
+    assert error.status_code == 503 and "preempted" in error.reason
+    assert stats["preempted"] == 1
+    assert stats["queue_depth"] == 0 and stats["in_flight"] == 0
+
+
+def test_same_priority_does_not_preempt():
+    async def run():
+        scheduler = _scheduler(max_queue=1)
+        await scheduler.acquire(MODEL)
+        waiter = asyncio.create_task(scheduler.acquire(MODEL, Priority.INTERACTIVE))
+        await _settle()
+        with pytest.raises(SchedulerOverloaded) as overloaded:
+            await scheduler.acquire(MODEL, Priority.INTERACTIVE)
+        waiter.cancel()
+        return overloaded.value
+
+    assert asyncio.run(run()).status_code == 429
+
+
+def test_queue_timeout_is_503_with_retry_after():
+    async def run():
+        scheduler = _scheduler(queue_timeout=0.05)
+        await scheduler.acquire(MODEL)
+        with pytest.raises(SchedulerOverloaded) as timed_out:
+            await scheduler.acquire(MODEL)
+        return timed_out.value, scheduler.stats()["models"][MODEL]
+
+    error, stats = asyncio.run(run())
+    assert error.status_code == 503 and "timed out" in error.reason
+    assert error.retry_after >= 1
+    assert stats["timed_out"] == 1 and stats["queue_depth"] == 0
+
+
+def test_cancelled_waiter_passes_granted_slot_on():
+    async def run():
+        scheduler = _scheduler()
+        held = await scheduler.acquire(MODEL)
+        first = asyncio.create_task(scheduler.acquire(MODEL))
+        await _settle()
+        second = asyncio.create_task(scheduler.acquire(MODEL))
+        await _settle()
+        # Слот передан first, но клиент ушел раньше, чем задача проснулась
+        scheduler.release(held)
+        first.cancel()
+        (result,) = await asyncio.gather(first, return_exceptions=True)
+        if not isinstance(result, BaseException):
+            # wait_for в 3.11 может проглотить отмену уже выполненного ожидания
+            scheduler.release(result)
+        ticket = await asyncio.wait_for(second, 1)
+        scheduler.release(ticket)
+        return scheduler.stats()["models"][MODEL]
+
+    stats = asyncio.run(run())
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+
+
+def test_release_is_idempotent():
+    async def run():
+        scheduler = _scheduler(max_in_flight=2)
+        ticket = await scheduler.acquire(MODEL)
+        await scheduler.acquire(MODEL)
+        scheduler.release(ticket)
+        scheduler.release(ticket)
+        return scheduler.stats()["models"][MODEL]["in_flight"]
+
+    assert asyncio.run(run()) == 1
+
+
+def test_limits_are_split_between_workers():
+    scheduler = _scheduler(max_in_flight=4, max_queue=8, workers=2, backends_for=lambda model: 2)
+    assert scheduler.max_queue == 4
+    assert scheduler._state(MODEL).max_in_flight == 4
@@ -0,0 +1,119 @@
+import zipfile
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from rag_system.snapshot import SnapshotError, export_snapshot, replace_from_snapshot  # noqa: E402
+
+MODEL = "model"
+
+
+class FakeCollection:
+    """Коллекция Chroma в памяти: только то, что нужно снимкам"""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.records = {}
+
+    def count(self):
+        return len(self.records)
+
+    def add(self, ids, embeddings, documents, metadatas):
+        for record in zip(ids, embeddings, documents, metadatas):
+            self.records[record[0]] = record[1:]
+
+    def get(self, limit, offset, include):
+        ids = sorted(self.records)[offset:offset + limit]
+        return {
+            "ids": ids,
+            "embeddings": [self.records[i][0] for i in ids],
+            "documents": [self.records[i][1] for i in ids],
+            "metadatas": [self.records[i][2] for i in ids],
+        }
+
+    def modify(self, name):
+        self.client.collections[name] = self.client.collections.pop(self.name)
+        self.name = name
+
+
+class FakeClient:
+    max_batch_size = 2
+
+    def __init__(self):
+        self.collections = {}
+
+    def create_collection(self, name):
+        if name in self.collections:
+            raise ValueError(f"Collection {name} already exists")
+        self.collections[name] = FakeCollection(self, name)
+        return self.collections[name]
+
+    def delete_collection(self, name):
+        if name not in self.collections:
+            raise ValueError(f"Collection {name} does not exist")
+        del self.collections[name]
+
+
+def _collection(client, name, count, dimension=2):
+    collection = client.create_collection(name)
+    collection.add(
+        ids=[f"{name}-{i}" for i in range(count)],
+        embeddings=[[float(i)] * dimension for i in range(count)],
+        documents=[f"text {i}" for i in range(count)],
+        metadatas=[{"n": i} for i in range(count)],
+    )
+    return collection
+
+
+@pytest.fixture
+def client():
+    client = FakeClient()
+    _collection(client, "docs", 3)
+    return client
+
+
+def test_failed_export_removes_tmp_file(tmp_path):
+    client = FakeClient()
+    path = tmp_path / "kb.zip"
+    with pytest.raises(SnapshotError):
+        # В коллекции векторы размерности 2, а ожидается 3
+        export_snapshot(_collection(client, "docs", 2), path, MODEL, dimension=3)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_replace_swaps_in_snapshot(client, tmp_path):
+    path = tmp_path / "kb.zip"
+    export_snapshot(_collection(client, "other", 5), path, MODEL, dimension=2)
+    result = replace_from_snapshot(client, "docs", path, MODEL, 2)
+    assert result["imported"] == 5
+    assert sorted(client.collections) == ["docs", "other"]
+    assert sorted(client.collections["docs"].records) == [f"other-{i}" for i in range(5)]
+
+
+def test_replace_with_other_model_keeps_collection(client, tmp_path):
+    path = tmp_path / "kb.zip"
+    export_snapshot(_collection(client, "other", 5), path, "another-model", dimension=2)
+    with pytest.raises(SnapshotError):
+        replace_from_snapshot(client, "docs", path, MODEL, 2)
+    assert sorted(client.collections["docs"].records) == ["docs-0", "docs-1", "docs-2"]
+    assert sorted(client.collections) == ["docs", "other"]
+
+
+def test_replace_with_truncated_snapshot_keeps_collection(client, tmp_path):
+    path = tmp_path / "kb.zip"
+    export_snapshot(_collection(client, "other", 5), path, MODEL, dimension=2)
+    # Тот же снимок, но векторов меньше, чем обещает манифест
+    broken = tmp_path / "broken.zip"
+    with zipfile.ZipFile(path) as src, zipfile.ZipFile(broken, "w") as dst:
+        for item in src.infolist():
+            data = src.read(item)
+            if item.filename == "embeddings.npy":
+                data = data[:-8]
+            dst.writestr(item, data)
+    with pytest.raises(SnapshotError):
+        replace_from_snapshot(client, "docs", broken, MODEL, 2)
+    assert client.collections["docs"].count() == 3
+    # Промежуточная коллекция не остается
+    assert sorted(client.collections) == ["docs", "other"]
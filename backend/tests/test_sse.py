@@ -0,0 +1,113 @@
+"""Склейка токенов в SSE события: границы событий, сброс по таймеру и при завершении"""
+import asyncio
+import json
+
+from rag_system.utils.sse import SSECoalescer
+
+
+def token(text: str) -> dict:
+    return {"type": "content", "content": text, "done": False}
+
+
+def events(frames: list) -> list:
+    return [json.loads(frame.decode()[len("data: "):]) for frame in frames]
+
+
+def contents(frames: list) -> list:
+    return [event.get("content") for event in events(frames)]
+
+
+async def source(items: list, pauses: dict | None = None, block: asyncio.Event | None = None):
+    """Чанки по одному; pauses - задержка перед чанком с этим номером"""
+    for i, item in enumerate(items):
+        if pauses and i in pauses:
+            await asyncio.sleep(pauses[i])
+        yield item
+    if block is not None:
+        await block.wait()
+
+
+def collect(coalescer: SSECoalescer, chunks, cancelled: asyncio.Event | None = None) -> list:
+    async def run():
+        return [frame async for frame in coalescer.stream(chunks, cancelled=cancelled)]
+
+    return asyncio.run(run())
+
+
+def test_first_token_is_sent_alone_and_rest_are_coalesced():
+    coalescer = SSECoalescer(flush_interval_ms=1000, max_tokens=3)
+    frames = collect(coalescer, source([token(str(i)) for i in range(7)]))
+    # Первый токен сразу, дальше по max_tokens, остаток - при завершении потока
+    assert contents(frames) == ["0", "123", "456"]
+    assert coalescer.stats()["tokens"] == 7 and coalescer.stats()["frames"] == 3
+
+
+def test_service_chunk_flushes_pending_tokens_first():
+    coalescer = SSECoalescer(flush_interval_ms=1000, max_tokens=16)
+    sources = {"type": "sources", "sources": ["a.txt"]}
+    final = {"type": "content", "content": "", "done": True}
+    frames = collect(coalescer, source([token("a"), token("b"), token("c"), sources, final]))
+    assert [event["type"] for event in events(frames)] == ["content", "content", "sources", "content"]
+    assert contents(frames)[:2] == ["a", "bc"]
+    assert events(frames)[-1]["done"] is True
+
+
+def test_pending_tokens_are_flushed_by_interval():
+    coalescer = SSECoalescer(flush_interval_ms=20, max_tokens=16)
+    received = []
+
+    async def run():
+        chunks = source([token("a"), token("b"), token("c"), token("d")], pauses={3: 0.2})
+        async for frame in coalescer.stream(chunks):
+            received.append((frame, asyncio.get_running_loop().time()))
+
+    asyncio.run(run())
+    assert contents([frame for frame, _ in received]) == ["a", "bc", "d"]
+    # "bc" ушло по таймеру, не дожидаясь следующего токена
+    assert received[2][1] - received[1][1] >= 0.1
+
+
+def test_disabled_coalescing_sends_every_token():
+    frames = collect(SSECoalescer(flush_interval_ms=0), source([token(c) for c in "abc"]))
+    assert contents(frames) == ["a", "b", "c"]
+
+
+def test_pending_tokens_are_flushed_on_cancel():
+    coalescer = SSECoalescer(flush_interval_ms=1000, max_tokens=16)
+
+    async def run():
+        cancelled = asyncio.Event()
+        block = asyncio.Event()
+        received = []
+        async for frame in coalescer.stream(source([token(c) for c in "abc"], block=block), cancelled=cancelled):
+            received.append(frame)
+            # Модель "зависла" после третьего токена, клиент отменяет запрос
+            asyncio.get_running_loop().call_later(0.05, cancelled.set)
+        return received
+
+    assert contents(asyncio.run(run())) == ["a", "bc"]
+
+
+def test_reader_stops_when_client_falls_behind():
+    coalescer = SSECoalescer(flush_interval_ms=0, max_pending=4)
+    produced = 0
+
+    async def chunks():
+        nonlocal produced
+        for i in range(100):
+            produced += 1
+            yield token(str(i))
+
+    async def run():
+        stream = coalescer.stream(chunks())
+        await stream.__anext__()
+        # Клиент не читает: чтение модели упирается в max_pending
+        for _ in range(20):
+            await asyncio.sleep(0)
+        ahead = produced
+        rest = [frame async for frame in stream]
+        return ahead, len(rest)
+
+    ahead, rest = asyncio.run(run())
+    assert ahead <= 1 + 4 + 1
+    assert rest == 99
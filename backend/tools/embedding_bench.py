@@ -0,0 +1,154 @@
+"""Экспорт, проверка совпадения и замер скорости бэкендов эмбеддингов.
+
+Примеры (из папки backend):
+
+    python tools/embedding_bench.py export --quantize      # экспорт в ONNX (+ int8) в кэш
+    python tools/embedding_bench.py parity                  # ONNX fp32 против PyTorch
+    python tools/embedding_bench.py parity --quantize --min-cosine 0.98
+    python tools/embedding_bench.py bench --backends torch onnx onnx-int8 --batch-sizes 1 8 32 64
+
+parity завершается с кодом 1, если косинусное сходство хотя бы одного
+вектора с PyTorch ниже порога - запускать после смены модели или версий
+onnxruntime/optimum.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rag_system.components.embedding.embedding_component import (  # noqa: E402
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_MAX_LENGTH,
+    EMBEDDING_MODEL,
+    EMBEDDING_THREADS,
+    create_embed_model,
+)
+from rag_system.components.embedding.onnx_embedding import export_onnx_model  # noqa: E402
+from rag_system.intent_router import load_eval_set  # noqa: E402
+
+# Фрагменты разной длины, как у семантического сплиттера
+_PASSAGE = (
+    "Сотрудник обязан согласовать командировку с непосредственным руководителем "
+    "не позднее чем за пять рабочих дней до выезда и оформить служебное задание. "
+)
+
+
+def sample_texts(path: Optional[Path] = None, limit: int = 256) -> List[str]:
+    if path is not None:
+        texts = [line.strip() for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+    else:
+        questions = [sample["question"] for sample in load_eval_set()]
+        passages = [_PASSAGE * repeat for repeat in (1, 2, 4, 8)]
+        texts = questions + passages * (len(questions) // len(passages))
+    if not texts:
+        raise SystemExit("No texts to embed")
+    while len(texts) < limit:
+        texts = texts + texts
+    return texts[:limit]
+
+
+def _build(backend: str, args: argparse.Namespace, batch_size: int = 32):
+    return create_embed_model(
+        backend="onnx" if backend.startswith("onnx") else backend,
+        model_name=args.model,
+        quantize=backend == "onnx-int8",
+        threads=args.threads,
+        batch_size=batch_size,
+        max_length=args.max_length,
+        cache_dir=args.cache_dir,
+    )
+
+
+def cmd_export(args: argparse.Namespace) -> int:
+    model_dir, model_path = export_onnx_model(args.model, args.cache_dir, args.quantize)
+    print(f"ONNX model: {model_path} ({model_path.stat().st_size / 1e6:.1f} MB), tokenizer: {model_dir}")
+    return 0
+
+
+def cmd_parity(args: argparse.Namespace) -> int:
+    texts = sample_texts(args.texts, args.limit)
+    reference = np.asarray(_build("torch", args).get_text_embedding_batch(texts), dtype=np.float32)
+    backend = "onnx-int8" if args.quantize else "onnx"
+    candidate = np.asarray(_build(backend, args).get_text_embedding_batch(texts), dtype=np.float32)
+
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate /= np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosine = (reference * candidate).sum(axis=1)
+    threshold = args.min_cosine if args.min_cosine is not None else (0.98 if args.quantize else 0.999)
+
+    report = {
+        "backend": backend,
+        "texts": len(texts),
+        "cosine_min": round(float(cosine.min()), 6),
+        "cosine_mean": round(float(cosine.mean()), 6),
+        "threshold": threshold,
+        "passed": bool(cosine.min() >= threshold),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report["passed"] else 1
+
+
+def cmd_bench(args: argparse.Namespace) -> int:
+    texts = sample_texts(args.texts, args.limit)
+    results = []
+    for backend in args.backends:
+        model = _build(backend, args)
+        # Прогрев: загрузка весов, выделение памяти, JIT оптимизации графа
+        model.get_text_embedding_batch(texts[: max(args.batch_sizes)])
+        for batch_size in args.batch_sizes:
+            model.embed_batch_size = batch_size
+            started = time.perf_counter()
+            model.get_text_embedding_batch(texts)
+            elapsed = time.perf_counter() - started
+            results.append({
+                "backend": backend,
+                "batch_size": batch_size,
+                "texts_per_second": round(len(texts) / elapsed, 1),
+                "ms_per_text": round(elapsed / len(texts) * 1000, 3),
+            })
+            print(f"{backend:>10}  batch={batch_size:<4} {results[-1]['texts_per_second']:>8} texts/s"
+                  f"  {results[-1]['ms_per_text']:>7} ms/text", file=sys.stderr)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--cache-dir", default=EMBEDDING_CACHE_DIR)
+    parser.add_argument("--threads", type=int, default=EMBEDDING_THREADS)
+    parser.add_argument("--max-length", type=int, default=EMBEDDING_MAX_LENGTH,
+                        help="по умолчанию max_seq_length модели")
+    parser.add_argument("--texts", type=Path, default=None, help="файл с текстами, по одному на строку")
+    parser.add_argument("--limit", type=int, default=256)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="экспорт модели в ONNX")
+    export.add_argument("--quantize", action="store_true")
+    export.set_defaults(func=cmd_export)
+
+    parity = commands.add_parser("parity", help="сравнение векторов ONNX и PyTorch")
+    parity.add_argument("--quantize", action="store_true")
+    parity.add_argument("--min-cosine", type=float, default=None)
+    parity.set_defaults(func=cmd_parity)
+
+    bench = commands.add_parser("bench", help="пропускная способность по размерам батча")
+    bench.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"],
+                       choices=["torch", "onnx", "onnx-int8"])
+    bench.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 16, 32, 64])
+    bench.add_argument("--json", action="store_true")
+    bench.set_defaults(func=cmd_bench)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
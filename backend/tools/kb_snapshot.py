@@ -0,0 +1,60 @@
+"""Снимок базы знаний: перенос на новую площадку без повторной загрузки документов.
+
+Примеры (из папки backend, сервер должен быть остановлен - у Chroma один писатель):
+
+    python tools/kb_snapshot.py export kb-snapshot.zip
+    python tools/kb_snapshot.py info kb-snapshot.zip
+    python tools/kb_snapshot.py import kb-snapshot.zip --replace
+
+На работающем сервере то же делают GET и POST /api/rag/snapshot.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rag_system.snapshot import SnapshotError, read_manifest  # noqa: E402
+
+
+def _ingest_component(data_dir: str):
+    from rag_system.ingest_component import IngestComponent
+
+    return IngestComponent(persist_dir=data_dir)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default="./data")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="выгрузить базу знаний в файл")
+    export.add_argument("path", type=Path)
+    info = commands.add_parser("info", help="показать manifest снимка")
+    info.add_argument("path", type=Path)
+    restore = commands.add_parser("import", help="загрузить снимок в базу знаний")
+    restore.add_argument("path", type=Path)
+    restore.add_argument("--replace", action="store_true", help="удалить текущие документы перед загрузкой")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "info":
+            result = read_manifest(args.path)
+        else:
+            ingest_component = _ingest_component(args.data_dir)
+            try:
+                if args.command == "export":
+                    result = ingest_component.export_snapshot(args.path)
+                else:
+                    result = ingest_component.import_snapshot(args.path, replace=args.replace)
+            finally:
+                ingest_component.close()
+    except SnapshotError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,410 @@
+"""Нагрузочный тест бэкенда: поток вопросов с заданным RPS на обычный и SSE эндпоинты.
+
+Примеры (из папки backend):
+
+    python tools/loadtest.py --rps 5 --duration 60                  # заглушка Ollama + свой uvicorn
+    python tools/loadtest.py --rps 20 --mix stream=0.8,query=0.2 --tokens-per-second 80
+    python tools/loadtest.py --url http://127.0.0.1:8000 --questions questions.jsonl
+    python tools/loadtest.py --rps 5 --compare loadtest_results/20240101T000000Z-abc1234.json
+
+Без --url скрипт запускает tools/mock_ollama.py и uvicorn app:app с
+OLLAMA_BASE_URL на заглушку и ждет /ready. Поиск по базе знаний и
+эмбеддинги - настоящие, заменена только генерация.
+
+Вопросы: --questions (jsonl с полем question или по строке на вопрос,
+например выгрузка из логов), по умолчанию - rag_system/intent_eval.jsonl.
+Запросы отправляются по расписанию (открытая модель): медленный сервер
+не снижает нагрузку, а копит запросы в работе до --max-in-flight.
+
+Отчет: p50/p95/p99 задержки, время до первого токена (SSE), доля ошибок,
+задержка event loop сервера (event_loop_lag_seconds из /metrics) и самого
+клиента. Результат сохраняется в --output-dir с коммитом в имени файла;
+--compare печатает разницу с прошлым прогоном.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from rag_system.intent_router import load_eval_set  # noqa: E402
+
+ENDPOINTS = {
+    "query": "/api/rag/query",
+    "stream": "/api/rag/query/stream",
+}
+
+
+def load_questions(path: Optional[Path]) -> List[str]:
+    if path is None:
+        questions = [sample["question"] for sample in load_eval_set()]
+    else:
+        questions = []
+        for line in path.read_text(encoding="utf-8").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            questions.append(json.loads(line)["question"] if line.startswith("{") else line)
+    if not questions:
+        raise SystemExit("No questions to replay")
+    return questions
+
+
+def parse_mix(raw: str) -> Dict[str, float]:
+    mix = {}
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint {name!r}, expected one of {sorted(ENDPOINTS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+def summarize(values: Sequence[float]) -> Dict[str, float]:
+    return {
+        "p50_ms": round(percentile(values, 0.5) * 1000, 1),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+        "max_ms": round(max(values, default=0.0) * 1000, 1),
+    }
+
+
+class Results:
+    def __init__(self) -> None:
+        self.latency: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.ttft: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.outcomes: Dict[str, Counter] = {name: Counter() for name in ENDPOINTS}
+        self.skipped = 0
+
+    def report(self, elapsed: float) -> Dict:
+        report = {}
+        for name in ENDPOINTS:
+            outcomes = self.outcomes[name]
+            total = sum(outcomes.values())
+            if not total:
+                continue
+            errors = total - outcomes["ok"]
+            report[name] = {
+                "requests": total,
+                "achieved_rps": round(total / elapsed, 2),
+                "error_rate": round(errors / total, 4),
+                "outcomes": dict(outcomes),
+                "latency": summarize(self.latency[name]),
+            }
+            if self.ttft[name]:
+                report[name]["time_to_first_token"] = summarize(self.ttft[name])
+        return report
+
+
+async def run_query(client: httpx.AsyncClient, question: str, results: Results) -> None:
+    started = time.perf_counter()
+    try:
+        response = await client.post(ENDPOINTS["query"], json={"question": question})
+        outcome = "ok" if response.status_code == 200 else f"http_{response.status_code}"
+    except httpx.HTTPError as e:
+        outcome = type(e).__name__
+    if outcome == "ok":
+        results.latency["query"].append(time.perf_counter() - started)
+    results.outcomes["query"][outcome] += 1
+
+
+async def run_stream(client: httpx.AsyncClient, question: str, results: Results) -> None:
+    started = time.perf_counter()
+    first_token = None
+    outcome = "incomplete"
+    try:
+        async with client.stream("POST", ENDPOINTS["stream"], json={"question": question}) as response:
+            if response.status_code != 200:
+                outcome = f"http_{response.status_code}"
+            else:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[6:])
+                    if event.get("type") == "error":
+                        outcome = "stream_error"
+                        break
+                    if event.get("type") == "content":
+                        if first_token is None and event.get("content"):
+                            first_token = time.perf_counter() - started
+                        if event.get("done"):
+                            outcome = "ok"
+                            break
+    except httpx.HTTPError as e:
+        outcome = type(e).__name__
+    if outcome == "ok":
+        results.latency["stream"].append(time.perf_counter() - started)
+        if first_token is not None:
+            results.ttft["stream"].append(first_token)
+    results.outcomes["stream"][outcome] += 1
+
+
+RUNNERS = {"query": run_query, "stream": run_stream}
+
+
+async def measure_loop_lag(samples: List[float], interval: float = 0.05) -> None:
+    """Задержка event loop самого клиента: если она большая, упирается клиент, а не сервер"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+
+async def replay(client: httpx.AsyncClient, questions: List[str], mix: Dict[str, float], rps: float,
+                 duration: float, max_in_flight: int, results: Results) -> float:
+    """Открытая модель: i-й запрос уходит в момент i / rps, независимо от ответов"""
+    names, weights = list(mix), list(mix.values())
+    tasks = set()
+    started = time.perf_counter()
+    for index in range(int(rps * duration)):
+        delay = started + index / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= max_in_flight:
+            results.skipped += 1
+            continue
+        endpoint = random.choices(names, weights)[0]
+        task = asyncio.create_task(RUNNERS[endpoint](client, random.choice(questions), results))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+    return time.perf_counter() - started
+
+
+def parse_histogram(metrics_text: str, name: str) -> Dict[float, int]:
+    """Накопленные счетчики корзин гистограммы без меток из /metrics"""
+    buckets = {}
+    prefix = f'{name}_bucket{{le="'
+    for line in metrics_text.splitlines():
+        if line.startswith(prefix):
+            bound, _, value = line[len(prefix):].partition('"} ')
+            buckets[float(bound)] = int(float(value))
+    return buckets
+
+
+def histogram_quantile(before: Dict[float, int], after: Dict[float, int], q: float) -> Optional[float]:
+    """Квантиль по приросту счетчиков за прогон (верхняя граница корзины)"""
+    delta = sorted((bound, after[bound] - before.get(bound, 0)) for bound in after)
+    total = delta[-1][1] if delta else 0
+    if not total:
+        return None
+    for bound, count in delta:
+        if count >= q * total:
+            return bound
+    return None
+
+
+async def server_loop_lag(client: httpx.AsyncClient) -> Dict[float, int]:
+    try:
+        response = await client.get("/metrics")
+        return parse_histogram(response.text, "event_loop_lag_seconds")
+    except httpx.HTTPError:
+        return {}
+
+
+async def run(args: argparse.Namespace, base_url: str) -> Dict:
+    questions = load_questions(args.questions)
+    mix = parse_mix(args.mix)
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    timeout = httpx.Timeout(args.request_timeout, connect=10)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        if args.warmup:
+            await replay(client, questions, mix, args.rps, args.warmup, args.max_in_flight, Results())
+
+        client_lag: List[float] = []
+        lag_task = asyncio.create_task(measure_loop_lag(client_lag))
+        lag_before = await server_loop_lag(client)
+        results = Results()
+        elapsed = await replay(client, questions, mix, args.rps, args.duration, args.max_in_flight, results)
+        lag_after = await server_loop_lag(client)
+        lag_task.cancel()
+
+    report = {
+        "endpoints": results.report(elapsed),
+        "skipped_max_in_flight": results.skipped,
+        "elapsed_seconds": round(elapsed, 2),
+        "client_loop_lag": summarize(client_lag),
+    }
+    if lag_after:
+        report["server_loop_lag"] = {
+            f"p{int(q * 100)}_ms": round(value * 1000, 2) if value is not None else None
+            for q in (0.5, 0.95, 0.99)
+            for value in [histogram_quantile(lag_before, lag_after, q)]
+        }
+    return report
+
+
+def _wait_until(url: str, timeout: float, process: subprocess.Popen, log) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise SystemExit(f"Process exited before {url} became available:\n{log.read()[-3000:]}")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"Timed out waiting for {url}")
+
+
+def start_stack(args: argparse.Namespace, log) -> List[subprocess.Popen]:
+    """Заглушка Ollama и uvicorn app:app на ней; ждем /ready"""
+    mock = subprocess.Popen(
+        [sys.executable, str(BACKEND_DIR / "tools" / "mock_ollama.py"), "--port", str(args.mock_port),
+         "--tokens-per-second", str(args.tokens_per_second), "--first-token-ms", str(args.first_token_ms),
+         "--tokens", str(args.tokens), "--error-rate", str(args.mock_error_rate)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=log,
+    )
+    processes = [mock]
+    _wait_until(f"http://127.0.0.1:{args.mock_port}/api/version", 30, mock, log)
+    env = {**os.environ, "OLLAMA_BASE_URL": f"http://127.0.0.1:{args.mock_port}", "OLLAMA_BACKENDS": ""}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log,
+    )
+    processes.append(server)
+    _wait_until(f"http://127.0.0.1:{args.port}/ready", args.startup_timeout, server, log)
+    return processes
+
+
+def stop_stack(processes: List[subprocess.Popen]) -> None:
+    for process in reversed(processes):
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(report: Dict, baseline: Dict) -> List[str]:
+    """Разница с сохраненным результатом прошлого прогона"""
+    lines = [f"Compared with {baseline['revision']} ({baseline['started_at']}):"]
+    for name, stats in report["endpoints"].items():
+        previous = baseline["report"]["endpoints"].get(name)
+        if not previous:
+            continue
+        for section in ("latency", "time_to_first_token"):
+            for key, value in stats.get(section, {}).items():
+                old = previous.get(section, {}).get(key)
+                if old:
+                    lines.append(f"  {name:<7} {section:<20} {key:<7} {old:>9.1f} -> {value:>9.1f} ms "
+                                 f"({(value - old) / old:+.1%})")
+        lines.append(f"  {name:<7} error_rate {previous['error_rate']:.2%} -> {stats['error_rate']:.2%}")
+    return lines
+
+
+def print_report(result: Dict) -> None:
+    report = result["report"]
+    print(f"{result['revision']}: {result['config']['rps']} rps for {report['elapsed_seconds']} s")
+    for name, stats in report["endpoints"].items():
+        latency = stats["latency"]
+        print(f"  {name:<7} {stats['requests']:>6} req  {stats['achieved_rps']:>6} rps  "
+              f"errors {stats['error_rate']:.2%}  p50 {latency['p50_ms']} ms  p95 {latency['p95_ms']} ms  "
+              f"p99 {latency['p99_ms']} ms")
+        if "time_to_first_token" in stats:
+            ttft = stats["time_to_first_token"]
+            print(f"  {'':<7} time to first token  p50 {ttft['p50_ms']} ms  p95 {ttft['p95_ms']} ms  "
+                  f"p99 {ttft['p99_ms']} ms")
+        failed = {k: v for k, v in stats["outcomes"].items() if k != "ok"}
+        if failed:
+            print(f"  {'':<7} failures: {failed}")
+    if "server_loop_lag" in report:
+        print(f"  server event loop lag: {report['server_loop_lag']}")
+    print(f"  client event loop lag: p99 {report['client_loop_lag']['p99_ms']} ms")
+    if report["skipped_max_in_flight"]:
+        print(f"  skipped (max in flight reached): {report['skipped_max_in_flight']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="уже запущенный бэкенд; без него запускаются заглушка и uvicorn")
+    parser.add_argument("--questions", type=Path, help="jsonl с полем question или по вопросу в строке")
+    parser.add_argument("--rps", type=float, default=5.0)
+    parser.add_argument("--duration", type=float, default=30.0, help="секунд нагрузки")
+    parser.add_argument("--warmup", type=float, default=5.0, help="секунд прогрева, в отчет не входят")
+    parser.add_argument("--mix", default="stream=0.5,query=0.5", help="доли эндпоинтов")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--port", type=int, default=int(os.getenv("LOADTEST_PORT", "8766")))
+    parser.add_argument("--mock-port", type=int, default=11435)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--first-token-ms", type=float, default=150.0)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--output-dir", type=Path, default=BACKEND_DIR / "loadtest_results")
+    parser.add_argument("--compare", type=Path, help="прошлый результат для сравнения")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="код 1, если ошибок больше")
+    args = parser.parse_args()
+
+    started_at = datetime.now(timezone.utc)
+    processes: List[subprocess.Popen] = []
+    # Лог процессов в файл, а не в pipe: иначе переполненный pipe остановит сервер
+    with tempfile.TemporaryFile(mode="w+") as log:
+        try:
+            if args.url:
+                base_url = args.url.rstrip("/")
+            else:
+                processes = start_stack(args, log)
+                base_url = f"http://127.0.0.1:{args.port}"
+            report = asyncio.run(run(args, base_url))
+        finally:
+            stop_stack(processes)
+
+    revision = git_revision()
+    result = {
+        "revision": revision,
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "config": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "report": report,
+    }
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    path = args.output_dir / f"{started_at.strftime('%Y%m%dT%H%M%SZ')}-{revision}.json"
+    path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    print_report(result)
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        print("\n".join(compare(report, baseline)))
+    print(f"Saved to {path}")
+
+    if args.max_error_rate is not None:
+        worst = max((stats["error_rate"] for stats in report["endpoints"].values()), default=0.0)
+        if worst > args.max_error_rate:
+            print(f"ERROR RATE EXCEEDED: {worst:.2%} > {args.max_error_rate:.2%}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""Заглушка Ollama для нагрузочных тестов: отвечает как Ollama, но без модели.
+
+Примеры (из папки backend):
+
+    python tools/mock_ollama.py --port 11435
+    python tools/mock_ollama.py --tokens-per-second 30 --first-token-ms 400 --error-rate 0.01
+
+Потом бэкенд запускается с OLLAMA_BASE_URL=http://127.0.0.1:11435
+(tools/loadtest.py делает это сам). Поддерживаются /api/generate и
+/api/chat (потоком и без), /api/tags, /api/ps, /api/pull и /api/version.
+Скорость генерации и задержка до первого токена задаются параметрами,
+в финальном ответе - eval_count, eval_duration и prompt_eval_* как у Ollama.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_WORDS = (
+    "Согласно положению МТУСИ сотрудник оформляет заявление через отдел кадров "
+    "не позднее чем за пять рабочих дней и согласует его с руководителем подразделения"
+).split()
+
+
+@dataclass
+class MockConfig:
+    models: List[str] = field(default_factory=lambda: ["qwen2.5:0.5b"])
+    tokens_per_second: float = 40.0
+    first_token_ms: float = 150.0
+    tokens: int = 64
+    jitter: float = 0.2
+    error_rate: float = 0.0
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _jittered(value: float, jitter: float) -> float:
+    return max(0.0, value * random.uniform(1 - jitter, 1 + jitter))
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI(title="Mock Ollama")
+    loaded: Dict[str, float] = {}
+
+    def token_budget(payload: Dict[str, Any]) -> int:
+        num_predict = (payload.get("options") or {}).get("num_predict")
+        return min(config.tokens, num_predict) if num_predict and num_predict > 0 else config.tokens
+
+    def prompt_tokens(payload: Dict[str, Any]) -> int:
+        text = payload.get("prompt") or "".join(m.get("content", "") for m in payload.get("messages", []))
+        return max(1, len(text) // 4)
+
+    async def generation(path: str, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Чанки ответа в формате Ollama, последний - со статистикой"""
+        model = payload.get("model", "")
+        loaded[model] = time.time()
+        started = time.perf_counter()
+        await asyncio.sleep(_jittered(config.first_token_ms, config.jitter) / 1000)
+        prompt_eval = time.perf_counter() - started
+        count = token_budget(payload) if payload.get("prompt") != "" else 0
+        eval_started = time.perf_counter()
+        for index in range(count):
+            if index:
+                await asyncio.sleep(_jittered(1 / config.tokens_per_second, config.jitter))
+            token = _WORDS[index % len(_WORDS)] + " "
+            if path == "/api/chat":
+                yield {"model": model, "created_at": _now(),
+                       "message": {"role": "assistant", "content": token}, "done": False}
+            else:
+                yield {"model": model, "created_at": _now(), "response": token, "done": False}
+        final = {
+            "model": model,
+            "created_at": _now(),
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens(payload),
+            "prompt_eval_duration": int(prompt_eval * 1e9),
+            "eval_count": count,
+            "eval_duration": int((time.perf_counter() - eval_started) * 1e9),
+        }
+        if path == "/api/chat":
+            final["message"] = {"role": "assistant", "content": ""}
+        else:
+            final["response"] = ""
+            # Как у Ollama: в raw режиме context не возвращается
+            if not payload.get("raw"):
+                final["context"] = list(payload.get("context") or []) + list(range(prompt_tokens(payload) + count))
+        yield final
+
+    async def handle(path: str, request: Request):
+        payload = await request.json()
+        if config.error_rate and random.random() < config.error_rate:
+            return JSONResponse(status_code=500, content={"error": "mock failure"})
+        if payload.get("stream", True):
+            async def lines():
+                async for chunk in generation(path, payload):
+                    yield json.dumps(chunk, ensure_ascii=False, separators=(",", ":")) + "\n"
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+        text = []
+        async for chunk in generation(path, payload):
+            text.append(chunk.get("response") or chunk.get("message", {}).get("content", ""))
+        if path == "/api/chat":
+            chunk["message"]["content"] = "".join(text)
+        else:
+            chunk["response"] = "".join(text)
+        return chunk
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        return await handle("/api/generate", request)
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        return await handle("/api/chat", request)
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [
+            {"name": model, "model": model, "modified_at": _now(), "size": 0, "digest": "mock"}
+            for model in config.models
+        ]}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": model, "model": model, "size": 0} for model in loaded]}
+
+    @app.post("/api/pull")
+    async def pull(request: Request):
+        payload = await request.json()
+        model = payload.get("model") or payload.get("name")
+        if model and model not in config.models:
+            config.models.append(model)
+        if payload.get("stream", True):
+            return StreamingResponse(iter([json.dumps({"status": "success"}) + "\n"]),
+                                     media_type="application/x-ndjson")
+        return {"status": "success"}
+
+    @app.get("/api/version")
+    async def version():
+        return {"version": "0.0.0-mock"}
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--models", nargs="+", default=MockConfig().models)
+    parser.add_argument("--tokens-per-second", type=float, default=MockConfig.tokens_per_second)
+    parser.add_argument("--first-token-ms", type=float, default=MockConfig.first_token_ms,
+                        help="задержка до первого токена (загрузка промпта)")
+    parser.add_argument("--tokens", type=int, default=MockConfig.tokens, help="токенов в ответе (не больше num_predict)")
+    parser.add_argument("--jitter", type=float, default=MockConfig.jitter, help="разброс задержек, доля от значения")
+    parser.add_argument("--error-rate", type=float, default=MockConfig.error_rate, help="доля ответов 500")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        models=list(args.models),
+        tokens_per_second=args.tokens_per_second,
+        first_token_ms=args.first_token_ms,
+        tokens=args.tokens,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
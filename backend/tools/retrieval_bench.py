@@ -0,0 +1,367 @@
+"""Качество и скорость поиска по базе знаний для разных настроек индекса.
+
+Примеры (из папки backend):
+
+    python tools/retrieval_bench.py generate --out bench_data --docs 120
+    python tools/retrieval_bench.py run --data bench_data
+    python tools/retrieval_bench.py run --data bench_data --embedding torch onnx-int8 \\
+        --breakpoints 90 95 --buffer-sizes 1 2 --top-k 3 5 --min-recall 0.9
+
+Набор данных - папка с документами corpus/ и размеченными вопросами
+questions.jsonl: {"question": "...", "relevant": ["имя_файла.txt", ...]}.
+generate создает синтетический набор: положения подразделений на русском
+с похожими формулировками и разными фактами, так что рядом с нужным
+документом всегда есть близкие, но неверные.
+
+Каждая конфигурация (порог и окно семантического сплиттера, модель,
+бэкенд эмбеддингов и int8 квантование) собирается в отдельном процессе с
+нужными переменными окружения в чистой папке индекса. Для каждого top_k
+считаются recall@k, MRR по документам, p50/p99 задержки поиска, а для
+индекса - время сборки, размер на диске и число фрагментов. Результат -
+одна таблица и JSON; отмечается самая быстрая конфигурация с recall@k
+не ниже --min-recall.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rag_system.components.embedding.embedding_component import EMBEDDING_MODEL  # noqa: E402
+from rag_system.ingest_helper import (  # noqa: E402
+    SEMANTIC_SPLITTER_BREAKPOINT_PERCENTILE,
+    SEMANTIC_SPLITTER_BUFFER_SIZE,
+)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+_DEPARTMENTS = [
+    "бухгалтерия", "отдел кадров", "ИТ-отдел", "учебный отдел", "приемная комиссия",
+    "библиотека", "научный отдел", "юридический отдел", "отдел закупок", "хозяйственный отдел",
+    "кафедра информатики", "кафедра радиотехники", "кафедра физики", "кафедра высшей математики",
+    "кафедра иностранных языков", "кафедра экономики", "деканат заочного обучения",
+    "отдел аспирантуры", "отдел охраны труда", "студенческий офис",
+]
+_SYSTEMS = ["1С:Документооборот", "СЭД Дело", "портал сотрудника", "ServiceDesk", "Directum"]
+_MONTHS = ["январе", "марте", "апреле", "мае", "сентябре", "октябре", "ноябре"]
+_NAMES = ["Иванова А. С.", "Петров Д. В.", "Сидорова Е. Н.", "Кузнецов М. И.", "Орлова Т. П.", "Волков Р. А."]
+
+# Тема: абзац с фактом и вопросы, сформулированные иначе, чем в тексте
+_TOPICS = {
+    "otpusk": (
+        "Порядок оформления отпуска. Заявление на ежегодный оплачиваемый отпуск сотрудники "
+        "подразделения «{dept}» подают не позднее чем за {days} календарных дней до его начала. "
+        "Заявление согласует {name}, после чего оно передается в отдел кадров.",
+        ["За сколько дней до отпуска в подразделении «{dept}» нужно подать заявление?",
+         "Кто согласует отпуск сотрудникам подразделения «{dept}»?"],
+    ),
+    "komandirovka": (
+        "Служебные командировки. Командировки работников подразделения «{dept}» оформляются "
+        "через {system}. Суточные при поездках по России составляют {amount} рублей, авансовый "
+        "отчет сдается в течение {days} рабочих дней после возвращения.",
+        ["Какой размер суточных в командировке для подразделения «{dept}»?",
+         "Через какую систему в подразделении «{dept}» оформить поездку в командировку?"],
+    ),
+    "propusk": (
+        "Пропускной режим. Временные пропуска для посетителей подразделения «{dept}» выдает "
+        "бюро пропусков в корпусе {building}, кабинет {room}, по заявке, поданной за {days} "
+        "рабочих дня до визита.",
+        ["Где получить временный пропуск для гостя подразделения «{dept}»?",
+         "За сколько дней подавать заявку на пропуск посетителю в подразделение «{dept}»?"],
+    ),
+    "dostup": (
+        "Доступ к информационным системам. Учетные записи в системе {system} для новых "
+        "сотрудников подразделения «{dept}» создаются по заявке руководителя в течение {days} "
+        "рабочих дней. Пароль меняется каждые {period} дней.",
+        ["Как быстро новому сотруднику подразделения «{dept}» откроют доступ к {system}?",
+         "Как часто в подразделении «{dept}» нужно менять пароль?"],
+    ),
+    "obuchenie": (
+        "Повышение квалификации. Курсы повышения квалификации для работников подразделения "
+        "«{dept}» проводятся в {month}, объем программы - {hours} академических часов. "
+        "Ответственный за запись на курсы - {name}.",
+        ["Когда проходят курсы повышения квалификации у подразделения «{dept}»?",
+         "Сколько часов длится программа повышения квалификации в подразделении «{dept}»?"],
+    ),
+}
+
+# Общие абзацы: одинаковая лексика во всех документах мешает поиску по словам
+_FILLER = [
+    "Настоящее положение разработано в соответствии с уставом университета и локальными "
+    "нормативными актами МТУСИ.",
+    "Изменения в положение вносятся приказом ректора по представлению руководителя подразделения.",
+    "Контроль за исполнением положения возлагается на руководителя подразделения.",
+    "Сотрудники знакомятся с положением под подпись при приеме на работу.",
+    "Вопросы, не урегулированные положением, решаются в соответствии с трудовым законодательством.",
+    "Документы хранятся в подразделении в течение срока, установленного номенклатурой дел.",
+]
+
+
+def generate_dataset(out: Path, docs: int, seed: int) -> Dict[str, int]:
+    """Синтетический корпус: документ - тема положения для одного подразделения"""
+    rng = random.Random(seed)
+    pairs = list(itertools.product(range(len(_DEPARTMENTS)), sorted(_TOPICS)))
+    rng.shuffle(pairs)
+    pairs = sorted(pairs[:docs])
+
+    corpus = out / "corpus"
+    if corpus.exists():
+        shutil.rmtree(corpus)
+    corpus.mkdir(parents=True)
+    questions = []
+    for dept_index, topic in pairs:
+        dept = _DEPARTMENTS[dept_index]
+        facts = {
+            "dept": dept,
+            "days": rng.choice([3, 5, 7, 10, 14]),
+            "name": rng.choice(_NAMES),
+            "system": rng.choice(_SYSTEMS),
+            "amount": rng.choice([700, 1000, 1500, 2500]),
+            "building": rng.choice("АБВГ"),
+            "room": rng.randint(100, 599),
+            "period": rng.choice([30, 60, 90]),
+            "month": rng.choice(_MONTHS),
+            "hours": rng.choice([16, 36, 72]),
+        }
+        template, question_templates = _TOPICS[topic]
+        filler = rng.sample(_FILLER, 4)
+        paragraphs = filler[:2] + [template.format(**facts)] + filler[2:]
+        file_name = f"dept{dept_index:02d}_{topic}.txt"
+        (corpus / file_name).write_text(
+            f"Положение подразделения «{dept}»\n\n" + "\n\n".join(paragraphs) + "\n", encoding="utf-8"
+        )
+        for question in question_templates:
+            questions.append({"question": question.format(**facts), "relevant": [file_name]})
+
+    with open(out / "questions.jsonl", "w", encoding="utf-8") as f:
+        for sample in questions:
+            f.write(json.dumps(sample, ensure_ascii=False) + "\n")
+    return {"documents": len(pairs), "questions": len(questions)}
+
+
+def load_labels(data: Path) -> List[dict]:
+    with open(data / "questions.jsonl", encoding="utf-8") as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    if not samples:
+        raise SystemExit(f"No questions in {data / 'questions.jsonl'}")
+    return samples
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def evaluate_index(data: Path, top_ks: List[int], persist_dir: Path) -> dict:
+    """Собрать индекс из corpus/ и прогнать размеченные вопросы; работает внутри процесса конфигурации"""
+    from rag_system.ingest_component import IngestComponent
+
+    samples = load_labels(data)
+    files = sorted(p for p in (data / "corpus").iterdir() if p.is_file())
+
+    started = time.perf_counter()
+    component = IngestComponent(persist_dir=str(persist_dir))
+    load_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    failed = [f.name for f in files if not component.ingest_file(str(f))]
+    component.flush()
+    build_seconds = time.perf_counter() - started
+    stats = component.documents.stats()
+
+    try:
+        # Прогрев: первый запрос платит за ленивую инициализацию модели и коллекции
+        component.query_with_scores(samples[0]["question"], max(top_ks))
+        results = []
+        for top_k in top_ks:
+            latencies, recalls, reciprocal_ranks = [], [], []
+            for sample in samples:
+                query_started = time.perf_counter()
+                nodes = component.query_with_scores(sample["question"], top_k)
+                latencies.append(time.perf_counter() - query_started)
+                ranked: List[str] = []
+                for node in nodes:
+                    file_name = node.node.metadata.get("file_name")
+                    if file_name not in ranked:
+                        ranked.append(file_name)
+                relevant = set(sample["relevant"])
+                recalls.append(len(relevant.intersection(ranked)) / len(relevant))
+                reciprocal_ranks.append(
+                    next((1 / (rank + 1) for rank, name in enumerate(ranked) if name in relevant), 0.0)
+                )
+            results.append({
+                "top_k": top_k,
+                "recall": round(sum(recalls) / len(recalls), 4),
+                "mrr": round(sum(reciprocal_ranks) / len(reciprocal_ranks), 4),
+                "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+                "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+            })
+    finally:
+        component.close()
+
+    return {
+        "documents": len(files) - len(failed),
+        "failed": failed,
+        "chunks": stats["chunks"],
+        "questions": len(samples),
+        "model_load_seconds": round(load_seconds, 2),
+        "build_seconds": round(build_seconds, 2),
+        "index_bytes": _dir_bytes(persist_dir),
+        "results": results,
+    }
+
+
+def _configurations(args: argparse.Namespace) -> List[Dict[str, str]]:
+    configs = []
+    for model, backend, breakpoint, buffer_size in itertools.product(
+        args.models, args.embedding, args.breakpoints, args.buffer_sizes
+    ):
+        configs.append({
+            "EMBEDDING_MODEL": model,
+            "EMBEDDING_BACKEND": "onnx" if backend.startswith("onnx") else backend,
+            "EMBEDDING_QUANTIZE": "1" if backend == "onnx-int8" else "0",
+            "SEMANTIC_SPLITTER_BREAKPOINT_PERCENTILE": str(breakpoint),
+            "SEMANTIC_SPLITTER_BUFFER_SIZE": str(buffer_size),
+        })
+    return configs
+
+
+def _label(config: Dict[str, str]) -> str:
+    backend = config["EMBEDDING_BACKEND"] + ("-int8" if config["EMBEDDING_QUANTIZE"] == "1" else "")
+    model = config["EMBEDDING_MODEL"].rsplit("/", 1)[-1]
+    return (f"{model} {backend} bp={config['SEMANTIC_SPLITTER_BREAKPOINT_PERCENTILE']}"
+            f" buf={config['SEMANTIC_SPLITTER_BUFFER_SIZE']}")
+
+
+def run_configuration(config: Dict[str, str], args: argparse.Namespace) -> dict:
+    """Сборка и замер в отдельном процессе: настройки читаются из окружения при импорте"""
+    with tempfile.TemporaryDirectory(prefix="retrieval_bench_") as work_dir:
+        log_path = Path(work_dir) / "worker.log"
+        command = [
+            sys.executable, str(Path(__file__).resolve()), "_evaluate",
+            "--data", str(args.data.resolve()),
+            "--persist-dir", str(Path(work_dir) / "index"),
+            "--top-k", *map(str, args.top_k),
+        ]
+        with open(log_path, "w", encoding="utf-8") as log:
+            completed = subprocess.run(
+                command, cwd=BACKEND_DIR, env={**os.environ, **config},
+                stdout=subprocess.PIPE, stderr=log, text=True,
+            )
+        if completed.returncode != 0 or not completed.stdout.strip():
+            tail = log_path.read_text(encoding="utf-8", errors="replace")[-2000:]
+            return {"config": config, "error": f"exit code {completed.returncode}", "log": tail}
+        report = json.loads(completed.stdout.strip().splitlines()[-1])
+        report["config"] = config
+        return report
+
+
+def print_table(reports: List[dict], recommended) -> None:
+    header = (f"{'configuration':<42} {'top_k':>5} {'recall':>7} {'MRR':>6} {'p50 ms':>8} {'p99 ms':>8}"
+              f" {'build s':>8} {'size MB':>8} {'chunks':>7}")
+    print(header)
+    print("-" * len(header))
+    for report in reports:
+        label = _label(report["config"])
+        if "error" in report:
+            print(f"{label:<42} failed: {report['error']}")
+            continue
+        for row in report["results"]:
+            mark = "  <- recommended" if recommended == (label, row["top_k"]) else ""
+            print(f"{label:<42} {row['top_k']:>5} {row['recall']:>7.3f} {row['mrr']:>6.3f}"
+                  f" {row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f} {report['build_seconds']:>8.1f}"
+                  f" {report['index_bytes'] / 1e6:>8.1f} {report['chunks']:>7}{mark}")
+
+
+def cmd_generate(args: argparse.Namespace) -> int:
+    counts = generate_dataset(args.out, args.docs, args.seed)
+    print(f"{counts['documents']} documents in {args.out / 'corpus'}, "
+          f"{counts['questions']} questions in {args.out / 'questions.jsonl'}")
+    return 0
+
+
+def cmd_run(args: argparse.Namespace) -> int:
+    load_labels(args.data)
+    reports = []
+    for config in _configurations(args):
+        print(f"building {_label(config)}...", file=sys.stderr)
+        reports.append(run_configuration(config, args))
+
+    candidates = [
+        (row["p50_ms"], _label(report["config"]), row["top_k"])
+        for report in reports if "error" not in report
+        for row in report["results"] if row["recall"] >= args.min_recall
+    ]
+    recommended = min(candidates)[1:] if candidates else None
+    print_table(reports, recommended)
+    if recommended:
+        print(f"\nFastest configuration with recall@k >= {args.min_recall}: {recommended[0]}, top_k={recommended[1]}")
+    else:
+        print(f"\nNo configuration reached recall@k >= {args.min_recall}")
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    path = args.output / f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json"
+    path.write_text(json.dumps({
+        "data": str(args.data),
+        "min_recall": args.min_recall,
+        "recommended": {"configuration": recommended[0], "top_k": recommended[1]} if recommended else None,
+        "reports": reports,
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Saved {path}")
+    return 0 if all("error" not in report for report in reports) else 1
+
+
+def cmd_evaluate(args: argparse.Namespace) -> int:
+    print(json.dumps(evaluate_index(args.data, args.top_k, args.persist_dir), ensure_ascii=False))
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="синтетический корпус с размеченными вопросами")
+    generate.add_argument("--out", type=Path, required=True)
+    generate.add_argument("--docs", type=int, default=60,
+                          help=f"число документов, не больше {len(_DEPARTMENTS) * len(_TOPICS)}")
+    generate.add_argument("--seed", type=int, default=42)
+    generate.set_defaults(func=cmd_generate)
+
+    run = commands.add_parser("run", help="сборка индекса и замеры по матрице настроек")
+    run.add_argument("--data", type=Path, required=True, help="папка с corpus/ и questions.jsonl")
+    run.add_argument("--models", nargs="+", default=[EMBEDDING_MODEL])
+    run.add_argument("--embedding", nargs="+", default=["torch"], choices=["torch", "onnx", "onnx-int8"])
+    run.add_argument("--breakpoints", nargs="+", type=float, default=[SEMANTIC_SPLITTER_BREAKPOINT_PERCENTILE],
+                     help="перцентили порога семантического сплиттера")
+    run.add_argument("--buffer-sizes", nargs="+", type=int, default=[SEMANTIC_SPLITTER_BUFFER_SIZE])
+    run.add_argument("--top-k", nargs="+", type=int, default=[3, 5, 10])
+    run.add_argument("--min-recall", type=float, default=0.9)
+    run.add_argument("--output", type=Path, default=Path("retrieval_bench_results"))
+    run.set_defaults(func=cmd_run)
+
+    # Внутренняя команда: одна конфигурация в отдельном процессе
+    evaluate = commands.add_parser("_evaluate")
+    evaluate.add_argument("--data", type=Path, required=True)
+    evaluate.add_argument("--persist-dir", type=Path, required=True)
+    evaluate.add_argument("--top-k", nargs="+", type=int, required=True)
+    evaluate.set_defaults(func=cmd_evaluate)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
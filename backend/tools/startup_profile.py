@@ -0,0 +1,179 @@
+"""Профиль запуска бэкенда: время импорта app.py и время до открытия порта.
+
+Примеры (из папки backend):
+
+    python tools/startup_profile.py                   # разбор -X importtime для "import app"
+    python tools/startup_profile.py --serve           # + время до открытия порта uvicorn
+    python tools/startup_profile.py --serve --wait-ready --max-bind-ms 1000
+
+С бюджетами (--max-import-ms, --max-bind-ms) скрипт завершается с кодом 1,
+если запуск стал медленнее - так регрессии видны до сборки PyInstaller.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def profile_imports(module: str = "app") -> dict:
+    """Запускает "import module" с -X importtime и собирает время по модулям"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+
+    # Верхнеуровневые импорты: модули с минимальным отступом
+    top_level = [m for m in modules if m[3] == min((m[3] for m in modules), default=0)]
+    packages = defaultdict(int)
+    for name, self_us, _, _ in modules:
+        packages[name.split(".")[0]] += self_us
+
+    return {
+        "module": module,
+        "wall_ms": round(wall_ms, 1),
+        "import_ms": round(next((m[2] for m in modules if m[0] == module), 0) / 1000, 1),
+        "modules": len(modules),
+        "top_imports": [
+            {"module": name, "cumulative_ms": round(cum / 1000, 1)}
+            for name, _, cum, _ in sorted(top_level, key=lambda m: m[2], reverse=True)
+        ],
+        "by_package": [
+            {"package": name, "self_ms": round(us / 1000, 1)}
+            for name, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)
+        ],
+    }
+
+
+def _port_open(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.settimeout(0.05)
+        return sock.connect_ex(("127.0.0.1", port)) == 0
+
+
+def _get_status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def profile_serve(port: int, wait_ready: bool, timeout: float) -> dict:
+    """Время от запуска uvicorn до открытия порта и, опционально, до /ready"""
+    # Лог в файл, а не в pipe: фоновая загрузка может писать много и заблокировать процесс
+    log = tempfile.TemporaryFile(mode="w+")
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=log,
+        text=True,
+    )
+    report = {"port": port, "bind_ms": None, "ready_ms": None}
+    try:
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                log.seek(0)
+                raise RuntimeError(f"uvicorn exited:\n{log.read()[-2000:]}")
+            if _port_open(port):
+                report["bind_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                break
+            time.sleep(0.01)
+
+        while wait_ready and report["bind_ms"] is not None and time.perf_counter() < deadline:
+            if _get_status(f"http://127.0.0.1:{port}/ready") == 200:
+                report["ready_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                break
+            time.sleep(0.25)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+    return report
+
+
+def _print_report(report: dict, top: int) -> None:
+    imports = report["imports"]
+    print(f"import {imports['module']}: {imports['import_ms']} ms "
+          f"({imports['modules']} modules, process {imports['wall_ms']} ms)")
+    print("\nTop-level imports (cumulative):")
+    for item in imports["top_imports"][:top]:
+        print(f"  {item['cumulative_ms']:>9.1f} ms  {item['module']}")
+    print("\nBy package (self time):")
+    for item in imports["by_package"][:top]:
+        print(f"  {item['self_ms']:>9.1f} ms  {item['package']}")
+    serve = report.get("serve")
+    if serve:
+        print(f"\nPort {serve['port']} bound after: {serve['bind_ms']} ms")
+        if "ready_ms" in serve and serve["ready_ms"] is not None:
+            print(f"/ready returned 200 after: {serve['ready_ms']} ms")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--serve", action="store_true", help="замерить время до открытия порта")
+    parser.add_argument("--wait-ready", action="store_true", help="ждать 200 от /ready")
+    parser.add_argument("--port", type=int, default=int(os.getenv("STARTUP_PROFILE_PORT", "8765")))
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    parser.add_argument("--max-bind-ms", type=float, default=None)
+    parser.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    args = parser.parse_args()
+
+    report = {"imports": profile_imports(args.module)}
+    if args.serve:
+        report["serve"] = profile_serve(args.port, args.wait_ready, args.timeout)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_report(report, args.top)
+
+    failures = []
+    if args.max_import_ms is not None and report["imports"]["import_ms"] > args.max_import_ms:
+        failures.append(f"import took {report['imports']['import_ms']} ms > {args.max_import_ms} ms")
+    if args.max_bind_ms is not None and args.serve:
+        bind_ms = report["serve"]["bind_ms"]
+        if bind_ms is None or bind_ms > args.max_bind_ms:
+            failures.append(f"port bound after {bind_ms} ms > {args.max_bind_ms} ms")
+    for failure in failures:
+        print(f"BUDGET EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())